@@ -0,0 +1,24 @@
+import numpy as np
+
+# Roles known to the app. Admins can always read everything; chunks without an
+# "allowed_roles" field (uploaded before access tagging existed) are public.
+ROLES = ("Patient", "Staff", "Admin")
+ADMIN_ROLE = "Admin"
+
+
+def normalize_roles(allowed_roles):
+    """Canonical, sorted allowed-roles list stored in chunk metadata (Admin is always included)."""
+    return sorted(set(allowed_roles) | {ADMIN_ROLE})
+
+
+def can_read(metadata, role):
+    """True if a chunk with this metadata may be retrieved for `role` (None means unfiltered)."""
+    if role is None or role == ADMIN_ROLE:
+        return True
+    allowed = metadata.get("allowed_roles")
+    return not allowed or role in allowed
+
+
+def role_mask(metadatas, role):
+    """Boolean numpy mask over a sequence of chunk metadata: which positions `role` may read."""
+    return np.fromiter((can_read(m, role) for m in metadatas), dtype=bool)
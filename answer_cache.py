@@ -0,0 +1,144 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Configuration: Answer cache size, freshness and how close a paraphrase must be to reuse an answer
+# - At 0.95 questions about a different drug or dose still matched; 0.98 keeps true rewordings
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.98"))
+
+
+def normalize_query(query):
+    """Lowercases, drops punctuation and collapses whitespace so trivial variants share a key."""
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+def query_identifiers(query):
+    """Tokens with a digit in them (doses, form numbers, room numbers): these must match exactly."""
+    return frozenset(t for t in normalize_query(query).split() if any(c.isdigit() for c in t))
+
+
+class AnswerCache:
+    """
+    Two-tier answer cache for role_based_query:
+    1. Exact tier keyed by (role, normalized query, corpus version)
+    2. Semantic tier: cosine similarity of query embeddings above a threshold, only
+       between questions with the same numbers/identifiers ("200 mg" never serves "400 mg")
+
+    Entries are partitioned by role (a Staff answer is never served to a Patient),
+    expire after a TTL, are evicted LRU per role, and are all dropped as soon as
+    a different corpus version is seen.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                 similarity_threshold=ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._corpus_version = None
+        self._partitions = {}   # role -> OrderedDict(normalized query -> entry)
+        self._matrices = {}     # role -> (keys, stacked unit vectors, identifiers), rebuilt lazily
+        self._counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _check_version(self, corpus_version):
+        """Drops every entry when the corpus has changed since they were stored. Caller holds the lock."""
+        if corpus_version != self._corpus_version:
+            if self._partitions:
+                self._counters["invalidations"] += 1
+            self._partitions.clear()
+            self._matrices.clear()
+            self._corpus_version = corpus_version
+
+    def _live(self, role):
+        """Returns the role's partition with expired entries removed. Caller holds the lock."""
+        partition = self._partitions.setdefault(role, OrderedDict())
+        now = time.time()
+        expired = [key for key, entry in partition.items() if entry["expires"] <= now]
+        for key in expired:
+            del partition[key]
+        if expired:
+            self._matrices.pop(role, None)
+        return partition
+
+    def get_exact(self, role, query, corpus_version):
+        """Exact-tier lookup. Cheap: no embedding needed. Does not count a miss."""
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version(corpus_version)
+            partition = self._live(role)
+            entry = partition.get(key)
+            if entry is None:
+                return None
+            partition.move_to_end(key)
+            self._counters["exact_hits"] += 1
+            return entry["result"]
+
+    def get_similar(self, role, query, query_vector, corpus_version):
+        """Semantic-tier lookup; counts a miss if nothing is close enough."""
+        identifiers = query_identifiers(query)
+        with self._lock:
+            self._check_version(corpus_version)
+            partition = self._live(role)
+            if partition and query_vector is not None:
+                if role not in self._matrices:
+                    keys = list(partition)
+                    self._matrices[role] = (
+                        keys,
+                        np.stack([partition[k]["vector"] for k in keys]),
+                        [partition[k]["identifiers"] for k in keys],
+                    )
+                keys, matrix, entry_identifiers = self._matrices[role]
+                scores = matrix @ _unit(query_vector)
+                scores[[ids != identifiers for ids in entry_identifiers]] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    key = keys[best]
+                    partition.move_to_end(key)
+                    self._counters["semantic_hits"] += 1
+                    return partition[key]["result"]
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, role, query, corpus_version, result, query_vector):
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version(corpus_version)
+            partition = self._live(role)
+            partition[key] = {
+                "result": result,
+                "vector": _unit(query_vector),
+                "identifiers": query_identifiers(query),
+                "expires": time.time() + self.ttl_seconds,
+            }
+            partition.move_to_end(key)
+            while len(partition) > self.max_entries:
+                partition.popitem(last=False)
+                self._counters["evictions"] += 1
+            self._matrices.pop(role, None)
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+            self._matrices.clear()
+
+    def stats(self):
+        """Hit-rate metrics for the admin view."""
+        with self._lock:
+            c = dict(self._counters)
+            lookups = c["exact_hits"] + c["semantic_hits"] + c["misses"]
+            c["hit_rate"] = (c["exact_hits"] + c["semantic_hits"]) / lookups if lookups else 0.0
+            c["entries"] = sum(len(p) for p in self._partitions.values())
+            return c
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
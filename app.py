@@ -3,17 +3,25 @@ import os
 import time
 import re
 from database import * 
-from ingest import process_pdf
-from rag_pipeline import build_qa_chain, role_based_query
+from rag_pipeline import build_qa_chain, stream_role_based_query, answer_cache_stats, get_embeddings, refresh_conversation_summary
+import ingest_jobs
+from query_service import get_query_service
+import telemetry
 from style import apply_custom_css
 from dotenv import load_dotenv
-import random # Ensure this is at the top of your app.py
-from mailer import send_otp_email # Ensure mailer.py exists with your SMTP logic
+from mailer import send_otp_email, delivery_status, start_mail_worker # Ensure mailer.py exists with your SMTP logic
 
 load_dotenv()
 
 # --- INITIALIZATION ---
 init_db()
+# Prometheus scrape endpoint, only if TELEMETRY_PROMETHEUS_PORT is set (started once per process)
+telemetry.start_prometheus_server()
+# Background PDF indexing for this server process (started once, shared by all sessions;
+# skipped with INDEX_READ_ONLY=on, where a separate writer indexes the uploads)
+ingest_jobs.start_worker()
+# Background sender for queued emails (also resumes mail left over from a restart)
+start_mail_worker()
 
 st.set_page_config(page_title="Hospital AI Portal", page_icon="🏥", layout="wide")
 apply_custom_css()
@@ -25,13 +33,114 @@ if "page" not in st.session_state:
     st.session_state.page = "landing"
 if "current_session" not in st.session_state:
     st.session_state.current_session = None
+if "ingest_batch" not in st.session_state:
+    # Latest upload batch of this Admin session, and the last batch seen to finish
+    st.session_state.ingest_batch = None
+    st.session_state.ingest_batch_done = None
+if "show_performance" not in st.session_state:
+    st.session_state.show_performance = False
+if "history_cache" not in st.session_state:
+    # session_id -> {"messages": [...], "has_older": bool}; the tail of each open chat
+    st.session_state.history_cache = {}
+
+# Number of messages rendered per chat page
+HISTORY_WINDOW = 30
+
+# Client IP for the per-IP reset-code limit. Behind N reverse proxies / load balancers
+# (TRUSTED_PROXY_HOPS=N) it is the N-th X-Forwarded-For entry from the right, the one our
+# own outermost proxy appended; earlier entries are client-supplied. OTP_IP_LIMIT=off drops
+# the per-IP limit (the per-email limits still apply).
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+OTP_IP_LIMIT = os.getenv("OTP_IP_LIMIT", "on") == "on"
 
 # --- HELPERS ---
 def is_valid_email(email):
     return re.match(r"[^@]+@[^@]+\.[^@]+", email)
 
+def load_history_window(session_id):
+    """Returns the cached tail of a chat, reading only the newest window from SQLite on first use."""
+    cache = st.session_state.history_cache
+    if session_id not in cache:
+        # Fetch one extra row just to learn whether older messages exist
+        rows = get_chat_history(session_id, limit=HISTORY_WINDOW + 1)
+        cache[session_id] = {"messages": rows[-HISTORY_WINDOW:], "has_older": len(rows) > HISTORY_WINDOW}
+    return cache[session_id]
+
+def load_older_messages(session_id):
+    """Prepends the previous page of messages to the cached window."""
+    window = load_history_window(session_id)
+    before_id = window["messages"][0]["id"] if window["messages"] else None
+    rows = get_chat_history(session_id, before_id=before_id, limit=HISTORY_WINDOW + 1)
+    window["messages"] = rows[-HISTORY_WINDOW:] + window["messages"]
+    window["has_older"] = len(rows) > HISTORY_WINDOW
+
+def remember_message(session_id, user_email, role, content):
+    """Saves a message and appends it to the in-memory tail, so the next run needn't query SQLite."""
+    message_id = save_message(session_id, user_email, role, content)
+    window = load_history_window(session_id)
+    window["messages"].append({"id": message_id, "role": role, "content": content})
+    # Keep rendering bounded: a new message snaps the view back to the latest window
+    if len(window["messages"]) > HISTORY_WINDOW:
+        window["messages"] = window["messages"][-HISTORY_WINDOW:]
+        window["has_older"] = True
+
 # --- UI PAGES ---
 
+def ingest_progress():
+    """Status of the Admin's latest upload batch; polled as a fragment so only this block reruns."""
+    jobs = ingest_jobs.get_batch(st.session_state.ingest_batch)
+    for job in jobs:
+        if job["status"] == ingest_jobs.FAILED:
+            st.error(f"{job['filename']}: {job['error']}")
+        elif job["status"] == ingest_jobs.DONE:
+            seconds = sum(job["timings"].get(k, 0) for k in ("parse_ms", "index_ms")) / 1000
+            st.caption(f"✅ {job['filename']}: {job['chunks']} chunks in {seconds:.1f}s")
+        else:
+            total = job["progress_total"] or 1
+            st.progress(min(job["progress_done"] / total, 1.0), text=f"{job['filename']}: {job['stage']}")
+    finished = all(job["status"] in (ingest_jobs.DONE, ingest_jobs.FAILED) for job in jobs)
+    if finished and st.session_state.ingest_batch_done != st.session_state.ingest_batch:
+        # Batch finished: one full rerun picks up the new index and stops the polling
+        st.session_state.ingest_batch_done = st.session_state.ingest_batch
+        st.rerun(scope="app")
+
+def performance_dashboard():
+    """Admin-only latency and cache overview of this server process."""
+    st.title("📊 Performance")
+    if not telemetry.TELEMETRY_ENABLED:
+        st.info("Telemetry is off (TELEMETRY=off); only cache counters are shown.")
+
+    data = telemetry.summary()
+    if data["spans"]:
+        st.subheader("Latency by stage (ms)")
+        st.dataframe(
+            [
+                {"stage": name, "count": s["count"], "mean": round(s["mean"], 1),
+                 "p50": round(s["p50"], 1), "p95": round(s["p95"], 1), "p99": round(s["p99"], 1)}
+                for name, s in data["spans"].items()
+            ],
+            use_container_width=True, hide_index=True,
+        )
+    else:
+        st.caption("No requests recorded yet.")
+
+    answers, embeddings, queries = answer_cache_stats(), get_embeddings().stats(), get_query_service().stats()
+    cols = st.columns(4)
+    cols[0].metric("Answer cache hit rate", f"{answers['hit_rate']:.0%}")
+    cols[1].metric("Embedding cache hit rate", f"{embeddings['hit_rate']:.0%}")
+    cols[2].metric("LLM calls", queries["leaders"])
+    cols[3].metric("Coalesced questions", queries["coalesced"])
+
+    if data["counters"]:
+        st.subheader("Counters")
+        st.dataframe(
+            [{"counter": name, "total": value} for name, value in sorted(data["counters"].items())],
+            use_container_width=True, hide_index=True,
+        )
+    if st.button("Reset latency samples"):
+        telemetry.reset()
+        st.rerun()
+
 def landing_page():
     st.markdown("""
         <div class='hero-section'>
@@ -54,10 +163,69 @@ def landing_page():
             st.session_state.page = "auth"
             st.rerun()
 
-import time
-import random
-import streamlit as st
-from mailer import send_otp_email
+def otp_delivery_caption():
+    """Tells the user whether the queued reset email has actually gone out."""
+    status = delivery_status(st.session_state.otp_message_id) if st.session_state.otp_message_id else None
+    if status is None:
+        return
+    if status["status"] == "sent":
+        st.caption("📬 Email delivered to the mail server.")
+    elif status["status"] == "failed":
+        st.error(f"Email could not be delivered: {status['last_error']}")
+    elif status["attempts"]:
+        st.caption(f"⏳ Email delayed, retrying (attempt {status['attempts'] + 1})...")
+    else:
+        st.caption("⏳ Sending email...")
+    if status["status"] in ("sent", "failed") and not st.session_state.otp_delivery_done:
+        # Final state reached: one full rerun renders it without the polling fragment
+        st.session_state.otp_delivery_done = True
+        st.rerun(scope="app")
+
+def resend_countdown(seconds):
+    """Counts down the resend cooldown in the browser, so waiting costs the server no reruns."""
+    st.iframe(f"""
+        <div id="countdown" style="font-family: sans-serif; font-size: 14px; color: #808495;"></div>
+        <script>
+            let left = {int(seconds + 0.999)};
+            const el = document.getElementById("countdown");
+            function tick() {{
+                el.textContent = left > 0
+                    ? `⏳ You can request a new code in ${{left}}s.`
+                    : "You can request a new code now.";
+                if (left-- > 0) setTimeout(tick, 1000);
+            }}
+            tick();
+        </script>
+    """, height=28)
+
+def client_ip():
+    """The client IP to rate-limit by, or None (no per-IP limit) if it can't be told apart from a proxy's."""
+    if not OTP_IP_LIMIT:
+        return None
+    if TRUSTED_PROXY_HOPS <= 0:
+        return st.context.ip_address
+    forwarded = [ip.strip() for ip in (st.context.headers.get("X-Forwarded-For") or "").split(",") if ip.strip()]
+    return forwarded[-TRUSTED_PROXY_HOPS] if len(forwarded) >= TRUSTED_PROXY_HOPS else None
+
+def request_otp(email):
+    """
+    Issues a reset code through the shared store and queues its email. The store
+    enforces the cooldown and rate limits; on refusal the countdown shows the wait.
+    """
+    code, wait = issue_otp(email, client_ip())
+    if code is None:
+        st.session_state.otp_retry_at = time.time() + wait
+        return False
+    # Only queues the email; the background sender delivers it. The outbox drops the
+    # code's plaintext once sent, failed or expired.
+    message_id = send_otp_email(email, code, expires_at=time.time() + OTP_TTL_SECONDS)
+    if not message_id:
+        st.error("Failed to send email. Check .env settings.")
+        return False
+    st.session_state.otp_message_id = message_id
+    st.session_state.otp_delivery_done = False
+    st.session_state.otp_retry_at = time.time() + OTP_RESEND_SECONDS
+    return True
 
 def auth_page():
     """Handles User Login, Registration, and Secure OTP Password Reset with Rate Limiting."""
@@ -94,63 +262,56 @@ def auth_page():
 
             # --- SECURE OTP PASSWORD RESET WITH TIMER ---
             with st.expander("Forgot Password?"):
-                # Initialize session states
+                # Initialize session states (the code itself lives only in the database)
                 if "otp_sent" not in st.session_state: st.session_state.otp_sent = False
-                if "generated_otp" not in st.session_state: st.session_state.generated_otp = None
                 if "reset_target_email" not in st.session_state: st.session_state.reset_target_email = None
-                if "last_otp_time" not in st.session_state: st.session_state.last_otp_time = 0
-                
-                cooldown = 60  # Cooldown period in seconds
+                if "otp_retry_at" not in st.session_state: st.session_state.otp_retry_at = 0
+                if "otp_message_id" not in st.session_state: st.session_state.otp_message_id = None
+                if "otp_delivery_done" not in st.session_state: st.session_state.otp_delivery_done = False
 
                 # STEP 1: Request Email & Send OTP
                 if not st.session_state.otp_sent:
                     st.caption("Step 1: Verify your registered email.")
                     email_to_verify = st.text_input("Enter Email", key="otp_email")
-                    
-                    elapsed = time.time() - st.session_state.last_otp_time
-                    wait_time = int(cooldown - elapsed)
 
+                    if st.button("Send Verification Code", use_container_width=True):
+                        if user_exists(email_to_verify):
+                            if request_otp(email_to_verify):
+                                st.session_state.reset_target_email = email_to_verify
+                                st.session_state.otp_sent = True
+                                st.success(f"📩 Code sent to {email_to_verify}!")
+                                st.rerun()
+                        else:
+                            st.error("❌ This email is not registered.")
+
+                    wait_time = st.session_state.otp_retry_at - time.time()
                     if wait_time > 0:
-                        st.button(f"⏳ Resend Code in {wait_time}s", disabled=True, use_container_width=True)
-                        time.sleep(1)
-                        st.rerun()
-                    else:
-                        if st.button("Send Verification Code", use_container_width=True):
-                            if user_exists(email_to_verify):
-                                otp = random.randint(100000, 999999)
-                                with st.spinner("Sending email..."):
-                                    if send_otp_email(email_to_verify, otp):
-                                        st.session_state.generated_otp = otp
-                                        st.session_state.reset_target_email = email_to_verify
-                                        st.session_state.otp_sent = True
-                                        st.session_state.last_otp_time = time.time()
-                                        st.success(f"📩 Code sent to {email_to_verify}!")
-                                        st.rerun()
-                                    else:
-                                        st.error("Failed to send email. Check .env settings.")
-                            else:
-                                st.error("❌ This email is not registered.")
+                        resend_countdown(wait_time)
 
                 # STEP 2: Verify OTP & Update Password
                 else:
                     st.caption(f"Step 2: Enter the code sent to {st.session_state.reset_target_email}")
+                    # Polls the outbox only until the email has gone out (or failed)
+                    if st.session_state.otp_delivery_done:
+                        otp_delivery_caption()
+                    else:
+                        st.fragment(otp_delivery_caption, run_every=2)()
                     user_otp = st.text_input("Enter 6-Digit Code", key="user_otp")
                     new_reset_pwd = st.text_input("New Password", type="password", key="new_reset_pwd")
                     
                     c1, c2 = st.columns(2)
                     if c1.button("Verify & Reset", use_container_width=True):
-                        if str(user_otp) == str(st.session_state.generated_otp):
-                            if len(new_reset_pwd) >= 6:
-                                if reset_user_password(st.session_state.reset_target_email, new_reset_pwd):
-                                    st.success("✅ Password reset! Please login.")
-                                    st.session_state.otp_sent = False 
-                                    st.session_state.generated_otp = None
-                                else:
-                                    st.error("Database update failed.")
+                        # Check the password first: a correct code is used up when verified
+                        if len(new_reset_pwd) < 6:
+                            st.error("Password must be at least 6 characters.")
+                        elif verify_otp(st.session_state.reset_target_email, user_otp):
+                            if reset_user_password(st.session_state.reset_target_email, new_reset_pwd):
+                                st.success("✅ Password reset! Please login.")
+                                st.session_state.otp_sent = False 
                             else:
-                                st.error("Password must be at least 6 characters.")
+                                st.error("Database update failed.")
                         else:
-                            st.error("❌ Invalid verification code.")
+                            st.error("❌ Invalid or expired verification code.")
                     
                     if c2.button("Cancel", use_container_width=True):
                         st.session_state.otp_sent = False
@@ -158,19 +319,14 @@ def auth_page():
 
                     # RESEND LOGIC INSIDE STEP 2
                     st.divider()
-                    elapsed_step2 = time.time() - st.session_state.last_otp_time
-                    wait_step2 = int(cooldown - elapsed_step2)
+                    if st.button("📩 Resend Verification Code", key="resend_inner", use_container_width=True):
+                        if request_otp(st.session_state.reset_target_email):
+                            st.toast("New code sent!", icon="📧")
+                            st.rerun()
 
+                    wait_step2 = st.session_state.otp_retry_at - time.time()
                     if wait_step2 > 0:
-                        st.caption(f"Didn't get the code? You can resend in {wait_step2} seconds.")
-                    else:
-                        if st.button("📩 Resend Verification Code", key="resend_inner", use_container_width=True):
-                            otp = random.randint(100000, 999999)
-                            if send_otp_email(st.session_state.reset_target_email, otp):
-                                st.session_state.generated_otp = otp
-                                st.session_state.last_otp_time = time.time()
-                                st.toast("New code sent!", icon="📧")
-                                st.rerun()
+                        resend_countdown(wait_step2)
 
         # --- SIGNUP TAB ---
         with tab_signup:
@@ -216,6 +372,7 @@ def admin_setup_tool():
 
 admin_setup_tool()
 
+@telemetry.traced("app.main_app")
 def main_app():
     role = st.session_state.user_role
     user = st.session_state.username
@@ -230,17 +387,19 @@ def main_app():
             st.rerun()
         
         st.write("📂 **Recent Chats**")
-        sessions = get_user_sessions(user)
+        sessions = list_sessions(user)
         
-        for s_id in sessions:
+        for session in sessions:
+            s_id = session["id"]
             cols = st.columns([0.8, 0.2])
             is_active = "▶️ " if s_id == st.session_state.current_session else "💬 "
-            if cols[0].button(f"{is_active}{s_id}", key=f"btn_{s_id}", use_container_width=True):
+            if cols[0].button(f"{is_active}{session['title'] or s_id}", key=f"btn_{s_id}", use_container_width=True):
                 st.session_state.current_session = s_id
                 st.rerun()
             
             if cols[1].button("🗑️", key=f"del_{s_id}"):
                 delete_session(s_id)
+                st.session_state.history_cache.pop(s_id, None)
                 # Corrected logic to reset current session if deleted
                 if st.session_state.current_session == s_id:
                     remaining = get_user_sessions(user)
@@ -251,50 +410,88 @@ def main_app():
             st.divider()
             if st.button("🧨 Clear All History", use_container_width=True):
                 clear_chat_history(user) # Corrected: matches user_email in database.py
+                st.session_state.history_cache = {}
                 st.session_state.current_session = create_new_session(user)
                 st.rerun()
 
         if role == "Admin":
             st.divider()
             st.subheader("⚙️ Admin: Indexing")
-            file = st.file_uploader("Upload Hospital PDF", type="pdf")
-            if file and st.button("Index Knowledge"):
-                with st.status("Processing PDF...") as status:
+            files = st.file_uploader("Upload Hospital PDFs", type="pdf", accept_multiple_files=True)
+            # Admins can always read everything; this only picks who else may retrieve it
+            readers = st.multiselect("Who can read these documents?", ["Patient", "Staff"], default=["Patient", "Staff"])
+            if files and st.button("Index Knowledge"):
+                if not os.path.exists("data"): os.makedirs("data")
+                paths = []
+                for file in files:
                     path = os.path.join("data", file.name)
-                    if not os.path.exists("data"): os.makedirs("data")
                     with open(path, "wb") as f: f.write(file.getbuffer())
-                    process_pdf(path)
-                    st.cache_resource.clear()
-                    status.update(label="Index Complete!", state="complete")
+                    paths.append(path)
+                # Indexing runs in the background worker; everyone keeps the live index until it is swapped
+                st.session_state.ingest_batch = ingest_jobs.enqueue_batch(paths, allowed_roles=readers)
+
+            batch = st.session_state.ingest_batch
+            if batch:
+                polling = st.session_state.ingest_batch_done != batch
+                st.fragment(ingest_progress, run_every=1.0 if polling else None)()
+
+            cache = answer_cache_stats()
+            st.caption(
+                f"Answer cache: {cache['hit_rate']:.0%} hit rate "
+                f"({cache['exact_hits']} exact, {cache['semantic_hits']} similar, {cache['misses']} misses)"
+            )
+            label = "💬 Back to Chat" if st.session_state.show_performance else "📊 Performance"
+            if st.button(label, use_container_width=True):
+                st.session_state.show_performance = not st.session_state.show_performance
+                st.rerun()
 
         st.divider()
         if st.button("🚪 Logout", use_container_width=True):
             st.session_state.logged_in = False
+            st.session_state.show_performance = False
+            st.session_state.history_cache = {}
             st.session_state.page = "landing"
             st.rerun()
 
+    if role == "Admin" and st.session_state.show_performance:
+        performance_dashboard()
+        return
+
     # --- MAIN CHAT ---
     st.title(f"🩺 Knowledge Assistant")
     st.caption(f"Active Session: {st.session_state.current_session}")
     
     qa_chain = build_qa_chain()
-    history = get_chat_history(st.session_state.current_session)
-    for msg in history:
+    session_id = st.session_state.current_session
+    window = load_history_window(session_id)
+    if window["has_older"]:
+        if st.button("⬆️ Load older messages", key=f"older_{session_id}"):
+            load_older_messages(session_id)
+            st.rerun()
+    for msg in window["messages"]:
         with st.chat_message(msg["role"]):
             st.write(msg["content"])
 
     if query := st.chat_input("Ask a question..."):
         with st.chat_message("user"):
             st.write(query)
-        save_message(st.session_state.current_session, user, "user", query)
-
-        with st.chat_message("assistant"):
-            with st.spinner("Analyzing documents..."):
-                res = role_based_query(qa_chain, query, role)
-                ans = res["result"]
-                st.write(ans)
-                save_message(st.session_state.current_session, user, "assistant", ans)
-                st.rerun()
+        remember_message(session_id, user, "user", query)
+
+        with st.chat_message("assistant"), telemetry.span("app.answer", role=role):
+            final = {}
+            def answer_tokens():
+                # Text parts are rendered as they arrive; the closing dict carries the full result
+                for part in stream_role_based_query(qa_chain, query, role, session_id):
+                    if isinstance(part, dict):
+                        final.update(part)
+                    else:
+                        yield part
+
+            ans = st.write_stream(answer_tokens())
+            # Persist once, after the stream completes; no rerun needed to show it
+            remember_message(session_id, user, "assistant", final.get("result", ans))
+        # Summarizing older turns is left until the answer is on screen
+        refresh_conversation_summary(qa_chain, session_id)
 
 if st.session_state.logged_in:
     main_app()
@@ -0,0 +1,94 @@
+"""
+Compares the FAISS index backends in index_store (Flat, IVF-Flat, HNSW, IVF-PQ) on
+synthetic clustered embeddings: build time, recall@k against exact Flat search,
+single-query p50/p99 latency, on-disk index size and resident memory growth.
+
+    python benchmarks/bench_ann_index.py --sizes 10000 100000
+    python benchmarks/bench_ann_index.py --sizes 1000000 --dim 128 --backends flat ivfpq
+    FAISS_NPROBE=32 FAISS_EF_SEARCH=128 python benchmarks/bench_ann_index.py
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import index_store
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def synthetic_embeddings(n, dim, n_queries, rng, n_clusters=1000):
+    """Gaussian clusters, roughly how chunk embeddings of related policies group together."""
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100000):
+        end = min(n, start + 100000)
+        labels = rng.integers(0, n_clusters, end - start)
+        vectors[start:end] = centers[labels] + 0.3 * rng.standard_normal((end - start, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n_queries)
+    queries = centers[labels] + 0.3 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    return vectors, queries
+
+
+def run(n, dim, backends, n_queries, k, rng):
+    vectors, queries = synthetic_embeddings(n, dim, n_queries, rng)
+    exact = None
+    print(f"\n{n} vectors x {dim} dims, k={k}, nprobe={index_store.FAISS_NPROBE}, "
+          f"efSearch={index_store.FAISS_EF_SEARCH}")
+    print(f"{'backend':<8}{'build s':>9}{'recall@k':>10}{'p50 ms':>9}{'p99 ms':>9}{'disk MB':>9}{'RSS +MB':>9}")
+    for kind in backends:
+        gc.collect()
+        before = rss_mb()
+        start = time.perf_counter()
+        index = index_store.new_index(kind, vectors)
+        build = time.perf_counter() - start
+        grown = rss_mb() - before
+
+        params = index_store.search_params(index)
+        timings, results = [], []
+        for q in queries:
+            start = time.perf_counter()
+            _, ids = index.search(q[None], k, params=params)
+            timings.append((time.perf_counter() - start) * 1000)
+            results.append(ids[0])
+        if kind == "flat":
+            exact = results
+        recall = np.mean([len(set(r) & set(e)) / k for r, e in zip(results, exact)]) if exact else float("nan")
+
+        with tempfile.NamedTemporaryFile(suffix=".faiss") as f:
+            faiss.write_index(index, f.name)
+            disk_mb = os.path.getsize(f.name) / 2**20
+        print(f"{kind:<8}{build:>9.1f}{recall:>10.3f}{np.percentile(timings, 50):>9.3f}"
+              f"{np.percentile(timings, 99):>9.3f}{disk_mb:>9.1f}{grown:>9.0f}")
+        del index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS index backend benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--backends", nargs="+", default=["flat", "ivf", "hnsw", "ivfpq"],
+                        help="flat must come first: it provides the exact results recall is measured against")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)  # one query at a time, as a chat request would issue it
+    rng = np.random.default_rng(0)
+    for n in args.sizes:
+        run(n, args.dim, args.backends, args.queries, args.k, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmarks the sidebar and history queries on a chat_history table with 1M rows,
+before (no indexes, SELECT DISTINCT over chat_history) and after database.init_db()
+migrates it (composite indexes + sessions table).
+
+    python benchmarks/bench_chat_history_schema.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+LEGACY_SCHEMA = """
+    CREATE TABLE chat_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT,
+        user_email TEXT,
+        role TEXT,
+        content TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def populate(db_name, rows, users, messages_per_session):
+    """Builds an un-migrated (version 0) database with `rows` messages."""
+    conn = sqlite3.connect(db_name)
+    conn.execute(LEGACY_SCHEMA)
+    conn.execute("CREATE TABLE users (email TEXT PRIMARY KEY, password TEXT, role TEXT)")
+    sessions = max(1, rows // messages_per_session)
+
+    def generate():
+        for i in range(rows):
+            s = i // messages_per_session
+            u = random.Random(s).randrange(users)
+            yield (f"s{s:07d}", f"user{u}@example.com", "user" if i % 2 == 0 else "assistant",
+                   f"message {i}", f"2026-01-01 00:00:{i % 60:02d}")
+
+    conn.executemany(
+        "INSERT INTO chat_history (session_id, user_email, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+        generate(),
+    )
+    conn.commit()
+    conn.close()
+    return sessions
+
+
+def timed(label, fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    ms = (time.perf_counter() - start) / repeat * 1000
+    print(f"  {label:<38} {ms:9.3f} ms/query")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="chat_history schema benchmark")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--messages-per-session", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    database.DB_NAME = os.path.join(tempfile.mkdtemp(prefix="bench_schema_"), "chat.db")
+    start = time.perf_counter()
+    sessions = populate(database.DB_NAME, args.rows, args.users, args.messages_per_session)
+    print(f"populated {args.rows} rows / {sessions} sessions in {time.perf_counter() - start:.1f}s")
+
+    user = "user7@example.com"
+    session = "s0000042"
+    legacy = sqlite3.connect(database.DB_NAME)
+
+    print("before (no indexes):")
+    timed("sidebar: SELECT DISTINCT session_id", lambda: legacy.execute(
+        "SELECT DISTINCT session_id FROM chat_history WHERE user_email = ? ORDER BY timestamp DESC",
+        (user,)).fetchall(), args.repeat)
+    timed("history: WHERE session_id = ?", lambda: legacy.execute(
+        "SELECT role, content FROM chat_history WHERE session_id = ? ORDER BY timestamp ASC",
+        (session,)).fetchall(), args.repeat)
+    legacy.close()
+
+    start = time.perf_counter()
+    database.init_db()
+    print(f"migration to schema v{len(database.MIGRATIONS)}: {time.perf_counter() - start:.1f}s")
+
+    print("after (indexes + sessions table):")
+    timed("sidebar: get_user_sessions()", lambda: database.get_user_sessions(user), args.repeat)
+    timed("history: get_chat_history()", lambda: database.get_chat_history(session), args.repeat)
+    timed("write: save_message()", lambda: database.save_message(session, user, "user", "hi"), args.repeat)
+
+    with database.connection() as conn:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM sessions WHERE user_email = ? ORDER BY last_active DESC",
+            (user,)).fetchall()
+    print("sidebar query plan:", "; ".join(row[-1] for row in plan))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Prompt context before and after packing: generated policy PDFs are ingested and indexed
+(offline hashing embedder), then questions built from their lines go through the real
+retrieval path (hybrid search, rerank, pack_context). For each question the top-3 raw
+chunks the "stuff" chain used to paste in are compared with the packed context at each
+token budget: whitespace compressed, overlapping neighbours of the same page merged,
+duplicates dropped, and passages taken from the reranked pool until the budget is spent.
+"Covered" is the share of questions whose quoted lines appear in the context.
+
+    python benchmarks/bench_context_packing.py --pages 20 --queries 200 --budgets 750 1500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_hybrid_recall import HashingEmbeddings, percentile
+from pdf_fixtures import page_lines, write_text_pdf
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Context packing benchmark")
+    parser.add_argument("--pdfs", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=20, help="pages per PDF")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[750, 1500], help="context token budgets")
+    args = parser.parse_args()
+
+    os.environ["EMBEDDINGS_PROVIDER"] = "fake"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")  # the chat client is built but never called
+    os.chdir(tempfile.mkdtemp(prefix="bench_packing_"))
+    import context_packer
+    import ingest
+    import rag_pipeline
+    import reranker
+    from token_utils import count_tokens
+
+    rag_pipeline._embeddings = HashingEmbeddings()
+    for seed in range(args.pdfs):
+        path = f"policy_{seed}.pdf"
+        write_text_pdf(path, args.pages, seed=seed)
+        ingest.process_pdf(path, workers=1)
+    qa_chain = rag_pipeline.build_qa_chain()
+
+    # Questions quote two consecutive lines, so their neighbouring chunks are relevant too
+    rng = random.Random(0)
+    questions = []
+    for _ in range(args.queries):
+        seed, page = rng.randrange(args.pdfs), rng.randrange(args.pages)
+        lines = page_lines(page, seed=seed)
+        i = rng.randrange(1, len(lines) - 1)
+        questions.append("\n".join(lines[i:i + 2]))
+
+    print(f"{args.pdfs} PDFs x {args.pages} pages, {args.queries} questions")
+    print(f"{'context':<22}{'tokens':>8}{'chunks':>8}{'passages':>10}{'saved':>7}{'covered':>9}{'pack p50 ms':>13}")
+
+    def covered(question, docs):
+        text = "\n".join(context_packer.compress_text(d.page_content) for d in docs)
+        return all(context_packer.compress_text(line) in text for line in question.split("\n"))
+
+    # Before: the three best chunks, pasted in as they are
+    tokens, hits = [], []
+    for question in questions:
+        candidates = qa_chain.retriever.for_role("Staff").invoke(question)
+        docs = reranker.rerank(question, candidates, top_k=3)
+        tokens.append(sum(count_tokens(d.page_content) for d in docs))
+        hits.append(covered(question, docs))
+    print(f"{'top-3 chunks, raw':<22}{statistics.mean(tokens):>8.0f}{3:>8}{3:>10}{'-':>7}"
+          f"{statistics.mean(hits):>9.0%}{'-':>13}")
+
+    for budget in args.budgets:
+        context_packer.ROLE_CONTEXT_MAX_TOKENS["Staff"] = budget
+        packed, raw, chunks, passages, hits, pack_ms = [], [], [], [], [], []
+        for question in questions:
+            timings = {}
+            docs = rag_pipeline._retrieve(qa_chain, question, "Staff", timings)
+            assert timings["context_tokens"] <= budget
+            packed.append(timings["context_tokens"])
+            raw.append(timings["context_raw_tokens"])
+            chunks.append(timings["context_chunks"])
+            passages.append(len(docs))
+            hits.append(covered(question, docs))
+            pack_ms.append(timings["pack_ms"])
+        saved = 1 - sum(packed) / sum(raw)
+        print(f"{f'packed to {budget}':<22}{statistics.mean(packed):>8.0f}{statistics.mean(chunks):>8.1f}"
+              f"{statistics.mean(passages):>10.1f}{saved:>7.0%}{statistics.mean(hits):>9.0%}"
+              f"{percentile(pack_ms, 0.5):>13.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Hammers database.save_message from N threads and reports throughput and lock errors,
+before (a fresh rollback-journal connection per call, as database.py used to do)
+and after (pooled WAL connections with a busy timeout). Then runs many short-lived
+threads one chat turn each, as Streamlit reruns do, and counts the connections opened.
+
+    python benchmarks/bench_db_concurrency.py --threads 16 --messages 500 --reruns 1000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+def legacy_save_message(db_name, session_id, user_email, role, content, timeout):
+    """The pre-pooling implementation: connect, insert, commit, close."""
+    conn = sqlite3.connect(db_name, timeout=timeout)
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO chat_history (session_id, user_email, role, content)
+        VALUES (?, ?, ?, ?)
+    """, (session_id, user_email, role, content))
+    conn.commit()
+    conn.close()
+
+
+def hammer(label, save, threads, messages):
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n):
+        for i in range(messages):
+            try:
+                save(f"s{n}", f"user{n}@example.com", "user", f"message {i} from thread {n}")
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total = threads * messages
+    locked = sum("locked" in e for e in errors)
+    print(f"{label:<28} {total / elapsed:9.0f} msg/s  {elapsed:6.2f}s  "
+          f"errors={len(errors)} (database is locked: {locked})")
+
+
+def reruns(count, concurrency):
+    """Each rerun is a new thread (as in Streamlit) that reads the history and saves a message."""
+    opened = []
+    open_connection = database._open_connection
+    database._open_connection = lambda: opened.append(1) or open_connection()
+
+    def rerun(n):
+        database.get_chat_history(f"s{n % concurrency}", limit=31)
+        database.save_message(f"s{n % concurrency}", "rerun@example.com", "user", f"rerun {n}")
+
+    start = time.perf_counter()
+    for first in range(0, count, concurrency):
+        batch = [threading.Thread(target=rerun, args=(n,)) for n in range(first, min(first + concurrency, count))]
+        for t in batch:
+            t.start()
+        for t in batch:
+            t.join()
+    elapsed = time.perf_counter() - start
+    database._open_connection = open_connection
+    print(f"{'reruns (thread per rerun)':<28} {count / elapsed:9.0f} rerun/s  {elapsed:6.2f}s  "
+          f"connections opened={len(opened)} for {count} threads "
+          f"(idle in pool: {database._pool.qsize()}, cap {database.POOL_SIZE})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite concurrency benchmark")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--messages", type=int, default=300, help="messages per thread")
+    parser.add_argument("--legacy-timeout", type=float, default=5.0,
+                        help="sqlite3.connect timeout used by the old code path (its default)")
+    parser.add_argument("--reruns", type=int, default=1000, help="short-lived threads, one chat turn each")
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="bench_db_")
+
+    # Before: separate file, so it keeps SQLite's default rollback journal
+    database.DB_NAME = os.path.join(workdir, "before.db")
+    database.init_db()
+    database.close_connections()
+    with sqlite3.connect(database.DB_NAME) as conn:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    hammer(
+        "before (connect per call)",
+        lambda *a: legacy_save_message(database.DB_NAME, *a, timeout=args.legacy_timeout),
+        args.threads, args.messages,
+    )
+
+    # After: pooled WAL connections
+    database.DB_NAME = os.path.join(workdir, "after.db")
+    database.init_db()
+    hammer("after (pooled WAL)", database.save_message, args.threads, args.messages)
+    reruns(args.reruns, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmarks embedding_pipeline.embed_texts against the local stub embeddings server.
+
+Compares one serial client call (what FAISS.from_documents does) with the batched,
+concurrent, rate-limited pipeline at several worker counts, while the stub injects
+latency and 429s.
+
+    python benchmarks/bench_embedding_pipeline.py --chunks 2000 --latency-ms 150 --error-rate 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_openai import OpenAIEmbeddings
+
+from embedding_pipeline import TokenBucket, embed_texts
+from stub_openai_server import start_server
+
+
+def make_client(base_url, batch_size):
+    # No client-side retries: 429 handling is what is being measured
+    return OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        base_url=base_url,
+        api_key="stub",
+        max_retries=0,
+        chunk_size=batch_size,
+        check_embedding_ctx_length=False,
+    )
+
+
+def run(label, fn, n_texts):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.2f}s  {n_texts / elapsed:9.1f} chunks/s  {result}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding pipeline benchmark")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--max-rps", type=int, default=40)
+    parser.add_argument("--rps-limit", type=float, default=30, help="client token-bucket rate")
+    args = parser.parse_args()
+
+    server, state = start_server(0, args.latency_ms, args.error_rate, args.max_rps)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    texts = [f"Hospital policy chunk {i}: visiting hours, parking and discharge." for i in range(args.chunks)]
+    print(f"{args.chunks} chunks, batch {args.batch_size}, stub latency {args.latency_ms}ms, "
+          f"error rate {args.error_rate}, server limit {args.max_rps} rps")
+
+    def serial():
+        # Mirrors the old path: one client call, client-side batching, no 429 handling
+        client = make_client(base_url, args.batch_size)
+        try:
+            client.embed_documents(texts)
+            return "ok"
+        except Exception as e:
+            return f"failed: {type(e).__name__}"
+
+    run("serial (client batching)", serial, args.chunks)
+
+    for workers in args.workers:
+        def pipeline():
+            stats = {}
+            embed_texts(
+                make_client(base_url, args.batch_size), texts,
+                batch_size=args.batch_size, max_workers=workers,
+                rate_limiter=TokenBucket(args.rps_limit), stats=stats,
+            )
+            return f"batches={stats['batches']} retries={stats['retries']}"
+        run(f"pipeline workers={workers}", pipeline, args.chunks)
+
+    print(f"stub served {state.requests} requests, rejected {state.rejected}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmarks role-filtered FAISS search: IDSelectorBitmap filtering inside the scan vs. a
+per-role partition index vs. the old approach of searching everything and dropping
+chunks the role may not read afterwards.
+
+    python benchmarks/bench_filtered_search.py --sizes 10000 100000 --restricted 0.3 0.9
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import faiss
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def timed(fn, queries, repeats):
+    timings = []
+    results = None
+    for _ in range(repeats):
+        for q in queries:
+            start = time.perf_counter()
+            results = fn(q)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), results
+
+
+def run(n, dim, restricted, n_queries, k, repeats, rng):
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    queries = rng.standard_normal((n_queries, dim)).astype(np.float32)
+    allowed = rng.random(n) >= restricted  # what a Patient may read
+    allowed_ids = np.flatnonzero(allowed)
+
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    bitmap = np.packbits(allowed, bitorder="little")
+    params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(bitmap))
+
+    partition = faiss.IndexFlatL2(dim)
+    partition.add(vectors[allowed_ids])
+
+    def post_filter(q):
+        _, ids = index.search(q[None], k)
+        return [i for i in ids[0] if i >= 0 and allowed[i]]
+
+    def bitmap_filter(q):
+        _, ids = index.search(q[None], k, params=params)
+        return [i for i in ids[0] if i >= 0]
+
+    def partitioned(q):
+        _, ids = partition.search(q[None], k)
+        return [allowed_ids[i] for i in ids[0] if i >= 0]
+
+    print(f"\n{n} vectors x {dim} dims, {restricted:.0%} restricted from the role, k={k}")
+    print(f"{'strategy':<28}{'p50 ms':>10}{'usable results':>16}")
+    for name, fn in (
+        ("unfiltered + post-filter", post_filter),
+        ("IDSelectorBitmap", bitmap_filter),
+        ("per-role partition", partitioned),
+    ):
+        ms, _ = timed(fn, queries, repeats)
+        usable = statistics.mean(len(fn(q)) for q in queries)
+        print(f"{name:<28}{ms:>10.3f}{usable:>13.2f}/{k}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Role-filtered FAISS search benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--restricted", type=float, nargs="+", default=[0.3, 0.9],
+                        help="share of chunks the querying role may not read")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)  # one query per request, as in the app
+    rng = np.random.default_rng(0)
+    for n in args.sizes:
+        for restricted in args.restricted:
+            run(n, args.dim, restricted, args.queries, args.k, args.repeats, rng)
+
+
+if __name__ == "__main__":
+    main()
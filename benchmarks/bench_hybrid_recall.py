@@ -0,0 +1,199 @@
+"""
+Offline recall@k and latency benchmark for hybrid (FAISS + BM25) retrieval.
+
+Synthetic mode builds a corpus of policy-like chunks, each carrying an exact identifier
+(form number, ward code or drug name), and asks one labeled question per target chunk:
+
+    python benchmarks/bench_hybrid_recall.py --chunks 100000 --queries 500
+
+Labeled mode evaluates the real corpus in the current directory (chunks.db / faiss_index)
+against a JSONL file of {"query": ..., "source": ..., "page": ...} lines:
+
+    python benchmarks/bench_hybrid_recall.py --labels labeled_queries.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import zlib
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import FAISS
+
+from pdf_fixtures import WORDS
+from hybrid_retriever import dense_search, reciprocal_rank_fusion
+from lexical_index import LexicalIndex, tokenize
+from reranker import LexicalOverlapScorer, rerank
+
+SYLLABLES = "ka lo mi ne ra tu vi zo pre dex sol fen mab tor cil lin".split()
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Offline stand-in for a semantic embedder: a normalized bag of hashed tokens in a
+    small space. Like real embeddings it captures topic words well but lets rare
+    identifiers collide, which is exactly the gap the lexical leg is meant to close.
+    """
+
+    model = "hashing-256"
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            vector[zlib.crc32(token.encode()) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def synthetic_corpus(n_chunks, n_queries, seed=0, n_topics=200):
+    """
+    Returns (chunks as (id, text, metadata), labeled queries as (query, relevant id)).
+    Each chunk is mostly written in one of n_topics small vocabularies, so vector search
+    can find the right topic while only the identifier pins down the right chunk.
+    """
+    rng = random.Random(seed)
+    topics = [rng.sample(WORDS, 6) for _ in range(n_topics)]
+    chunks = []
+    identifiers = []
+    for i in range(n_chunks):
+        kind = i % 3
+        if kind == 0:
+            ident = f"F-{i:06d}"
+            lead = f"Form {ident} must be completed"
+        elif kind == 1:
+            ident = f"ward {chr(65 + i % 26)}{i % 997}-{i // 997}"
+            lead = f"Patients in {ident} follow this rule"
+        else:
+            ident = "".join(rng.choice(SYLLABLES) for _ in range(3)) + f"{i % 89}"
+            lead = f"The dosage of {ident} is reviewed"
+        topic = topics[rng.randrange(n_topics)]
+        body = " ".join(rng.choice(topic if rng.random() < 0.7 else WORDS) for _ in range(120))
+        chunks.append((f"chunk-{i}", f"{lead}. {body}.", {"source": f"policy_{i // 500}.pdf"}))
+        identifiers.append(ident)
+
+    queries = []
+    for i in rng.sample(range(n_chunks), min(n_queries, n_chunks)):
+        topic = " ".join(rng.sample(chunks[i][1].split()[6:40], 4))
+        queries.append((f"What does the policy say about {identifiers[i]} and {topic}?", f"chunk-{i}"))
+    return chunks, queries
+
+
+def recall_at(ranked, relevant, k):
+    return 1.0 if relevant & set(ranked[:k]) else 0.0
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def evaluate(vectorstore, lexical, queries, ks, fetch_k):
+    """
+    queries: (query, set of relevant ids). Prints recall@k of each leg, of the fusion,
+    and of the fusion after lexical-overlap reranking (fused with its order) of its top fetch_k.
+    """
+    recalls = {name: {k: [] for k in ks} for name in ("vector", "bm25", "hybrid", "reranked")}
+    lexical_ms, rerank_ms = [], []
+    scorer = LexicalOverlapScorer()
+    for query, relevant in queries:
+        dense = dense_search(vectorstore, query, fetch_k)
+        start = time.perf_counter()
+        keyword = [cid for cid, _ in lexical.search(query, fetch_k)]
+        lexical_ms.append((time.perf_counter() - start) * 1000)
+        fused = reciprocal_rank_fusion([dense, keyword])
+        timings = {}
+        candidates = [vectorstore.docstore.search(cid) for cid in fused[:fetch_k]]
+        reranked = [d.id for d in rerank(query, candidates, scorer, top_k=fetch_k, budget_ms=1e9, timings=timings)]
+        rerank_ms.append(timings["rerank_ms"])
+        for name, ranked in (("vector", dense), ("bm25", keyword), ("hybrid", fused), ("reranked", reranked)):
+            for k in ks:
+                recalls[name][k].append(recall_at(ranked, relevant, k))
+
+    print(f"{len(queries)} labeled queries")
+    print(f"{'retriever':<10}" + "".join(f"{f'recall@{k}':>12}" for k in ks))
+    for name, by_k in recalls.items():
+        print(f"{name:<10}" + "".join(f"{statistics.mean(by_k[k]):>12.3f}" for k in ks))
+    print(f"BM25 search over {len(lexical)} chunks: p50 {percentile(lexical_ms, 0.5):.3f} ms, "
+          f"p99 {percentile(lexical_ms, 0.99):.3f} ms")
+    print(f"Reranking {fetch_k} candidates: p50 {percentile(rerank_ms, 0.5):.3f} ms, "
+          f"p99 {percentile(rerank_ms, 0.99):.3f} ms")
+
+
+def run_synthetic(args):
+    chunks, labeled = synthetic_corpus(args.chunks, args.queries, args.seed)
+
+    start = time.perf_counter()
+    lexical = LexicalIndex()
+    lexical.add(chunks)
+    print(f"BM25 index: {len(lexical)} chunks, {len(lexical.postings)} terms, "
+          f"built in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    embeddings = HashingEmbeddings()
+    texts = [text for _, text, _ in chunks]
+    vectorstore = FAISS.from_embeddings(
+        zip(texts, embeddings.embed_documents(texts)),
+        embeddings,
+        metadatas=[metadata for _, _, metadata in chunks],
+        ids=[cid for cid, _, _ in chunks],
+    )
+    print(f"FAISS index ({embeddings.model}) built in {time.perf_counter() - start:.1f}s")
+
+    evaluate(vectorstore, lexical, [(q, {cid}) for q, cid in labeled], args.k, args.fetch_k)
+
+
+def run_labeled(args):
+    import rag_pipeline
+
+    vectorstore, lexical = rag_pipeline._get_indexes()
+    if vectorstore is None:
+        sys.exit("No indexed documents in the current directory.")
+    by_page = {}
+    for doc_id in vectorstore.index_to_docstore_id.values():
+        meta = vectorstore.docstore.search(doc_id).metadata
+        by_page.setdefault((meta.get("source"), meta.get("page")), set()).add(doc_id)
+
+    queries = []
+    with open(args.labels, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                queries.append((item["query"], by_page.get((item["source"], item.get("page")), set())))
+    evaluate(vectorstore, lexical, queries, args.k, args.fetch_k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hybrid retrieval recall benchmark")
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 10])
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--labels", help="JSONL of labeled queries for the corpus in the current directory")
+    args = parser.parse_args()
+
+    if args.labels:
+        run_labeled(args)
+    else:
+        run_synthetic(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmarks streaming PDF ingestion: in-process lazy_load vs. the page-sharded process pool.
+
+    python benchmarks/bench_ingest_parallel.py --pages 400 --files 4 --workers 1 2 4
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pdf_fixtures import write_text_pdf
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel ingestion benchmark")
+    parser.add_argument("--pages", type=int, default=200, help="pages per PDF")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_ingest_")
+    os.chdir(workdir)
+    import chunk_store
+    import ingest
+
+    folder = os.path.join(workdir, "pdfs")
+    os.makedirs(folder)
+    for i in range(args.files):
+        write_text_pdf(os.path.join(folder, f"policy_{i}.pdf"), args.pages, seed=i)
+    total_pages = args.pages * args.files
+    print(f"{args.files} PDFs x {args.pages} pages in {folder}")
+
+    start = time.perf_counter()
+    count = 0
+    for name in sorted(os.listdir(folder)):
+        count += ingest.process_pdf(os.path.join(folder, name))
+    elapsed = time.perf_counter() - start
+    print(f"{'in-process lazy_load':<24} {elapsed:7.2f}s  {total_pages / elapsed:8.1f} pages/s  {count} chunks")
+
+    for workers in args.workers:
+        start = time.perf_counter()
+        count = ingest.ingest_folder(folder, workers)
+        elapsed = time.perf_counter() - start
+        print(f"{f'pool workers={workers}':<24} {elapsed:7.2f}s  {total_pages / elapsed:8.1f} pages/s  {count} chunks")
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak RSS of the parent process: {peak_mb:.0f} MB, chunk store corpus version {chunk_store.corpus_version()}")
+
+
+if __name__ == "__main__":
+    main()
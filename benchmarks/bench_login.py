@@ -0,0 +1,92 @@
+"""
+Login storm benchmark: concurrent verify_user calls per second with bcrypt run inline on
+the calling threads vs. in the bounded passwords process pool, and how much a cheap
+"chat" read (get_chat_history) slows down while the storm is running.
+
+    python benchmarks/bench_login.py --users 32 --logins 200 --rounds 10 12
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def storm(database, users, logins, accounts):
+    """Returns (logins/s, p95 login ms, p95 chat read ms during the storm)."""
+    login_ms, chat_ms = [], []
+    done = threading.Event()
+
+    def login(i):
+        start = time.perf_counter()
+        assert database.verify_user(accounts[i % len(accounts)], "correct horse battery staple")
+        login_ms.append((time.perf_counter() - start) * 1000)
+
+    def chat_reader():
+        while not done.is_set():
+            start = time.perf_counter()
+            database.get_chat_history("s1", limit=31)
+            chat_ms.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.005)
+
+    reader = threading.Thread(target=chat_reader)
+    reader.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    reader.join()
+    p95 = lambda values: statistics.quantiles(values, n=20)[-1]
+    return logins / elapsed, p95(login_ms), p95(chat_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent login benchmark")
+    parser.add_argument("--users", type=int, default=32, help="concurrent logins")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 12])
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_login_"))
+    import database
+    import passwords
+
+    database.init_db()
+    for i in range(30):
+        database.save_message("s1", "reader@example.com", "user", f"message {i}")
+
+    workers = passwords.BCRYPT_WORKERS
+    print(f"{args.logins} logins from {args.users} threads; pool: {workers} processes, "
+          f"max {passwords.BCRYPT_MAX_PENDING} pending; {os.cpu_count()} CPUs")
+    print(f"{'mode':<10}{'cost':>5}{'logins/s':>10}{'login p95 ms':>14}{'chat p95 ms':>13}")
+    for rounds in args.rounds:
+        passwords.BCRYPT_ROUNDS = rounds
+        accounts = [f"user{rounds}_{i}@example.com" for i in range(args.users)]
+        for email in accounts:
+            database.add_user(email, "correct horse battery staple", "Patient")
+        for mode, pool_size in (("inline", 0), ("pool", workers)):
+            passwords.BCRYPT_WORKERS = pool_size
+            rate, login_p95, chat_p95 = storm(database, args.users, args.logins, accounts)
+            print(f"{mode:<10}{rounds:>5}{rate:>10.1f}{login_p95:>14.0f}{chat_p95:>13.2f}")
+
+    # Rehash on login: a cost-10 hash is upgraded to the policy cost the first time it is verified
+    passwords.BCRYPT_ROUNDS = 10
+    database.add_user("legacy@example.com", "correct horse battery staple", "Staff")
+    passwords.BCRYPT_ROUNDS = max(args.rounds)
+    database.verify_user("legacy@example.com", "correct horse battery staple")
+    with database.connection() as conn:
+        stored = conn.execute(
+            "SELECT password FROM users WHERE email = 'legacy@example.com'"
+        ).fetchone()[0]
+    print(f"rehash on login: cost 10 -> {passwords.hash_rounds(stored)}")
+
+
+if __name__ == "__main__":
+    main()
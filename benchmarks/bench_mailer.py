@@ -0,0 +1,109 @@
+"""
+Password-reset burst against the local stub SMTP server: the old path (a fresh
+connection, handshake and login per email, sent inside the user's request) vs. the
+outbox (enqueue returns at once; one background sender reuses a single session).
+
+    python benchmarks/bench_mailer.py --emails 100 --users 16 --handshake-ms 300 --error-rate 0.1
+"""
+import argparse
+import os
+import smtplib
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub_smtp_server import start_server
+
+
+def legacy_send(host, port, receiver_email, otp_code):
+    """What send_otp_email used to do: connect, log in and send, all in the caller's thread."""
+    msg = EmailMessage()
+    msg.set_content(f"Your Hospital AI Portal Password Reset Code: {otp_code}")
+    msg['Subject'] = 'Your Password Reset Code'
+    msg['From'] = "portal@example.com"
+    msg['To'] = receiver_email
+    try:
+        with smtplib.SMTP(host, port) as smtp:
+            smtp.login("portal@example.com", "secret")
+            smtp.send_message(msg)
+        return True
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def burst(label, send, recipients, users):
+    """Returns per-request latencies (ms) as seen by the user who asked for a code."""
+    latencies = []
+
+    def request(i):
+        start = time.perf_counter()
+        send(recipients[i], 100000 + i)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(request, range(len(recipients))))
+    latencies.sort()
+    return time.perf_counter() - start, latencies
+
+
+def report(label, elapsed, latencies, delivered, connections, extra=""):
+    print(f"{label:<10}{statistics.median(latencies):>10.1f}{latencies[int(0.95 * (len(latencies) - 1))]:>10.1f}"
+          f"{elapsed:>10.2f}{delivered:>11}{connections:>13}  {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mail outbox benchmark")
+    parser.add_argument("--emails", type=int, default=100)
+    parser.add_argument("--users", type=int, default=16, help="concurrent reset requests")
+    parser.add_argument("--handshake-ms", type=float, default=300, help="connect + TLS + login cost per connection")
+    parser.add_argument("--latency-ms", type=float, default=20, help="per-message server latency")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="share of messages deferred with 451")
+    parser.add_argument("--bounces", type=int, default=2, help="recipients the server refuses permanently")
+    args = parser.parse_args()
+
+    server, state = start_server(handshake_ms=args.handshake_ms, latency_ms=args.latency_ms,
+                                 error_rate=args.error_rate)
+    host, port = server.server_address
+    os.environ.update({"SMTP_HOST": host, "SMTP_PORT": str(port), "SMTP_SECURITY": "none",
+                       "EMAIL_USER": "portal@example.com", "EMAIL_PASS": "secret"})
+    os.chdir(tempfile.mkdtemp(prefix="bench_mailer_"))
+    import mailer
+    mailer.MAIL_RETRY_BASE_SECONDS = 0.05  # keep the retry schedule short for the benchmark
+
+    recipients = [f"user{i}@example.com" for i in range(args.emails - args.bounces)]
+    recipients += [f"bounce{i}@example.com" for i in range(args.bounces)]
+
+    print(f"{args.emails} reset emails from {args.users} users; handshake {args.handshake_ms:.0f} ms, "
+          f"message {args.latency_ms:.0f} ms, {args.error_rate:.0%} deferred, {args.bounces} bounces")
+    print(f"{'path':<10}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}{'delivered':>11}{'connections':>13}")
+
+    elapsed, latencies = burst("legacy", lambda to, otp: legacy_send(host, port, to, otp), recipients, args.users)
+    report("legacy", elapsed, latencies, len(state.delivered), state.connections,
+           f"(failures are lost: {state.deferred} deferred)")
+
+    state.delivered.clear()
+    connections, deferred = state.connections, state.deferred
+    ids = []
+    elapsed_enqueue, latencies = burst("outbox", lambda to, otp: ids.append(mailer.send_otp_email(to, otp)),
+                                       recipients, args.users)
+    start = time.perf_counter()
+    while True:
+        statuses = [mailer.delivery_status(i)["status"] for i in ids]
+        if all(s in (mailer.SENT, mailer.FAILED) for s in statuses):
+            break
+        time.sleep(0.05)
+    drained = elapsed_enqueue + time.perf_counter() - start
+    failed = statuses.count(mailer.FAILED)
+    report("outbox", drained, latencies, len(state.delivered), state.connections - connections,
+           f"({state.deferred - deferred} deferred and retried, {failed} failed permanently)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmarks the query path against the local stub OpenAI server: the old per-request
+path (a fresh ChatOpenAI and RetrievalQA.invoke for every question) vs. the shared
+QueryService (pooled clients, ainvoke, single-flight coalescing of identical questions).
+
+    python benchmarks/bench_query_service.py --users 16 --requests 200 --distinct 10 --latency-ms 300
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pdf_fixtures import page_lines
+from stub_openai_server import start_server
+
+
+def run(label, ask, questions, users, state):
+    chats, connections = state.chat_requests, state.connections
+    latencies = []
+
+    def timed(question):
+        start = time.perf_counter()
+        ask(question)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(timed, questions))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{label:<34}{len(questions) / elapsed:>8.1f}{statistics.median(latencies):>9.0f}"
+          f"{latencies[int(0.95 * (len(latencies) - 1))]:>9.0f}"
+          f"{state.chat_requests - chats:>11}{state.connections - connections:>13}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query service benchmark")
+    parser.add_argument("--users", type=int, default=16, help="concurrent sessions")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=10, help="distinct questions among the requests")
+    parser.add_argument("--latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    server, state = start_server(latency_ms=args.latency_ms)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["EMBEDDINGS_PROVIDER"] = "fake"
+    os.environ["ANSWER_CACHE_MAX_ENTRIES"] = "0"  # measure the LLM path, not the answer cache
+    os.chdir(tempfile.mkdtemp(prefix="bench_query_"))
+
+    import chunk_store
+    import rag_pipeline
+    from langchain_classic.chains import RetrievalQA
+    from langchain_openai import ChatOpenAI
+
+    chunk_store.append_chunks(
+        {"page_content": line, "metadata": {"source": "policy.pdf", "page": p}}
+        for p in range(50) for line in page_lines(p, 20)
+    )
+    qa_chain = rag_pipeline.build_qa_chain()
+    vectorstore = rag_pipeline.get_vectorstore()
+
+    rng = random.Random(0)
+    topics = [f"What is the policy on {' '.join(rng.sample(page_lines(0)[1].split(), 3))} #{i}?"
+              for i in range(args.distinct)]
+    questions = [rng.choice(topics) for _ in range(args.requests)]
+
+    def per_request(question):
+        # What build_qa_chain + role_based_query used to do on every turn
+        chain = RetrievalQA.from_chain_type(
+            llm=ChatOpenAI(temperature=0, model="gpt-4o-mini"),
+            retriever=vectorstore.as_retriever(search_kwargs={"k": 3}),
+            return_source_documents=True,
+        )
+        return chain.invoke(question)
+
+    def service(question):
+        return rag_pipeline.role_based_query(qa_chain, question, "Patient")
+
+    def service_stream(question):
+        return list(rag_pipeline.stream_role_based_query(qa_chain, question, "Patient"))
+
+    print(f"{args.requests} questions ({args.distinct} distinct) from {args.users} concurrent users, "
+          f"stub latency {args.latency_ms:.0f} ms")
+    print(f"{'path':<34}{'QPS':>8}{'p50 ms':>9}{'p95 ms':>9}{'LLM calls':>11}{'connections':>13}")
+    run("per-request client + invoke", per_request, questions, args.users, state)
+    run("query service (ainvoke)", service, questions, args.users, state)
+    run("query service (astream)", service_stream, questions, args.users, state)
+    print(f"single-flight: {rag_pipeline.get_query_service().stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Offline regression suite: ingestion, index build/reload, retrieval latency and recall,
+end-to-end query latency, chat persistence at scale and login cost. Runs with no network:
+a deterministic hashing embedder stands in for OpenAI embeddings and the local stub
+server (latency 0) for the chat model, so the numbers measure this code, not the API.
+
+Results are written as JSON and compared against a stored baseline; the exit status is 1
+if any metric regressed by more than the tolerance, or if reranking lowered recall@3
+below the fused retrieval order it reorders, so a deploy can be gated on it:
+
+    python benchmarks/bench_suite.py --output bench_results.json
+    python benchmarks/bench_suite.py --update-baseline          # after an intended change
+    python benchmarks/bench_suite.py --tolerance 0.5 --no-compare
+
+Baselines are machine-specific, so none is committed: record one on the machine (or CI
+runner) that gates, at the commit it gates from. A baseline recorded on other hardware
+or with other arguments is reported before the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_hybrid_recall import HashingEmbeddings, percentile, synthetic_corpus
+from pdf_fixtures import write_text_pdf
+from stub_openai_server import start_server
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Recall is deterministic: any drop beyond rounding is a regression, whatever --tolerance says
+QUALITY_TOLERANCE = 0.01
+# Sub-millisecond timings jitter by more than any sensible tolerance; ignore changes below this
+NOISE_FLOOR_MS = 0.05
+
+
+class Results:
+    """Collects metrics as {name: {"value", "unit", "better"}} and echoes each one."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, unit, better="lower"):
+        self.metrics[name] = {"value": round(value, 4), "unit": unit, "better": better}
+        print(f"  {name:<40}{value:>12.3f} {unit}")
+
+
+def timed_ms(fn, repeat):
+    """Runs fn `repeat` times; returns the individual durations in ms."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def bench_ingest(results, page_counts):
+    import ingest
+
+    print("ingest.process_pdf")
+    os.makedirs("pdfs", exist_ok=True)
+    for pages in page_counts:
+        path = os.path.join("pdfs", f"policy_{pages}p.pdf")
+        write_text_pdf(path, pages, seed=pages)
+        start = time.perf_counter()
+        chunks = ingest.process_pdf(path)
+        elapsed = time.perf_counter() - start
+        results.add(f"ingest.{pages}p.pages_per_s", pages / elapsed, "pages/s", "higher")
+        results.add(f"ingest.{pages}p.chunks_per_s", chunks / elapsed, "chunks/s", "higher")
+
+
+def bench_index(results, rag_pipeline, chunk_store, chunks):
+    print(f"index (load_documents + embed + build, {len(chunks)} synthetic chunks + ingested PDFs)")
+    chunk_store.append_chunks(
+        ({"page_content": text, "metadata": metadata} for _, text, metadata in chunks),
+    )
+    start = time.perf_counter()
+    rag_pipeline._get_indexes()
+    results.add("index.build_s", time.perf_counter() - start, "s")
+
+    # Cold start of another process: nothing in memory, everything persisted
+    rag_pipeline._vectorstore_cache.update(corpus_version=None, digest=None, vectorstore=None, lexical=None)
+    start = time.perf_counter()
+    rag_pipeline._get_indexes()
+    results.add("index.reload_s", time.perf_counter() - start, "s")
+
+
+def bench_retrieval(results, rag_pipeline, labeled):
+    print(f"retrieval (hybrid + rerank + pack, {len(labeled)} labeled queries)")
+    qa_chain = rag_pipeline.build_qa_chain()
+    latencies, hits, fused_hits = [], [], []
+    for query, relevant_text in labeled:
+        start = time.perf_counter()
+        docs = rag_pipeline._retrieve(qa_chain, query, "Patient", {})
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits.append(1.0 if any(d.page_content == relevant_text for d in docs[:3]) else 0.0)
+        # The same candidates in fused (RRF) order, before reranking and packing
+        fused = qa_chain.retriever.for_role("Patient").invoke(query)
+        fused_hits.append(1.0 if any(d.page_content == relevant_text for d in fused[:3]) else 0.0)
+    results.add("retrieval.p50_ms", percentile(latencies, 0.5), "ms")
+    results.add("retrieval.p95_ms", percentile(latencies, 0.95), "ms")
+    results.add("retrieval.recall_at_3", statistics.mean(hits), "recall", "higher")
+    results.add("retrieval.hybrid_recall_at_3", statistics.mean(fused_hits), "recall", "higher")
+    return qa_chain
+
+
+def rerank_recall_loss(metrics):
+    """
+    How much recall@3 reranking and packing lose against the fused order they reorder,
+    if more than QUALITY_TOLERANCE. Checked on every run, baseline or not.
+    """
+    loss = metrics["retrieval.hybrid_recall_at_3"]["value"] - metrics["retrieval.recall_at_3"]["value"]
+    return loss if loss > QUALITY_TOLERANCE else 0.0
+
+
+def bench_query(results, rag_pipeline, qa_chain, questions):
+    print(f"query (role_based_query with the stub LLM, {len(questions)} distinct questions)")
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        rag_pipeline.role_based_query(qa_chain, question, "Patient")
+        latencies.append((time.perf_counter() - start) * 1000)
+    results.add("query.p50_ms", percentile(latencies, 0.5), "ms")
+    results.add("query.p95_ms", percentile(latencies, 0.95), "ms")
+
+
+def bench_chat(results, database, messages, writes, repeat):
+    print(f"chat persistence ({messages} stored messages)")
+    database.init_db()
+
+    # Bulk-fill the history directly; only the measured writes go through save_message
+    sessions = max(1, messages // 20)
+    conn = sqlite3.connect(database.DB_NAME)
+    with conn:
+        conn.executemany(
+            "INSERT INTO sessions (id, user_email, title) VALUES (?, ?, ?)",
+            ((f"s{s:07d}", f"user{s % 500}@example.com", f"question {s}") for s in range(sessions)),
+        )
+        conn.executemany(
+            "INSERT INTO chat_history (session_id, user_email, role, content) VALUES (?, ?, ?, ?)",
+            ((f"s{i // 20:07d}", f"user{(i // 20) % 500}@example.com",
+              "user" if i % 2 == 0 else "assistant", f"message {i}") for i in range(messages)),
+        )
+    conn.close()
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for i in range(writes):
+        s = rng.randrange(sessions)
+        database.save_message(f"s{s:07d}", f"user{s % 500}@example.com", "user", f"new message {i}")
+    results.add("chat.save_message_per_s", writes / (time.perf_counter() - start), "msgs/s", "higher")
+
+    session_ids = [f"s{rng.randrange(sessions):07d}" for _ in range(repeat)]
+    window = []
+    for session_id in session_ids:
+        start = time.perf_counter()
+        database.get_chat_history(session_id, limit=31)
+        window.append((time.perf_counter() - start) * 1000)
+    results.add("chat.history_window_p50_ms", percentile(window, 0.5), "ms")
+    sidebar = timed_ms(lambda: database.list_sessions(f"user{rng.randrange(500)}@example.com"), repeat)
+    results.add("chat.list_sessions_p50_ms", percentile(sidebar, 0.5), "ms")
+
+
+def bench_auth(results, database, repeat):
+    print("auth")
+    database.add_user("bench@example.com", "correct horse battery staple", "Staff")
+    durations = timed_ms(lambda: database.verify_user("bench@example.com", "correct horse battery staple"), repeat)
+    results.add("auth.verify_user_ms", statistics.median(durations), "ms")
+
+
+def compare(current, baseline, tolerance):
+    """Returns the regressed metric names, printing a side-by-side table."""
+    regressions = []
+    print(f"\n{'metric':<40}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, metric in current.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<40}{'-':>12}{metric['value']:>12.3f}{'new':>9}")
+            continue
+        before, after = old["value"], metric["value"]
+        change = (after - before) / before if before else 0.0
+        worse = -change if metric["better"] == "higher" else change
+        allowed = QUALITY_TOLERANCE if metric["unit"] == "recall" else tolerance
+        jitter = metric["unit"] == "ms" and abs(after - before) < NOISE_FLOOR_MS
+        flag = "  REGRESSION" if worse > allowed and not jitter else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<40}{before:>12.3f}{after:>12.3f}{change:>+9.0%}{flag}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument("--pdf-pages", type=int, nargs="+", default=[10, 100], help="sizes of the generated PDFs")
+    parser.add_argument("--chunks", type=int, default=20000, help="synthetic chunks added before the index build")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=200000, help="chat messages stored before measuring")
+    parser.add_argument("--writes", type=int, default=2000, help="save_message calls measured")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--output", help="write the results JSON here")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative slowdown per metric")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--no-compare", action="store_true")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline)
+
+    server, _ = start_server(latency_ms=0)
+    os.environ.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1",
+        "OPENAI_API_KEY": "stub",
+        "EMBEDDINGS_PROVIDER": "fake",
+        "ANSWER_CACHE_MAX_ENTRIES": "0",  # every question takes the full path
+    })
+    os.chdir(tempfile.mkdtemp(prefix="bench_suite_"))
+
+    import chunk_store
+    import database
+    import rag_pipeline
+    from embedding_cache import CachedEmbeddings
+
+    # Deterministic, topic-aware embedder so recall is meaningful offline
+    rag_pipeline._embeddings = CachedEmbeddings(HashingEmbeddings())
+    chunks, labeled = synthetic_corpus(args.chunks, args.queries)
+    texts = {cid: text for cid, text, _ in chunks}
+    labeled = [(query, texts[cid]) for query, cid in labeled]
+
+    results = Results()
+    started = time.perf_counter()
+    bench_ingest(results, args.pdf_pages)
+    bench_index(results, rag_pipeline, chunk_store, chunks)
+    qa_chain = bench_retrieval(results, rag_pipeline, labeled)
+    bench_query(results, rag_pipeline, qa_chain, [query for query, _ in labeled[:50]])
+    bench_chat(results, database, args.messages, args.writes, args.repeat)
+    bench_auth(results, database, 5)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items()
+                     if k not in ("output", "baseline", "tolerance", "update_baseline", "no_compare")},
+            "elapsed_s": round(time.perf_counter() - started, 1),
+        },
+        "metrics": results.metrics,
+    }
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    loss = rerank_recall_loss(results.metrics)
+    if loss:
+        print(f"\nReranking lowered recall@3 by {loss:.3f} against the fused retrieval order")
+        sys.exit(1)
+    if args.update_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {baseline_path}")
+        return
+    if args.no_compare:
+        return
+    if not os.path.exists(baseline_path):
+        print(f"\nNo baseline at {baseline_path}; record one on this machine with --update-baseline")
+        return
+
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    for key in ("machine", "cpus", "python", "args"):
+        if baseline["meta"].get(key) != report["meta"][key]:
+            print(f"\nWarning: baseline {key} differs ({baseline['meta'].get(key)} vs {report['meta'][key]}); "
+                  "timings are not comparable, re-record the baseline here")
+    print(f"Baseline recorded at commit {baseline['meta'].get('commit')}")
+    regressions = compare(results.metrics, baseline["metrics"], args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Multi-worker load test: N read-only worker processes (INDEX_READ_ONLY=on) answer hybrid
+retrieval queries from the index one writer published, and the writer publishes a new
+version halfway through each run. Reports total queries/s, summed resident memory (RSS)
+and proportional memory (PSS, which splits shared pages between the processes mapping
+them, i.e. what the workers really cost), and how long the workers took to switch to
+the new version.
+
+"mmap" is the deployment mode: every worker maps the same published files. "copy" makes
+each worker copy the FAISS index, docstore and BM25 postings into private memory, which
+is what N independent processes used to cost.
+
+    python benchmarks/bench_workers.py --chunks 50000 --workers 1 2 4 --seconds 10
+
+PSS is read from /proc/<pid>/smaps_rollup (Linux); elsewhere only RSS is reported.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_hybrid_recall import HashingEmbeddings, synthetic_corpus
+
+
+def memory_mb():
+    """(RSS, PSS) of this process in MB; PSS is None where smaps_rollup is unavailable."""
+    try:
+        with open("/proc/self/smaps_rollup", "r", encoding="ascii") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.split()[-1] == "kB"}
+        return fields["Rss"] / 1024, fields["Pss"] / 1024
+    except OSError:
+        import resource
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, None
+
+
+def private_copy(vectorstore, lexical):
+    """Moves a mapped index into process-private memory (the "copy" mode)."""
+    import faiss
+    import numpy as np
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    vectorstore.index = faiss.deserialize_index(faiss.serialize_index(vectorstore.index))
+    vectorstore.docstore = InMemoryDocstore(vectorstore.docstore.as_dict())
+    lexical.postings = {term: (np.array(d), np.array(t)) for term, (d, t) in lexical.postings.items()}
+    lexical.doc_len = np.array(lexical.doc_len)
+
+
+def worker(workdir, dim, mode, queries, ready, start_at, stop_after, published_at, results):
+    os.environ["INDEX_READ_ONLY"] = "on"
+    os.environ["INDEX_POLL_SECONDS"] = "0.5"
+    os.chdir(workdir)
+    import rag_pipeline
+    from hybrid_retriever import HybridRetriever
+
+    rag_pipeline._embeddings = HashingEmbeddings(dim)
+    retriever, loaded, seen_new_at = None, None, None
+    done = 0
+
+    def serve(query):
+        nonlocal retriever, loaded, seen_new_at
+        vectorstore, lexical = rag_pipeline._get_indexes()
+        if vectorstore is not loaded:
+            if mode == "copy":
+                private_copy(vectorstore, lexical)
+            retriever = HybridRetriever(vectorstore=vectorstore, lexical=lexical, k=5).for_role("Staff")
+            if loaded is not None and seen_new_at is None:
+                seen_new_at = time.time()
+            loaded = vectorstore
+        retriever.invoke(query)
+
+    # Warm up (imports, index mapping, role bitmap) before the clock starts
+    for query in queries[:20]:
+        serve(query)
+    ready.release()
+    while not start_at.value:
+        time.sleep(0.01)
+    stop_at = start_at.value + stop_after
+    while time.time() < stop_at:
+        serve(queries[done % len(queries)])
+        done += 1
+    lag_ms = (seen_new_at - published_at.value) * 1000 if seen_new_at and published_at.value else None
+    results.put((done, *memory_mb(), lag_ms))
+
+
+def run(workdir, dim, mode, workers, seconds, queries, publish):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    ready = ctx.Semaphore(0)
+    start_at, published_at = ctx.Value("d", 0.0), ctx.Value("d", 0.0)
+    procs = [
+        ctx.Process(target=worker,
+                    args=(workdir, dim, mode, queries, ready, start_at, seconds, published_at, results))
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready.acquire()
+    start_at.value = time.time()
+    time.sleep(seconds / 2)
+    publish()
+    published_at.value = time.time()
+    rows = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    queries_done = sum(r[0] for r in rows)
+    rss = sum(r[1] for r in rows)
+    pss = sum(r[2] for r in rows) if all(r[2] is not None for r in rows) else None
+    lags = [r[3] for r in rows if r[3] is not None]
+    return queries_done / seconds, rss, pss, (max(lags) if len(lags) == len(rows) else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-only worker scaling benchmark")
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384, help="embedding size (index size grows with it)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--modes", nargs="+", choices=["mmap", "copy"], default=["mmap", "copy"])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_workers_")
+    os.environ["EMBEDDINGS_PROVIDER"] = "fake"
+    os.environ.pop("INDEX_READ_ONLY", None)
+    os.chdir(workdir)
+    import chunk_store
+    import rag_pipeline
+    import index_store
+
+    # The writer: builds and publishes the first version
+    rag_pipeline._embeddings = HashingEmbeddings(args.dim)
+    chunks, labeled = synthetic_corpus(args.chunks, args.queries)
+    chunk_store.append_chunks({"page_content": text, "metadata": metadata} for _, text, metadata in chunks)
+    start = time.perf_counter()
+    rag_pipeline.get_vectorstore()
+    path = index_store.version_dir(index_store.current_version())
+    size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+    print(f"{args.chunks} chunks, {args.dim}-d: built and published in {time.perf_counter() - start:.1f}s, "
+          f"{size / 2**20:.0f} MB on disk; {os.cpu_count()} CPUs")
+
+    rng = random.Random(1)
+    sources = sorted({metadata.get("source") for _, _, metadata in chunks})
+
+    def publish():
+        # Re-upload of one source: the incremental writer path, published as a new version
+        source = rng.choice(sources)
+        rag_pipeline.add_chunks_to_index(
+            [{"page_content": f"Revised notice {rng.random()} for {source}", "metadata": {"source": source}}]
+        )
+
+    queries = [query for query, _ in labeled]
+    print(f"{'mode':<6}{'workers':>8}{'queries/s':>11}{'RSS MB':>9}{'PSS MB':>9}{'reload ms':>11}")
+    for mode in args.modes:
+        for workers in args.workers:
+            qps, rss, pss, lag = run(workdir, args.dim, mode, workers, args.seconds, queries, publish)
+            print(f"{mode:<6}{workers:>8}{qps:>11.0f}{rss:>9.0f}"
+                  f"{(f'{pss:.0f}' if pss is not None else 'n/a'):>9}"
+                  f"{(f'{lag:.0f}' if lag is not None else 'n/a'):>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Generates synthetic hospital-policy PDFs for the ingestion benchmarks (no extra dependencies)."""
+import random
+
+WORDS = (
+    "patient visiting hours ward discharge policy parking medication dosage "
+    "paracetamol ibuprofen amoxicillin triage emergency consent form pharmacy "
+    "infection control isolation cardiology pediatrics radiology appointment "
+    "referral insurance billing staff shift handover nurse physician record"
+).split()
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def page_lines(page_number, lines=40, seed=0):
+    rng = random.Random(seed * 100003 + page_number)
+    out = [f"Policy section {page_number + 1}"]
+    for i in range(lines - 1):
+        out.append(" ".join(rng.choice(WORDS) for _ in range(12)) + f" (ref {page_number}-{i}).")
+    return out
+
+
+def write_text_pdf(path, n_pages, lines_per_page=40, seed=0):
+    """Writes an n_pages PDF with Helvetica text that pypdf can extract."""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(None)  # filled in once the page ids are known
+    page_ids = []
+    for p in range(n_pages):
+        stream = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        for line in page_lines(p, lines_per_page, seed):
+            stream.append(f"({_escape(line)}) Tj T*")
+        stream.append("ET")
+        data = "\n".join(stream).encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode("ascii")
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % n_pages
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
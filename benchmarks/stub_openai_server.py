@@ -0,0 +1,199 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions endpoints, used to
+benchmark the ingestion and query paths without network access or API spend.
+
+Embeddings are deterministic vectors; chat completions echo a short canned answer,
+streamed as server-sent events when requested. Every request sleeps for a configurable
+latency, and a configurable share of requests (plus anything above the server's own
+rate limit) is answered with HTTP 429. Connections are kept alive (HTTP/1.1) and
+counted, so client connection pooling is visible.
+
+    python benchmarks/stub_openai_server.py --port 8765 --latency-ms 150 --error-rate 0.1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+DIMENSIONS = 256
+ANSWER = "According to the hospital policy documents, please contact the ward nurse for details."
+
+
+def fake_vector(text, dimensions=DIMENSIONS):
+    """Deterministic unit vector derived from the text's hash."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class StubState:
+    def __init__(self, latency_ms, error_rate, max_rps):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.requests = 0
+        self.rejected = 0
+        self.chat_requests = 0
+        self.connections = 0
+
+    def admit(self):
+        """Returns False if this request should be answered with 429."""
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            over_limit = self.max_rps and self.window_count > self.max_rps
+            if over_limit or random.random() < self.error_rate:
+                self.rejected += 1
+                return False
+            return True
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with state.lock:
+                state.connections += 1
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            time.sleep(state.latency)
+
+            if not self.path.endswith(("/embeddings", "/chat/completions")):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            if not state.admit():
+                self._send(
+                    429,
+                    {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                    {"Retry-After": "0.2"},
+                )
+                return
+
+            if self.path.endswith("/chat/completions"):
+                self._chat(request)
+                return
+
+            inputs = request.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            data = []
+            for i, text in enumerate(inputs):
+                vector = fake_vector(text if isinstance(text, str) else json.dumps(text))
+                if request.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+                else:
+                    embedding = vector.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+            self._send(200, {
+                "object": "list",
+                "data": data,
+                "model": request.get("model", "stub"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+
+        def _chat(self, request):
+            with state.lock:
+                state.chat_requests += 1
+            model = request.get("model", "stub")
+            if not request.get("stream"):
+                self._send(200, {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": ANSWER},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                })
+                return
+
+            # Server-sent events in HTTP/1.1 chunked encoding, one chunk per word
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def event(data, last=False):
+                payload = f"data: {data}\n\n".encode("utf-8")
+                chunk = f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n"
+                # The terminating chunk goes out with [DONE], so a client that stops
+                # reading there has consumed the whole body and can reuse the connection
+                self.wfile.write(chunk + (b"0\r\n\r\n" if last else b""))
+
+            for i, word in enumerate(ANSWER.split(" ")):
+                delta = {"content": word if i == 0 else " " + word}
+                if i == 0:
+                    delta["role"] = "assistant"
+                event(json.dumps({
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }))
+            event(json.dumps({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }))
+            event("[DONE]", last=True)
+
+    return Handler
+
+
+def start_server(port=0, latency_ms=100, error_rate=0.0, max_rps=0):
+    """Starts the stub in a daemon thread; returns (server, state). Port 0 picks a free port."""
+    state = StubState(latency_ms, error_rate, max_rps)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-rps", type=int, default=0, help="server-side requests/second before 429 (0 = unlimited)")
+    args = parser.parse_args()
+    server, _ = start_server(args.port, args.latency_ms, args.error_rate, args.max_rps)
+    print(f"Stub OpenAI server on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,133 @@
+"""
+Local stand-in SMTP server (plain SMTP, no TLS) for exercising mailer's outbox without
+a real mail account, in the spirit of aiosmtpd's debugging server but dependency-free.
+
+It speaks enough ESMTP for smtplib: EHLO/HELO, AUTH PLAIN/LOGIN (any credentials),
+MAIL, RCPT, DATA, NOOP, RSET and QUIT. `handshake_ms` delays every new connection, as a
+TLS handshake plus login to a remote server would, and `latency_ms` delays every message.
+A share of messages (`error_rate`) is deferred with a transient 451, and recipients
+containing "bounce" are refused with a permanent 550. Delivered messages are kept in
+`state.delivered`.
+
+    python benchmarks/stub_smtp_server.py --port 2525 --handshake-ms 300
+    SMTP_HOST=127.0.0.1 SMTP_PORT=2525 SMTP_SECURITY=none streamlit run app.py
+"""
+import argparse
+import random
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+
+
+class SmtpState:
+    def __init__(self, handshake_ms, latency_ms, error_rate):
+        self.handshake = handshake_ms / 1000.0
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.deferred = 0
+        self.delivered = []   # (recipients, email.message.Message)
+
+
+def make_handler(state):
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write(line.encode("ascii") + b"\r\n")
+
+        def handle(self):
+            with state.lock:
+                state.connections += 1
+            time.sleep(state.handshake)
+            self.reply("220 stub-smtp ESMTP ready")
+            recipients = []
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command = line.decode("utf-8", "replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    self.reply("250-stub-smtp")
+                    self.reply("250-AUTH PLAIN LOGIN")
+                    self.reply("250 8BITMIME")
+                elif verb == "HELO":
+                    self.reply("250 stub-smtp")
+                elif verb == "AUTH":
+                    parts = command.split()
+                    if parts[1].upper() == "LOGIN":
+                        for prompt in ("334 VXNlcm5hbWU6", "334 UGFzc3dvcmQ6"):
+                            self.reply(prompt)
+                            self.rfile.readline()
+                    elif len(parts) == 2:
+                        self.reply("334 ")
+                        self.rfile.readline()
+                    self.reply("235 2.7.0 Authentication successful")
+                elif verb == "MAIL":
+                    recipients = []
+                    self.reply("250 OK")
+                elif verb == "RCPT":
+                    address = command.split(":", 1)[1].strip().strip("<>")
+                    if "bounce" in address:
+                        self.reply("550 5.1.1 No such user")
+                    else:
+                        recipients.append(address)
+                        self.reply("250 OK")
+                elif verb == "DATA":
+                    self.reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = []
+                    while True:
+                        chunk = self.rfile.readline()
+                        if chunk in (b".\r\n", b".\n", b""):
+                            break
+                        data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                    time.sleep(state.latency)
+                    if random.random() < state.error_rate:
+                        with state.lock:
+                            state.deferred += 1
+                        self.reply("451 4.3.0 Try again later")
+                    else:
+                        with state.lock:
+                            state.delivered.append((recipients, message_from_bytes(b"".join(data))))
+                        self.reply("250 OK queued")
+                    recipients = []
+                elif verb in ("NOOP", "RSET"):
+                    self.reply("250 OK")
+                elif verb == "QUIT":
+                    self.reply("221 Bye")
+                    return
+                else:
+                    self.reply("502 Command not implemented")
+
+    return Handler
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server(port=0, handshake_ms=300, latency_ms=20, error_rate=0.0):
+    """Starts the stub in a daemon thread; returns (server, state). Port 0 picks a free port."""
+    state = SmtpState(handshake_ms, latency_ms, error_rate)
+    server = _Server(("127.0.0.1", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--handshake-ms", type=float, default=300)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server, state = start_server(args.port, args.handshake_ms, args.latency_ms, args.error_rate)
+    print(f"Stub SMTP server on 127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"{state.connections} connections, {len(state.delivered)} delivered, {state.deferred} deferred")
+    except KeyboardInterrupt:
+        server.shutdown()
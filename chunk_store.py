@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from itertools import islice
+
+# Configuration: Where processed chunks are stored (replaces the old documents.json)
+CHUNK_DB = "chunks.db"
+LEGACY_JSON_FILE = "documents.json"
+# Streamed records are written this many rows per statement, so an ingest never holds more
+INSERT_BATCH_SIZE = 500
+
+_init_lock = threading.Lock()
+_initialized_for = None
+
+
+def chunk_hash(page_content, metadata):
+    """Content hash of a chunk (text + source/page metadata), used as its stable id."""
+    payload = json.dumps(
+        {"page_content": page_content, "metadata": metadata},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _connect():
+    """Opens the chunk store, creating the schema and migrating documents.json on first use."""
+    global _initialized_for
+    conn = sqlite3.connect(CHUNK_DB, timeout=30)
+    if _initialized_for != CHUNK_DB:
+        with _init_lock:
+            if _initialized_for != CHUNK_DB:
+                _init_schema(conn)
+                _migrate_legacy_json(conn)
+                _initialized_for = CHUNK_DB
+    return conn
+
+
+def _init_schema(conn):
+    """Creates the chunk table, its per-source index and the corpus version counter."""
+    # WAL lets readers stream the corpus while an ingest is appending
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chunk_id TEXT NOT NULL,
+            source TEXT,
+            page INTEGER,
+            page_content TEXT NOT NULL,
+            metadata TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS store_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('corpus_version', 0)")
+    conn.commit()
+
+
+def _migrate_legacy_json(conn):
+    """One-shot import of an existing documents.json into an empty store."""
+    if not os.path.exists(LEGACY_JSON_FILE):
+        return
+    if conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone():
+        return
+
+    try:
+        with open(LEGACY_JSON_FILE, "r", encoding="utf-8") as f:
+            records = json.load(f)
+    except json.JSONDecodeError as e:
+        # Leave the file where it is so nothing is lost; it can be fixed and retried
+        print(f"Chunk store migration skipped, {LEGACY_JSON_FILE} is unreadable: {e}")
+        return
+
+    with conn:
+        _insert(conn, records)
+    os.replace(LEGACY_JSON_FILE, f"{LEGACY_JSON_FILE}.migrated")
+    print(f"Migrated {len(records)} chunks from {LEGACY_JSON_FILE} to {CHUNK_DB}")
+
+
+def _insert(conn, records):
+    """
+    Inserts any iterable of records in INSERT_BATCH_SIZE batches (streamed, never
+    materialized) and bumps the corpus version. Returns the number of rows inserted.
+    """
+    rows = (
+        (
+            chunk_hash(r["page_content"], r["metadata"]),
+            r["metadata"].get("source"),
+            r["metadata"].get("page"),
+            r["page_content"],
+            json.dumps(r["metadata"], ensure_ascii=False),
+        )
+        for r in records
+    )
+    inserted = 0
+    while True:
+        batch = list(islice(rows, INSERT_BATCH_SIZE))
+        if not batch:
+            break
+        conn.executemany(
+            """
+            INSERT INTO chunks (chunk_id, source, page, page_content, metadata)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            batch,
+        )
+        inserted += len(batch)
+    conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'corpus_version'")
+    return inserted
+
+
+def append_chunks(records, replace_source=None):
+    """
+    Appends chunk records in a single transaction. If `replace_source` is given, that
+    source's previous chunks are removed in the same transaction, so readers see
+    either the old document or the new one, never a mix or an empty corpus.
+    `records` may be a generator; it is consumed while the transaction is open.
+    """
+    conn = _connect()
+    try:
+        with conn:
+            if replace_source is not None:
+                conn.execute("DELETE FROM chunks WHERE source = ?", (replace_source,))
+            count = _insert(conn, records)
+    finally:
+        conn.close()
+    return count
+
+
+def iter_chunks(batch_size=500):
+    """Streams every chunk record in insertion order without loading the corpus into memory."""
+    conn = _connect()
+    try:
+        cursor = conn.execute("SELECT page_content, metadata FROM chunks ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for page_content, metadata in rows:
+                yield {"page_content": page_content, "metadata": json.loads(metadata)}
+    finally:
+        conn.close()
+
+
+def iter_chunk_ids(batch_size=5000):
+    """Streams just the chunk ids, which is all an index manifest needs."""
+    conn = _connect()
+    try:
+        cursor = conn.execute("SELECT chunk_id FROM chunks ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for (cid,) in rows:
+                yield cid
+    finally:
+        conn.close()
+
+
+def get_source_chunks(source):
+    """Returns the chunk records of a single source file (uses the per-source index)."""
+    return [record for batch in iter_source_chunks(source) for record in batch]
+
+
+def iter_source_chunks(source, batch_size=500):
+    """Streams a single source file's chunk records as lists of at most `batch_size`, in insertion order."""
+    conn = _connect()
+    try:
+        cursor = conn.execute(
+            "SELECT page_content, metadata FROM chunks WHERE source = ? ORDER BY id", (source,)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [{"page_content": c, "metadata": json.loads(m)} for c, m in rows]
+    finally:
+        conn.close()
+
+
+def count_source_chunks(source):
+    """Number of stored chunks of a single source file."""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT COUNT(*) FROM chunks WHERE source = ?", (source,)).fetchone()
+    finally:
+        conn.close()
+    return row[0]
+
+
+def list_sources():
+    """Returns every ingested source file name."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT DISTINCT source FROM chunks ORDER BY source").fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows]
+
+
+def corpus_version():
+    """Monotonic counter bumped on every write; a cheap way to detect corpus changes."""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT value FROM store_meta WHERE key = 'corpus_version'").fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else 0
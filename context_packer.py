@@ -0,0 +1,122 @@
+import os
+import re
+import time
+
+from access_control import ROLES
+from reranker import CONTEXT_MAX_TOKENS, trim_to_budget
+from token_utils import count_tokens
+
+# Configuration: How reranked chunks are assembled into the prompt context
+# - CONTEXT_MAX_TOKENS_<ROLE> (e.g. CONTEXT_MAX_TOKENS_PATIENT): per-role context budget,
+#   CONTEXT_MAX_TOKENS by default; passages are added in rank order until it is spent
+# - MIN_OVERLAP_CHARS: shortest shared span between two chunks of the same page that is
+#   treated as splitter overlap (ingest.py overlaps neighbours by up to 200 characters)
+ROLE_CONTEXT_MAX_TOKENS = {
+    role: int(os.getenv(f"CONTEXT_MAX_TOKENS_{role.upper()}", str(CONTEXT_MAX_TOKENS))) for role in ROLES
+}
+MIN_OVERLAP_CHARS = 30
+
+_SPACES_RE = re.compile(r"[ \t\f\v\r]+")
+_LINE_EDGE_RE = re.compile(r" ?\n ?")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def compress_text(text):
+    """Collapses the runs of spaces and blank lines PDF extraction leaves behind; the words are untouched."""
+    text = _SPACES_RE.sub(" ", text)
+    text = _LINE_EDGE_RE.sub("\n", text)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def _overlap(a, b):
+    """Length of the longest suffix of `a` that `b` starts with (all of `b` if `a` contains it), else 0."""
+    if b in a:
+        return len(b)
+    probe = b[:MIN_OVERLAP_CHARS]
+    pos = a.find(probe, max(0, len(a) - len(b)))
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(probe, pos + 1)
+    return 0
+
+
+def _join(a, b):
+    """`a` and `b` as one passage if they overlap (in either order), else None."""
+    k = _overlap(a, b)
+    if k == len(b):
+        return a
+    if k >= MIN_OVERLAP_CHARS:
+        return a + b[k:]
+    k = _overlap(b, a)
+    if k == len(a):
+        return b
+    if k >= MIN_OVERLAP_CHARS:
+        return b + a[k:]
+    return None
+
+
+def merge_chunks(docs):
+    """
+    Merges overlapping chunks of the same source page into single passages and drops
+    duplicates. Returns (passages as Documents, the chunks each passage was built from).
+    Passages keep the rank of their best chunk, and that chunk's metadata.
+    """
+    blocks = []   # [best rank, (source, page), text, best doc, chunks]
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        text = compress_text(doc.page_content)
+        for block in blocks:
+            if block[1] == key:
+                joined = _join(block[2], text)
+                if joined is not None:
+                    block[2] = joined
+                    block[4].append(doc)
+                    break
+        else:
+            blocks.append([rank, key, text, doc, [doc]])
+            continue
+
+        # A chunk that bridged two passages of the page joins them too
+        merged = True
+        while merged:
+            merged = False
+            for i, first in enumerate(blocks):
+                for second in blocks[i + 1:]:
+                    joined = first[1] == second[1] and _join(first[2], second[2])
+                    if joined:
+                        first[2] = joined
+                        first[4].extend(second[4])
+                        blocks.remove(second)
+                        merged = True
+                        break
+                if merged:
+                    break
+
+    blocks.sort(key=lambda b: b[0])
+    passages = [doc.model_copy(update={"page_content": text}) for _, _, text, doc, _ in blocks]
+    return passages, [b[4] for b in blocks]
+
+
+def pack_context(docs, role=None, max_tokens=None, timings=None):
+    """
+    Assembles the whole reranked pool into the prompt context:
+    1. Normalizes whitespace and merges overlapping neighbours / duplicates (merge_chunks)
+    2. Takes passages in rank order until the role's token budget is reached (trim_to_budget),
+       so the budget, not a fixed chunk count, decides how much context the LLM sees
+    `timings` gets the tokens the chunks in the context would have cost unmerged, and how many were saved.
+    """
+    start = time.perf_counter()
+    passages, members = merge_chunks(docs)
+    if max_tokens is None:
+        max_tokens = ROLE_CONTEXT_MAX_TOKENS.get(role, CONTEXT_MAX_TOKENS)
+    packed = trim_to_budget(passages, max_tokens, timings=timings)
+    if timings is not None:
+        in_context = [d for chunks in members[:len(packed)] for d in chunks]
+        raw_tokens = sum(count_tokens(d.page_content) for d in in_context)
+        timings["pack_ms"] = (time.perf_counter() - start) * 1000
+        timings["context_chunks"] = len(in_context)
+        timings["context_raw_tokens"] = raw_tokens
+        timings["context_tokens_saved"] = max(0, raw_tokens - timings["context_tokens"])
+        timings["chunks_merged"] = max(0, len(in_context) - len(packed))
+    return packed
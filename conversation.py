@@ -0,0 +1,148 @@
+import re
+import threading
+
+from database import get_chat_history, get_session_summary, save_session_summary
+from token_utils import truncate_tokens
+
+# Configuration: How much conversation reaches the LLM
+# - HISTORY_TURNS recent question/answer pairs are quoted verbatim
+# - older turns are folded into a rolling summary, SUMMARY_BATCH_TURNS at a time
+# - every quoted message and the summary are capped in tokens, so the condense
+#   prompt stays bounded however long the session gets
+HISTORY_TURNS = 3
+SUMMARY_BATCH_TURNS = 2
+MESSAGE_MAX_TOKENS = 200
+SUMMARY_MAX_TOKENS = 300
+
+# Only questions that look like follow-ups are condensed (one LLM call each); the rest go
+# straight to the answer cache and retrieval. A follow-up refers back ("is it safe for
+# them?"), continues ("and for children?", "what about Ward 3?") or is too short to
+# stand alone ("dosage?").
+FOLLOW_UP_MAX_WORDS = 3
+FOLLOW_UP_REFERENCES = re.compile(
+    r"\b(it|its|it's|they|them|their|theirs|this|that|these|those|he|him|his|she|her|hers|"
+    r"there|same|above|previous|former|latter|else|instead|one|ones)\b",
+    re.IGNORECASE,
+)
+FOLLOW_UP_OPENERS = re.compile(
+    r"^\s*(and|or|but|also|then|what about|how about|what if|why not|how come|what else|anything else)\b",
+    re.IGNORECASE,
+)
+
+CONDENSE_PROMPT = """Given the conversation so far and a follow-up question, rewrite the follow-up \
+as a single standalone question that can be understood without the conversation. \
+Keep names, drug names, ward codes and form numbers exactly as written. \
+If it is already standalone, return it unchanged. Return only the question.
+
+Summary of earlier conversation:
+{summary}
+
+Recent messages:
+{recent}
+
+Follow-up question: {question}
+Standalone question:"""
+
+SUMMARY_PROMPT = """Update the running summary of a hospital assistant conversation with the new messages. \
+Keep the topics, entities and facts the user may refer back to. Stay under {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+
+def _format_messages(messages):
+    return "\n".join(
+        f"{m['role'].title()}: {truncate_tokens(m['content'], MESSAGE_MAX_TOKENS)}" for m in messages
+    )
+
+
+def is_follow_up(query):
+    """Cheap check for anaphora or ellipsis; False means the question already stands alone."""
+    return bool(
+        len(query.split()) <= FOLLOW_UP_MAX_WORDS
+        or FOLLOW_UP_REFERENCES.search(query)
+        or FOLLOW_UP_OPENERS.search(query)
+    )
+
+
+def _unsummarized(session_id, query=None):
+    """Returns (summary, messages it does not cover yet), newest last."""
+    summary, through_id = get_session_summary(session_id)
+    # At most this many unsummarized messages are read (+1 for the question being asked)
+    messages = get_chat_history(
+        session_id, after_id=through_id, limit=2 * (HISTORY_TURNS + SUMMARY_BATCH_TURNS) + 1
+    )
+    # The app saves the new question before answering it; it isn't history yet
+    if query is not None and messages and messages[-1]["role"] == "user" and messages[-1]["content"] == query:
+        messages = messages[:-1]
+    return summary, messages
+
+
+def refresh_summary(llm, session_id):
+    """
+    Once enough turns have slid out of the verbatim window, folds them into the stored
+    summary with one LLM call, so older turns are never re-summarized. Runs after an
+    answer has been delivered (see start_summary_refresh), never on the question path.
+    """
+    summary, messages = _unsummarized(session_id)
+    keep = 2 * HISTORY_TURNS
+    if len(messages) < keep + 2 * SUMMARY_BATCH_TURNS:
+        return
+    older = messages[:-keep]
+    updated = llm.invoke(SUMMARY_PROMPT.format(
+        max_words=int(SUMMARY_MAX_TOKENS * 0.7),
+        summary=summary or "(none)",
+        messages=_format_messages(older),
+    )).content.strip()
+    save_session_summary(session_id, truncate_tokens(updated, SUMMARY_MAX_TOKENS), older[-1]["id"])
+
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def start_summary_refresh(llm, session_id):
+    """Runs refresh_summary in a background thread; a session already being refreshed is skipped."""
+    with _refreshing_lock:
+        if session_id in _refreshing:
+            return None
+        _refreshing.add(session_id)
+
+    def run():
+        try:
+            refresh_summary(llm, session_id)
+        except Exception as e:
+            print(f"Summary refresh for session {session_id} failed: {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(session_id)
+
+    thread = threading.Thread(target=run, name=f"summary-{session_id}", daemon=True)
+    thread.start()
+    return thread
+
+
+def condense_query(llm, session_id, query):
+    """
+    Rewrites a follow-up ("what about for children?") into a standalone retrieval query
+    using the session's rolling summary and last few turns. Returns `query` unchanged,
+    without an LLM call, for a fresh session or a question that already stands alone.
+    """
+    if session_id is None or not is_follow_up(query):
+        return query
+    summary, recent = _unsummarized(session_id, query)
+    # Turns not yet folded into the summary (a refresh may still be running) are dropped here
+    recent = recent[-2 * HISTORY_TURNS:]
+    if not summary and not recent:
+        return query
+    standalone = llm.invoke(CONDENSE_PROMPT.format(
+        summary=summary or "(none)",
+        recent=_format_messages(recent) or "(none)",
+        question=query,
+    )).content.strip()
+    return standalone or query
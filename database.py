@@ -1,15 +1,153 @@
+import hashlib
+import hmac
+import queue
+import secrets
 import sqlite3
-import bcrypt
+import threading
+import time
+from contextlib import contextmanager
 import uuid
+from passwords import check_password, hash_password, needs_rehash
+from telemetry import traced
 
 # Configuration: Standardize database file name
 DB_NAME = "hospital_users.db"
 
+# Connection tuning: how long a writer waits for a lock, and how many prepared
+# statements each connection keeps compiled
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 128
+
+# Sidebar titles are the first characters of a session's first question
+SESSION_TITLE_LENGTH = 40
+
+# Password-reset codes: lifetime, wrong guesses allowed per code, and minimum gap between sends
+OTP_TTL_SECONDS = 600
+OTP_MAX_ATTEMPTS = 5
+OTP_RESEND_SECONDS = 60
+
+# Token buckets for sending codes, as (burst, seconds per new token). Kept in SQLite so
+# they hold across browser sessions and across app processes sharing the database.
+OTP_EMAIL_BUCKET = (3, 600)   # 3 codes at once, then one every 10 minutes per address
+OTP_IP_BUCKET = (10, 60)      # 10 codes at once, then one a minute per client IP
+RATE_BUCKET_IDLE_SECONDS = 86400  # buckets untouched this long are full again; drop them
+
+# Idle connections kept open for reuse. Streamlit runs each rerun on a new thread, so
+# connections are shared across threads rather than owned by one; a busier moment
+# opens extra ones, and any beyond this many are closed when handed back.
+POOL_SIZE = 8
+
+_pool = queue.LifoQueue()
+_pool_lock = threading.Lock()
+# The connection this thread has checked out, so nested use shares one transaction
+_local = threading.local()
+
+# --- CONNECTION MANAGEMENT ---
+
+def _open_connection():
+    # isolation_level=None: autocommit for reads, explicit BEGIN in transaction()
+    # check_same_thread=False: a pooled connection serves whichever thread checks it out
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    # WAL lets readers and a writer work concurrently; NORMAL is durable in WAL mode
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+def _checkout():
+    while True:
+        try:
+            db_name, conn = _pool.get_nowait()
+        except queue.Empty:
+            return DB_NAME, _open_connection()
+        if db_name == DB_NAME:
+            return db_name, conn
+        conn.close()
+
+def _checkin(db_name, conn):
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if db_name == DB_NAME and _pool.qsize() < POOL_SIZE:
+            _pool.put((db_name, conn))
+            return
+    conn.close()
+
+@contextmanager
+def connection():
+    """
+    Checks a pooled connection out for the enclosed block (results must be fetched
+    inside it). Connections and their cached prepared statements outlive the thread
+    that used them, so a rerun or chat turn does not reconnect. Nested use on the same
+    thread gets the connection already checked out.
+    """
+    held = getattr(_local, "held", None)
+    if held is not None:
+        yield held[1]
+        return
+    held = _checkout()
+    _local.held = held
+    try:
+        yield held[1]
+    finally:
+        _local.held = None
+        _checkin(*held)
+
+@contextmanager
+def transaction():
+    """
+    Runs the enclosed statements as one write transaction and yields a cursor.
+    BEGIN IMMEDIATE takes the write lock up front (waiting up to the busy timeout)
+    instead of failing halfway through. Nested use joins the outer transaction.
+    """
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn.cursor()
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+def close_connections():
+    """Closes the idle pooled connections (e.g. before deleting the database file)."""
+    while True:
+        try:
+            _pool.get_nowait()[1].close()
+        except queue.Empty:
+            return
+
 def init_db():
-    """Initializes the database and ensures all tables/columns exist."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
+    """
+    Initializes the database and brings the schema up to date.
+    Applies every migration newer than the file's PRAGMA user_version, in order,
+    inside a single transaction. Streamlit calls this on every rerun, so an
+    up-to-date schema is detected with a plain read and never takes the write lock.
+    """
+    with connection() as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            return
+    with transaction() as cursor:
+        # Re-read under the lock: another session or process may have just migrated
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for target, migrate in enumerate(MIGRATIONS, start=1):
+            if target > version:
+                migrate(cursor)
+                cursor.execute(f"PRAGMA user_version = {target}")
+
+# --- SCHEMA MIGRATIONS ---
+
+def _migration_1_base_tables(cursor):
     # 1. Users Table (Uses 'email' as primary identifier)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -30,134 +168,240 @@ def init_db():
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    conn.commit()
-    conn.close()
+
+def _migration_2_sessions_and_indexes(cursor):
+    # 1. Indexes for the two hot queries: a user's messages and a session's messages
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_user_time ON chat_history (user_email, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_session_id ON chat_history (session_id, id)")
+
+    # 2. First-class sessions, so the sidebar list no longer scans chat_history
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_email TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_active DATETIME DEFAULT CURRENT_TIMESTAMP,
+            title TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_active ON sessions (user_email, last_active)")
+
+    # 3. Backfill from existing history (title = start of the first user message)
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO sessions (id, user_email, created_at, last_active, title)
+        SELECT h.session_id, h.user_email, MIN(h.timestamp), MAX(h.timestamp),
+               (SELECT substr(f.content, 1, {SESSION_TITLE_LENGTH}) FROM chat_history f
+                WHERE f.session_id = h.session_id AND f.role = 'user'
+                ORDER BY f.id LIMIT 1)
+        FROM chat_history h
+        WHERE h.session_id IS NOT NULL
+        GROUP BY h.session_id
+    """)
+
+def _migration_3_session_summaries(cursor):
+    # Rolling summary of the turns that no longer fit in the conversation window
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_through_id INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _migration_4_otp_and_rate_limits(cursor):
+    # 1. One live reset code per address (only its salted hash is stored)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS otp_codes (
+            email TEXT PRIMARY KEY,
+            code_hash TEXT NOT NULL,
+            salt TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )
+    """)
+
+    # 2. Token buckets keyed by e.g. "otp:email:<address>" or "otp:ip:<address>"
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rate_buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+
+# Append new migrations here; never edit or reorder released ones
+MIGRATIONS = [
+    _migration_1_base_tables,
+    _migration_2_sessions_and_indexes,
+    _migration_3_session_summaries,
+    _migration_4_otp_and_rate_limits,
+]
 
 # --- SESSION MANAGEMENT ---
 
+@traced("db.create_new_session")
 def create_new_session(user_email):
     """Generates a unique 8-character string for a conversation thread."""
     return str(uuid.uuid4())[:8]
 
+@traced("db.list_sessions")
+def list_sessions(user_email):
+    """Returns a user's sessions (id, title, last_active), most recently active first."""
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT id, title, last_active FROM sessions
+            WHERE user_email = ? ORDER BY last_active DESC, rowid DESC
+        """, (user_email,)).fetchall()
+    return [{"id": row[0], "title": row[1], "last_active": row[2]} for row in rows]
+
 def get_user_sessions(user_email):
     """Retrieves list of session IDs belonging to a user."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # Corrected: Query uses user_email column
-    c.execute("""
-        SELECT DISTINCT session_id FROM chat_history 
-        WHERE user_email = ? ORDER BY timestamp DESC
-    """, (user_email,))
-    sessions = [row[0] for row in c.fetchall() if row[0] is not None]
-    conn.close()
-    return sessions
+    return [s["id"] for s in list_sessions(user_email)]
 
+@traced("db.delete_session")
 def delete_session(session_id):
     """Deletes all messages for a specific session ID."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM chat_history WHERE session_id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("DELETE FROM chat_history WHERE session_id = ?", (session_id,))
+        c.execute("DELETE FROM session_summaries WHERE session_id = ?", (session_id,))
+        c.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
 
 # --- MESSAGE LOGIC ---
 
+@traced("db.save_message")
 def save_message(session_id, user_email, role, content):
-    """Inserts a new message into the history table."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO chat_history (session_id, user_email, role, content) 
-        VALUES (?, ?, ?, ?)
-    """, (session_id, user_email, role, content))
-    conn.commit()
-    conn.close()
+    """Inserts a new message into the history table, marks its session as active and returns the message id."""
+    title = content[:SESSION_TITLE_LENGTH] if role == "user" else None
+    with transaction() as c:
+        c.execute("""
+            INSERT INTO chat_history (session_id, user_email, role, content) 
+            VALUES (?, ?, ?, ?)
+        """, (session_id, user_email, role, content))
+        message_id = c.lastrowid
+        c.execute("""
+            INSERT INTO sessions (id, user_email, title) VALUES (?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                last_active = CURRENT_TIMESTAMP,
+                title = COALESCE(sessions.title, excluded.title)
+        """, (session_id, user_email, title))
+    return message_id
 
-def get_chat_history(session_id):
-    """Fetches all messages for a specific session."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("""
-        SELECT role, content FROM chat_history 
-        WHERE session_id = ? ORDER BY timestamp ASC
-    """, (session_id,))
-    history = [{"role": row[0], "content": row[1]} for row in c.fetchall()]
-    conn.close()
+@traced("db.get_chat_history")
+def get_chat_history(session_id, before_id=None, limit=None, after_id=None):
+    """
+    Fetches messages for a specific session, oldest first.
+    With `limit`, returns only the newest `limit` messages older than `before_id`
+    (keyset pagination on the (session_id, id) index); without it, the whole session.
+    `after_id` additionally skips everything up to and including that message.
+    """
+    after = after_id if after_id is not None else 0
+    with connection() as conn:
+        c = conn.cursor()
+        if limit is None:
+            c.execute("""
+                SELECT id, role, content FROM chat_history 
+                WHERE session_id = ? AND id > ? ORDER BY id ASC
+            """, (session_id, after))
+            rows = c.fetchall()
+        else:
+            c.execute("""
+                SELECT id, role, content FROM chat_history
+                WHERE session_id = ? AND id > ? AND id < ? ORDER BY id DESC LIMIT ?
+            """, (session_id, after, before_id if before_id is not None else 2**63 - 1, limit))
+            rows = c.fetchall()[::-1]
+    history = [{"id": row[0], "role": row[1], "content": row[2]} for row in rows]
     return history
 
+@traced("db.get_session_summary")
+def get_session_summary(session_id):
+    """Returns (rolling summary, id of the last message it covers) for a session."""
+    with connection() as conn:
+        row = conn.execute("""
+            SELECT summary, summarized_through_id FROM session_summaries WHERE session_id = ?
+        """, (session_id,)).fetchone()
+    return (row[0], row[1]) if row else ("", 0)
+
+@traced("db.save_session_summary")
+def save_session_summary(session_id, summary, summarized_through_id):
+    """Stores the updated rolling summary of a session."""
+    with transaction() as c:
+        c.execute("""
+            INSERT INTO session_summaries (session_id, summary, summarized_through_id)
+            VALUES (?, ?, ?)
+            ON CONFLICT (session_id) DO UPDATE SET
+                summary = excluded.summary,
+                summarized_through_id = excluded.summarized_through_id,
+                updated_at = CURRENT_TIMESTAMP
+        """, (session_id, summary, summarized_through_id))
+
+@traced("db.clear_chat_history")
 def clear_chat_history(user_email):
     """Wipes all records for a user."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # Corrected: column name updated to user_email
-    c.execute("DELETE FROM chat_history WHERE user_email = ?", (user_email,))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        # Corrected: column name updated to user_email
+        c.execute("DELETE FROM chat_history WHERE user_email = ?", (user_email,))
+        c.execute("""
+            DELETE FROM session_summaries
+            WHERE session_id IN (SELECT id FROM sessions WHERE user_email = ?)
+        """, (user_email,))
+        c.execute("DELETE FROM sessions WHERE user_email = ?", (user_email,))
 
 # --- AUTHENTICATION ---
 
+@traced("db.add_user")
 def add_user(user_email, password, role):
     """Registers a new user. Admins can only be created via special setup tool."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    # Check if we are creating the very first user (Special case for Admin Setup Tool)
-    c.execute("SELECT COUNT(*) FROM users")
-    user_count = c.fetchone()[0]
-
     # Security Guard: Only allow Admin role if it's the first ever user 
     # OR if explicitly called through code logic.
     allowed_roles = ["Patient", "Staff", "Admin"]
     final_role = role if role in allowed_roles else "Patient"
 
+    # Generate secure hash in the bcrypt pool (outside the write lock)
+    hashed_pw = hash_password(password)
     try:
-        # Generate secure hash and decode to string for storage
-        hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        c.execute("INSERT INTO users (email, password, role) VALUES (?, ?, ?)", 
-                  (user_email, hashed_pw, final_role))
-        conn.commit()
+        with transaction() as c:
+            c.execute("INSERT INTO users (email, password, role) VALUES (?, ?, ?)", 
+                      (user_email, hashed_pw, final_role))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
+@traced("db.verify_user")
 def verify_user(email, password):
-    """Verifies credentials."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT password, role FROM users WHERE email = ?", (email,))
-    result = c.fetchone()
-    conn.close()
+    """Verifies credentials. A hash made with an outdated bcrypt cost is replaced on successful login."""
+    # Fetched and handed back before the (slow) bcrypt check
+    with connection() as conn:
+        result = conn.execute("SELECT password, role FROM users WHERE email = ?", (email,)).fetchone()
 
     if result:
         hashed_pwd, role = result
-        # bcrypt.checkpw expects (bytes, bytes)
-        if bcrypt.checkpw(password.encode('utf-8'), hashed_pwd.encode('utf-8')):
+        if check_password(password, hashed_pwd):
+            if needs_rehash(hashed_pwd):
+                # Only replace the hash we verified, in case the password changed meanwhile
+                new_hash = hash_password(password)
+                with transaction() as c:
+                    c.execute("UPDATE users SET password = ? WHERE email = ? AND password = ?",
+                              (new_hash, email, hashed_pwd))
             return role
     return None
 
 def admin_exists():
     """Checks if any Admin exists."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM users WHERE role = 'Admin' LIMIT 1")
-    result = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        result = conn.execute("SELECT 1 FROM users WHERE role = 'Admin' LIMIT 1").fetchone()
     return result is not None
 
 def reset_user_password(user_email, new_password):
     """Hashes new password and updates record."""
     try:
-        # Encode to string for SQLite storage
-        hashed_pwd = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        # Hashed in the bcrypt pool; stored as a string
+        hashed_pwd = hash_password(new_password)
         
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET password = ? WHERE email = ?", (hashed_pwd, user_email))
-        conn.commit()
-        updated = cursor.rowcount > 0
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute("UPDATE users SET password = ? WHERE email = ?", (hashed_pwd, user_email))
+            updated = cursor.rowcount > 0
         return updated
     except Exception as e:
         print(f"Database error: {e}")
@@ -166,9 +410,99 @@ def reset_user_password(user_email, new_password):
 # To check wether the user exist or not
 def user_exists(email):
     """Checks if an email is registered in the system."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM users WHERE email = ?", (email,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
\ No newline at end of file
+    with connection() as conn:
+        result = conn.execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone()
+    return result is not None
+
+# --- PASSWORD RESET CODES ---
+
+def _hash_otp(salt, code):
+    # A 6-digit code has little entropy to protect, and expiry plus the attempt cap
+    # bound guessing, so a salted SHA-256 is enough (bcrypt would only add latency)
+    return hashlib.sha256(f"{salt}:{code}".encode()).hexdigest()
+
+def _otp_buckets(email, ip):
+    buckets = [(f"otp:email:{email.lower()}",) + OTP_EMAIL_BUCKET]
+    if ip:
+        buckets.append((f"otp:ip:{ip}",) + OTP_IP_BUCKET)
+    return buckets
+
+def _bucket_tokens(cursor, key, burst, refill_seconds, now):
+    """Tokens currently in a bucket, after refilling it for the time since its last use."""
+    row = cursor.execute("SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return float(burst)
+    tokens, updated_at = row
+    return min(float(burst), tokens + (now - updated_at) / refill_seconds)
+
+def _otp_wait(cursor, email, ip, now):
+    """Seconds until a code may be sent to email from ip (0 = now), and the bucket levels."""
+    row = cursor.execute("SELECT created_at FROM otp_codes WHERE email = ?", (email,)).fetchone()
+    wait = OTP_RESEND_SECONDS - (now - row[0]) if row else 0.0
+    levels = []
+    for key, burst, refill_seconds in _otp_buckets(email, ip):
+        tokens = _bucket_tokens(cursor, key, burst, refill_seconds, now)
+        levels.append((key, tokens))
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) * refill_seconds)
+    return max(wait, 0.0), levels
+
+def otp_wait_seconds(email, ip=None):
+    """How long until issue_otp would send another code to this email (0 if it would now)."""
+    with connection() as conn:
+        return _otp_wait(conn.cursor(), email, ip, time.time())[0]
+
+@traced("db.issue_otp")
+def issue_otp(email, ip=None):
+    """
+    Creates a new reset code for email, replacing any earlier one.
+    Returns (code, 0), or (None, seconds to wait) while the resend cooldown or the
+    per-email / per-IP rate limit applies. Only a hash of the code is stored.
+    """
+    now = time.time()
+    with transaction() as c:
+        wait, levels = _otp_wait(c, email, ip, now)
+        if wait > 0:
+            return None, wait
+
+        # 1. Spend one token from each bucket
+        c.executemany(
+            "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+            ((key, tokens - 1, now) for key, tokens in levels),
+        )
+
+        # 2. Store the new code (this also resets its attempt count)
+        code = str(secrets.randbelow(900000) + 100000)
+        salt = secrets.token_hex(16)
+        c.execute(
+            "INSERT OR REPLACE INTO otp_codes (email, code_hash, salt, expires_at, attempts, created_at) "
+            "VALUES (?, ?, ?, ?, 0, ?)",
+            (email, _hash_otp(salt, code), salt, now + OTP_TTL_SECONDS, now),
+        )
+
+        # 3. Housekeeping: expired codes and long-idle buckets
+        c.execute("DELETE FROM otp_codes WHERE expires_at < ?", (now,))
+        c.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - RATE_BUCKET_IDLE_SECONDS,))
+    return code, 0
+
+@traced("db.verify_otp")
+def verify_otp(email, code):
+    """
+    Checks a reset code. A correct code is consumed; a wrong one counts against
+    OTP_MAX_ATTEMPTS, after which (or once expired) the code no longer works.
+    """
+    now = time.time()
+    with transaction() as c:
+        row = c.execute(
+            "SELECT code_hash, salt, expires_at, attempts FROM otp_codes WHERE email = ?", (email,)
+        ).fetchone()
+        if row is None:
+            return False
+        code_hash, salt, expires_at, attempts = row
+        if expires_at < now or attempts >= OTP_MAX_ATTEMPTS:
+            return False
+        if hmac.compare_digest(code_hash, _hash_otp(salt, str(code).strip())):
+            c.execute("DELETE FROM otp_codes WHERE email = ?", (email,))
+            return True
+        c.execute("UPDATE otp_codes SET attempts = attempts + 1 WHERE email = ?", (email,))
+    return False
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Configuration: Where cached vectors live and how much disk they may use
+CACHE_DB = os.getenv("EMBED_CACHE_DB", "embedding_cache.db")
+CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# When over budget, evict down to this fraction so eviction doesn't run on every insert
+EVICT_TO_FRACTION = 0.9
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _as_float32(vector):
+    return np.asarray(vector, dtype=np.float32).tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of any LangChain embeddings object.
+    Vectors are keyed by (model name, sha256 of text), stored as float32 blobs in
+    SQLite and evicted least-recently-used once the byte budget is exceeded.
+    """
+
+    def __init__(self, embeddings, db_path=CACHE_DB, max_bytes=CACHE_MAX_BYTES):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    # --- LangChain Embeddings interface ---
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(t) for t in texts]
+        found = self._lookup(set(hashes))
+
+        # Embed each distinct missing text once, even if it repeats within the batch
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found:
+                missing.setdefault(h, t)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            # Round through float32 so a miss returns exactly what a later hit will
+            fresh = {h: _as_float32(v) for h, v in zip(missing, vectors)}
+            self._store(fresh)
+            found.update(fresh)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [found[h] for h in hashes]
+
+    def embed_query(self, text):
+        h = text_hash(text)
+        found = self._lookup({h})
+        if h in found:
+            with self._lock:
+                self.hits += 1
+            return found[h]
+
+        vector = _as_float32(self.embeddings.embed_query(text))
+        self._store({h: vector})
+        with self._lock:
+            self.misses += 1
+        return vector
+
+    # --- Storage ---
+
+    def _lookup(self, hashes):
+        """Returns {hash: vector} for cached entries and marks them as recently used."""
+        if not hashes:
+            return {}
+        found = {}
+        keys = list(hashes)
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, self.model, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, vectors):
+        now = time.time()
+        rows = [
+            (self.model, h, np.asarray(v, dtype=np.float32).tobytes(), now)
+            for h, v in vectors.items()
+        ]
+        if not rows:
+            return
+        with self._lock:
+            # Another thread may have stored the same text meanwhile; keep the first copy
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._total_bytes += cursor.rowcount * len(rows[0][2])
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drops least-recently-used vectors until the cache is back under budget. Caller holds the lock."""
+        target = int(self.max_bytes * EVICT_TO_FRACTION)
+        cursor = self._conn.execute(
+            "SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used ASC"
+        )
+        doomed = []
+        total = self._total_bytes
+        for rowid, size in cursor:
+            if total <= target:
+                break
+            doomed.append((rowid,))
+            total -= size
+        self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", doomed)
+        self._total_bytes = total
+
+    # --- Metrics ---
+
+    def stats(self):
+        """Hit/miss counters and current cache size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,148 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+
+# Configuration: Batching, concurrency and rate limits for ingestion embedding calls
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "4"))
+EMBED_REQUESTS_PER_SECOND = float(os.getenv("EMBED_REQUESTS_PER_SECOND", "20"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+# A user's question is retried less (and never waits on the ingestion rate limit)
+QUERY_MAX_RETRIES = 2
+
+# Retries live here, not in the OpenAI client (built with max_retries=0 in rag_pipeline), so
+# every attempt passes the rate limiter and a failure is retried once, not here and there.
+# Backoff window: full jitter between 0 and min(cap, base * 2**attempt)
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 30.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available, then takes them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _is_retryable(error):
+    """What the OpenAI client itself would retry: 429, 408, 409, 5xx, dropped connections and timeouts."""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+def _retry_after(error):
+    """Honours a server-provided Retry-After header when there is one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _with_retries(call, rate_limiter, max_retries, stats):
+    """Runs call(), backing off with jitter whenever it fails with a retryable API error."""
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return call()
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= max_retries:
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            attempt += 1
+            if stats is not None:
+                with stats["lock"]:
+                    stats["retries"] += 1
+            time.sleep(delay)
+
+
+def _embed_batch(embeddings, texts, rate_limiter, max_retries, stats):
+    """Embeds one ingestion batch."""
+    return _with_retries(lambda: embeddings.embed_documents(texts), rate_limiter, max_retries, stats)
+
+
+def embed_query(embeddings, text, max_retries=QUERY_MAX_RETRIES):
+    """Embeds a user's question, with the same retries as ingestion but no rate limiter."""
+    return _with_retries(lambda: embeddings.embed_query(text), None, max_retries, None)
+
+
+_default_rate_limiter = TokenBucket(EMBED_REQUESTS_PER_SECOND)
+
+
+def embed_texts(
+    embeddings,
+    texts,
+    batch_size=EMBED_BATCH_SIZE,
+    max_workers=EMBED_MAX_WORKERS,
+    rate_limiter=_default_rate_limiter,
+    max_retries=EMBED_MAX_RETRIES,
+    progress=None,
+    stats=None,
+):
+    """
+    Embeds `texts` in fixed-size batches on a bounded thread pool and returns the
+    vectors in input order. `progress(done, total)` is called from the calling thread
+    as batches finish, so it may safely update Streamlit elements. If given, `stats`
+    is filled with batch and retry counts.
+    """
+    texts = list(texts)
+    total = len(texts)
+    if stats is not None:
+        stats.update(batches=0, retries=0, lock=threading.Lock())
+    if not texts:
+        return []
+
+    batches = [texts[i:i + batch_size] for i in range(0, total, batch_size)]
+    results = [None] * len(batches)
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(_embed_batch, embeddings, batch, rate_limiter, max_retries, stats): i
+            for i, batch in enumerate(batches)
+        }
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                # Ordered reassembly: each batch lands in its original slot
+                results[i] = future.result()
+                done += len(batches[i])
+                if progress is not None:
+                    progress(done, total)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    if stats is not None:
+        stats["batches"] = len(batches)
+        del stats["lock"]
+    return [vector for batch in results for vector in batch]
@@ -0,0 +1,113 @@
+import threading
+import weakref
+from typing import Optional
+
+import faiss
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+import index_store
+from embedding_pipeline import embed_query
+from access_control import ADMIN_ROLE, role_mask
+from telemetry import span
+
+# Configuration: Candidates taken from each leg before fusion, and the RRF damping constant
+HYBRID_FETCH_K = 20
+RRF_K = 60
+
+# Per-store, per-role FAISS selector bitmaps; dropped with the store when it is swapped out
+_bitmaps = weakref.WeakKeyDictionary()
+_bitmaps_lock = threading.Lock()
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=RRF_K, weights=None):
+    """
+    Fuses several ranked lists of ids into one: score(id) = sum of weight / (rrf_k + rank).
+    Only ranks are used, so BM25 scores and vector distances need no calibration.
+    `weights` (one per ranking, default 1) sets how much each list counts.
+    """
+    scores = {}
+    for ranking, weight in zip(rankings, weights or [1.0] * len(rankings)):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def role_bitmap(vectorstore, role):
+    """
+    Packed bitmap over FAISS positions that `role` may read, in the bit order
+    faiss.IDSelectorBitmap expects. Computed once per store and role.
+    """
+    with _bitmaps_lock:
+        per_role = _bitmaps.setdefault(vectorstore, {})
+        if role not in per_role:
+            docstore, ids = vectorstore.docstore, vectorstore.index_to_docstore_id
+            if hasattr(docstore, "iter_metadata"):
+                # Published (SQLite-backed) docstore: one ordered scan instead of a lookup per chunk
+                metadatas = docstore.iter_metadata()
+            else:
+                metadatas = (docstore.search(ids[i]).metadata for i in range(len(ids)))
+            mask = role_mask(metadatas, role)
+            per_role[role] = np.packbits(mask, bitorder="little")
+        return per_role[role]
+
+
+def dense_search(vectorstore, query, k, role=None, query_vector=None):
+    """
+    FAISS similarity search that skips chunks `role` may not read inside the index scan
+    (IDSelectorBitmap), so the k results all come from the allowed subset. Works with
+    every index backend, applying its nprobe / efSearch per call.
+    Pass `query_vector` if the query has already been embedded. Returns docstore ids, best first.
+    """
+    if query_vector is None:
+        with span("retrieve.embed_query"):
+            query_vector = embed_query(vectorstore.embedding_function, query)
+    vector = np.array([query_vector], dtype=np.float32)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(vector)
+    selector = None
+    if role is not None and role != ADMIN_ROLE:
+        selector = faiss.IDSelectorBitmap(role_bitmap(vectorstore, role))
+    params = index_store.search_params(vectorstore.index, selector)
+    with span("retrieve.faiss", backend=index_store.index_kind(vectorstore.index)):
+        _, positions = vectorstore.index.search(vector, k, params=params)
+    return [vectorstore.index_to_docstore_id[int(i)] for i in positions[0] if i >= 0]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Combines FAISS similarity search with the BM25 lexical index. Exact terms such as
+    drug names, ward codes and form numbers that embeddings tend to blur are still
+    found by the lexical leg; both candidate lists are merged with reciprocal rank fusion.
+    With a `role`, both legs only ever see chunks that role is allowed to read.
+    """
+
+    vectorstore: object
+    lexical: object = None
+    role: Optional[str] = None
+    query_vector: Optional[list] = None
+    k: int = 3
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+
+    def for_role(self, role, query_vector=None):
+        """
+        A copy of this retriever restricted to what `role` may read. A `query_vector`
+        (the embedding of the query it will be invoked with) saves embedding it again.
+        """
+        return self.model_copy(update={"role": role, "query_vector": query_vector})
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        rankings = [dense_search(self.vectorstore, query, self.fetch_k, self.role, self.query_vector)]
+        if self.lexical is not None:
+            with span("retrieve.bm25"):
+                rankings.append([cid for cid, _ in self.lexical.search(query, self.fetch_k, self.role)])
+
+        docs = []
+        for doc_id in reciprocal_rank_fusion(rankings, self.rrf_k)[:self.k]:
+            doc = self.vectorstore.docstore.search(doc_id)
+            # A lexical hit may be missing from an older store mid-swap; skip it
+            if not isinstance(doc, str):
+                docs.append(doc)
+        return docs
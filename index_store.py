@@ -0,0 +1,554 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+import chunk_store
+
+# Configuration: Where the persisted indexes live on disk. Every publish writes a complete,
+# immutable version directory (FAISS index, docstore, BM25 index) under INDEX_DIR and then
+# atomically repoints the CURRENT file at it, so readers in any process see either the old
+# version or the new one, never a mix. Older versions are pruned, keeping INDEX_KEEP_VERSIONS.
+INDEX_DIR = "faiss_index"
+CURRENT_FILE = "CURRENT"
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.db"
+LEGACY_DOCSTORE_FILE = "docstore.json"
+MANIFEST_FILE = "manifest.json"
+LEXICAL_SUBDIR = "lexical"
+MANIFEST_VERSION = 1
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+# v<publish counter>-<publish time>: the zero-padded counter makes names sort in publish order
+VERSION_RE = re.compile(r"^v(\d{8})-\d{8}-\d{6}$")
+
+# Index backend for large corpora:
+# - "flat": exact search over full float32 vectors (default)
+# - "ivf": IVF-Flat, "hnsw": HNSW-Flat, "ivfpq": IVF with product-quantized codes
+# Below ANN_MIN_VECTORS chunks an exact Flat index is used anyway; once the corpus passes
+# it, the ANN index is trained automatically from the stored vectors (no re-embedding).
+INDEX_BACKEND = os.getenv("FAISS_INDEX_BACKEND", "flat")
+ANN_MIN_VECTORS = int(os.getenv("FAISS_ANN_MIN_VECTORS", "20000"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+HNSW_M = 32
+PQ_BITS = 8
+TRAIN_POINTS_PER_CENTROID = 64
+
+
+def chunk_id(doc):
+    """Content hash of a chunk (text + source/page metadata), used as its stable docstore id."""
+    return chunk_store.chunk_hash(doc.page_content, doc.metadata)
+
+
+def build_manifest(chunk_ids, embedding_model):
+    """
+    Describes exactly which chunks an index contains. The digest is order-independent
+    so that appending or replacing a source yields the same manifest as a full rebuild.
+    """
+    digest = hashlib.sha256()
+    digest.update(embedding_model.encode("utf-8"))
+    for cid in sorted(chunk_ids):
+        digest.update(cid.encode("ascii"))
+    return {
+        "version": MANIFEST_VERSION,
+        "embedding_model": embedding_model,
+        "chunk_count": len(chunk_ids),
+        "digest": digest.hexdigest(),
+    }
+
+
+def read_manifest(index_dir=INDEX_DIR):
+    """Returns the saved manifest, or None if no (readable) index exists."""
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _atomic_write(path, write_fn):
+    """Writes to a temp file next to `path` and renames it into place."""
+    tmp_path = f"{path}.tmp"
+    write_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, data):
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+    _atomic_write(path, write)
+
+
+class MappedDocstore(Docstore):
+    """
+    Read-only docstore over the SQLite file of a published version. Versions never
+    change, so the file is opened immutable (no locking) and chunk text stays in the OS
+    page cache, shared by every worker process, instead of being parsed into each heap.
+    The file is opened once, when the version is loaded: the open handle keeps working
+    after the writer prunes the version, so sessions still on it are never cut off.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(
+            f"file:{quote(os.path.abspath(path))}?mode=ro&immutable=1", uri=True, check_same_thread=False
+        )
+        # Streamlit runs every rerun on its own thread; they share the one connection
+        self._lock = threading.Lock()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def search(self, search):
+        rows = self._query("SELECT page_content, metadata FROM docs WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=rows[0][0], metadata=json.loads(rows[0][1]))
+
+    def ids(self):
+        """Docstore ids in FAISS position order (positions may have gaps; only their order counts)."""
+        return [doc_id for (doc_id,) in self._query("SELECT id FROM docs ORDER BY position")]
+
+    def iter_metadata(self):
+        """Every chunk's metadata in FAISS position order, in one scan."""
+        for (metadata,) in self._query("SELECT metadata FROM docs ORDER BY position"):
+            yield json.loads(metadata)
+
+    def ids_for_sources(self, sources):
+        """Ids of every chunk from the given source files, found by SQLite instead of a Python scan."""
+        sources = [s for s in sources if s is not None]
+        if not sources:
+            return []
+        return [doc_id for (doc_id,) in self._query(
+            f"SELECT id FROM docs WHERE json_extract(metadata, '$.source') IN ({', '.join('?' * len(sources))})",
+            sources,
+        )]
+
+    def as_dict(self):
+        """{id: Document} of the whole store, for building a writable copy."""
+        return {
+            doc_id: Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+            for doc_id, text, metadata in self._query("SELECT id, page_content, metadata FROM docs")
+        }
+
+    def backup(self, path):
+        """Copies the store page by page into a new SQLite file at `path` (works after pruning too)."""
+        target = sqlite3.connect(path)
+        try:
+            with self._lock:
+                self._conn.backup(target)
+        finally:
+            target.close()
+
+
+class DeltaDocstore(Docstore, AddableMixin):
+    """
+    Writable docstore for the next version: a published MappedDocstore plus the chunks
+    added and deleted since. Nothing is copied up front, and save_index() writes only the
+    delta on top of a copy of the published file.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.added = {}
+        self.deleted = set()
+
+    def copy(self):
+        other = DeltaDocstore(self.base)
+        other.added = dict(self.added)
+        other.deleted = set(self.deleted)
+        return other
+
+    def _in_base(self, doc_id):
+        return doc_id not in self.deleted and isinstance(self.base.search(doc_id), Document)
+
+    def add(self, texts):
+        overlapping = [doc_id for doc_id in texts if doc_id in self.added or self._in_base(doc_id)]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self.added.update(texts)
+
+    def delete(self, ids):
+        for doc_id in ids:
+            if self.added.pop(doc_id, None) is None:
+                self.deleted.add(doc_id)
+
+    def search(self, search):
+        if search in self.added:
+            return self.added[search]
+        if search in self.deleted:
+            return f"ID {search} not found."
+        return self.base.search(search)
+
+    def ids_for_sources(self, sources):
+        ids = [doc_id for doc_id in self.base.ids_for_sources(sources) if doc_id not in self.deleted]
+        return ids + [doc_id for doc_id, doc in self.added.items() if doc.metadata.get("source") in sources]
+
+
+def ids_for_sources(vectorstore, sources):
+    """Docstore ids of every chunk in a FAISS store that comes from one of `sources`."""
+    docstore = vectorstore.docstore
+    if isinstance(docstore, (MappedDocstore, DeltaDocstore)):
+        return docstore.ids_for_sources(sources)
+    return [
+        doc_id for doc_id in vectorstore.index_to_docstore_id.values()
+        if docstore.search(doc_id).metadata.get("source") in sources
+    ]
+
+
+def save_index(vectorstore, manifest, index_dir):
+    """
+    Writes the FAISS index and its docstore into `index_dir`. The docstore is an SQLite
+    file (never pickle) and the manifest is written last, so it only ever describes a
+    complete index. Use publish_index() to make a version live.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+
+    # 1. Raw vectors in FAISS' native binary format
+    _atomic_write(
+        os.path.join(index_dir, INDEX_FILE),
+        lambda tmp_path: faiss.write_index(vectorstore.index, tmp_path),
+    )
+
+    # 2. Chunk text + metadata, keyed by id and stored in index order (a DeltaDocstore
+    #    is written as its published file plus the changes)
+    def write_docstore(tmp_path):
+        ids = vectorstore.index_to_docstore_id
+        if isinstance(vectorstore.docstore, DeltaDocstore) and _write_delta(vectorstore.docstore, ids, tmp_path):
+            return
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("""
+                CREATE TABLE docs (
+                    position INTEGER PRIMARY KEY,
+                    id TEXT NOT NULL UNIQUE,
+                    page_content TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )
+            """)
+            with conn:
+                conn.executemany(
+                    "INSERT INTO docs (position, id, page_content, metadata) VALUES (?, ?, ?, ?)",
+                    (
+                        (i, ids[i], doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                        for i, doc in ((i, vectorstore.docstore.search(ids[i])) for i in range(len(ids)))
+                    ),
+                )
+        finally:
+            conn.close()
+    _atomic_write(os.path.join(index_dir, DOCSTORE_FILE), write_docstore)
+
+    # 3. Manifest last: it is the commit point for readers
+    _write_json(os.path.join(index_dir, MANIFEST_FILE), manifest)
+
+
+def _write_delta(docstore, ids, tmp_path):
+    """
+    Writes a DeltaDocstore as a copy of its published file plus the delta, so an upload
+    costs a page copy and its own rows rather than re-serializing every chunk.
+    Returns False if the result doesn't line up with the FAISS positions (the caller
+    then writes the whole store).
+    """
+    try:
+        docstore.base.backup(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Docstore copy error: {e}")
+        return False
+    try:
+        with conn:
+            # Only the order of `position` matters (FAISS keeps survivors in order), so
+            # deleted rows just leave gaps and new chunks go after the last row
+            conn.executemany("DELETE FROM docs WHERE id = ?", ((doc_id,) for doc_id in docstore.deleted))
+            kept, last = conn.execute("SELECT COUNT(*), COALESCE(MAX(position), -1) FROM docs").fetchone()
+            rows = []
+            for i in range(kept, len(ids)):
+                doc = docstore.added.get(ids[i])
+                if doc is None:
+                    return False
+                rows.append((last + 1 + i - kept, ids[i], doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+            conn.executemany("INSERT INTO docs (position, id, page_content, metadata) VALUES (?, ?, ?, ?)", rows)
+            stored = [doc_id for (doc_id,) in conn.execute("SELECT id FROM docs ORDER BY position")]
+        return stored == [ids[i] for i in range(len(ids))]
+    except sqlite3.Error as e:
+        print(f"Docstore delta error: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def current_version(index_dir=INDEX_DIR):
+    """Name of the published version directory, or None if nothing has been published yet."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def version_dir(name, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, name)
+
+
+def publish_index(vectorstore, manifest, lexical, index_dir=INDEX_DIR):
+    """
+    Publishes a new index version and returns its name:
+    1. Writes the FAISS index, docstore and BM25 index into a private staging directory
+    2. Renames it to its final version name (readers never see a half-written directory)
+    3. Atomically replaces CURRENT, which is what readers poll
+    Meant for a single writer; readers only ever open published versions.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+
+    # 1. Stage
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=index_dir)
+    try:
+        save_index(vectorstore, manifest, staging)
+        lexical.save(manifest["digest"], os.path.join(staging, LEXICAL_SUBDIR))
+
+        # 2. Name it one past the newest version; rename fails rather than overwrite one
+        name = _next_version(index_dir)
+        os.rename(staging, version_dir(name, index_dir))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    # 3. Commit point
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+    _atomic_write(os.path.join(index_dir, CURRENT_FILE), write)
+
+    _prune_versions(index_dir, name)
+    return name
+
+
+def _version_order(name):
+    """Sort key in publish order; names from before the counter sort as oldest."""
+    match = VERSION_RE.match(name)
+    return (1, int(match.group(1))) if match else (0, name)
+
+
+def _next_version(index_dir):
+    """Name for the next version: the publish counter one past the newest version, plus the time."""
+    names = os.listdir(index_dir) + [current_version(index_dir) or ""]
+    counters = [_version_order(n)[1] for n in names if VERSION_RE.match(n)]
+    return f"v{max(counters, default=0) + 1:08d}-{time.strftime('%Y%m%d-%H%M%S')}"
+
+
+def _prune_versions(index_dir, current):
+    """
+    Deletes all but the newest INDEX_KEEP_VERSIONS versions, leftover staging dirs and
+    index files from before versioning. Processes still serving an old version keep
+    working: the FAISS and BM25 files stay mapped and the docstore stays open (see
+    MappedDocstore) until that version is dropped.
+    """
+    versions = sorted(
+        (n for n in os.listdir(index_dir) if n.startswith("v") and n != current), key=_version_order
+    )
+    doomed = versions[:max(0, len(versions) - (INDEX_KEEP_VERSIONS - 1))]
+    doomed += [n for n in os.listdir(index_dir) if n.startswith(".staging-")
+               and time.time() - os.path.getmtime(version_dir(n, index_dir)) > 3600]
+    for name in doomed:
+        shutil.rmtree(version_dir(name, index_dir), ignore_errors=True)
+    for name in (INDEX_FILE, LEGACY_DOCSTORE_FILE, MANIFEST_FILE):
+        if os.path.isfile(os.path.join(index_dir, name)):
+            os.remove(os.path.join(index_dir, name))
+
+
+def load_index(embeddings, manifest, index_dir):
+    """
+    Memory-maps the index saved in `index_dir` if its manifest matches `manifest`
+    (pass None to accept whatever is there, as read-only workers do).
+    Returns None when the index is missing or stale, so the caller rebuilds.
+    """
+    saved = read_manifest(index_dir)
+    if saved is None or (manifest is not None and saved.get("digest") != manifest["digest"]):
+        return None
+
+    try:
+        # IO_FLAG_MMAP_IFC maps the vectors straight from disk instead of copying them into RAM
+        index = faiss.read_index(os.path.join(index_dir, INDEX_FILE), faiss.IO_FLAG_MMAP_IFC)
+        if os.path.exists(os.path.join(index_dir, DOCSTORE_FILE)):
+            docstore = MappedDocstore(os.path.join(index_dir, DOCSTORE_FILE))
+            ids = docstore.ids()
+        else:
+            # Indexes saved before versioning kept the docstore as JSON
+            with open(os.path.join(index_dir, LEGACY_DOCSTORE_FILE), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            ids = stored["ids"]
+            docstore = InMemoryDocstore({
+                doc_id: Document(id=doc_id, page_content=d["page_content"], metadata=d["metadata"])
+                for doc_id, d in stored["documents"].items()
+            })
+    except (OSError, RuntimeError, sqlite3.Error, json.JSONDecodeError) as e:
+        print(f"Index load error: {e}")
+        return None
+
+    if index.ntotal != len(ids):
+        return None
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+
+
+def copy_vectorstore(vectorstore):
+    """
+    Returns an independent, writable copy of a FAISS store. Memory-mapped indexes are
+    read-only, and copying also keeps concurrent searches on the old store safe while
+    the copy is being modified. The vectors are copied (one memcpy-speed pass); a
+    published docstore is not, only the changes made to the copy are kept (DeltaDocstore).
+    """
+    index = faiss.deserialize_index(faiss.serialize_index(vectorstore.index))
+    docstore = vectorstore.docstore
+    if isinstance(docstore, MappedDocstore):
+        docstore = DeltaDocstore(docstore)
+    elif isinstance(docstore, DeltaDocstore):
+        docstore = docstore.copy()
+    else:
+        docstore = InMemoryDocstore(dict(docstore._dict))
+    return FAISS(
+        embedding_function=vectorstore.embedding_function,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(vectorstore.index_to_docstore_id),
+    )
+
+
+def index_kind(index):
+    """Which backend a FAISS index implements: "flat", "ivf", "ivfpq" or "hnsw"."""
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def desired_kind(ntotal, backend=None):
+    """The configured backend, or "flat" while the corpus is too small to be worth an ANN index."""
+    backend = backend or INDEX_BACKEND
+    return backend if ntotal >= ANN_MIN_VECTORS else "flat"
+
+
+def _pq_subquantizers(dim):
+    """Largest divisor of dim giving sub-vectors of at least 8 dimensions (e.g. 192 bytes per 1536-d vector)."""
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def new_index(kind, vectors, metric=faiss.METRIC_L2):
+    """Builds (and trains, for IVF kinds) an index of `kind` holding `vectors` in order."""
+    n, dim = vectors.shape
+    if kind == "flat":
+        index = faiss.IndexFlat(dim, metric)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, metric)
+    elif kind in ("ivf", "ivfpq"):
+        # ~4*sqrt(n) lists, but never fewer than 39 training points per list
+        nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+        quantizer = faiss.IndexFlat(dim, metric)
+        if kind == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        else:
+            # Each PQ codebook needs ~39 training points per centroid; shrink codes for tiny corpora
+            nbits = PQ_BITS
+            while nbits > 1 and (1 << nbits) * 39 > n:
+                nbits -= 1
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim), nbits, metric)
+        index.own_fields = True
+        quantizer.this.disown()
+        sample = min(n, nlist * TRAIN_POINTS_PER_CENTROID)
+        picks = np.random.default_rng(0).choice(n, sample, replace=False) if sample < n else slice(None)
+        index.train(vectors[picks])
+    else:
+        raise ValueError(f"Unknown FAISS index backend: {kind}")
+    index.add(vectors)
+    return index
+
+
+def _all_vectors(index):
+    """Every stored vector in position order (approximate for IVF-PQ, whose codes are lossy)."""
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def ensure_backend(vectorstore, backend=None):
+    """
+    Rebuilds the store's index as the backend its size calls for, reusing the stored
+    vectors. Returns True if the index was replaced (the caller should persist it).
+    """
+    index = vectorstore.index
+    kind = desired_kind(index.ntotal, backend)
+    if index.ntotal == 0 or index_kind(index) == kind:
+        return False
+    vectorstore.index = new_index(kind, _all_vectors(index), index.metric_type)
+    return True
+
+
+def delete_ids(vectorstore, ids):
+    """
+    Removes docstore ids from a store. Flat indexes delete in place; IVF keeps stale
+    labels after remove_ids and HNSW cannot remove at all, so those are re-filled from
+    the surviving vectors (IVF reuses its trained centroids).
+    """
+    index = vectorstore.index
+    if index_kind(index) == "flat":
+        vectorstore.delete(ids)
+        return
+
+    doomed = set(ids)
+    keep = [i for i in range(index.ntotal) if vectorstore.index_to_docstore_id[i] not in doomed]
+    vectors = _all_vectors(index)[keep]
+    if isinstance(index, faiss.IndexIVF):
+        fresh = faiss.clone_index(index)
+        fresh.reset()
+        fresh.add(vectors)
+    else:
+        fresh = new_index(index_kind(index), vectors, index.metric_type)
+    vectorstore.index = fresh
+    vectorstore.docstore.delete(list(doomed))
+    vectorstore.index_to_docstore_id = {
+        new: vectorstore.index_to_docstore_id[old] for new, old in enumerate(keep)
+    }
+
+
+def search_params(index, selector=None):
+    """Per-call search parameters (nprobe / efSearch plus an optional ID filter) for any backend."""
+    kind = index_kind(index)
+    if kind in ("ivf", "ivfpq"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=FAISS_NPROBE)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=FAISS_EF_SEARCH)
+    return faiss.SearchParameters(sel=selector) if selector is not None else None
@@ -1,40 +1,42 @@
+import argparse
+import multiprocessing
 import os
-import json
+from collections import deque
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor
 from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
+import chunk_store
+from access_control import ROLES, normalize_roles
+from telemetry import count, span
 
-# Configuration: Where PDFs are stored and where the processed JSON is saved
+# Configuration: Where PDFs are stored (processed chunks go to the chunk store)
 DATA_FOLDER = "data"
-OUTPUT_FILE = "documents.json"
+
+# Parallel parsing: pages per worker task, and how many tasks may be queued per worker.
+# Only (workers * MAX_SHARDS_PER_WORKER * PAGES_PER_SHARD) pages are ever in memory at once.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_SHARD = 8
+MAX_SHARDS_PER_WORKER = 2
 
 # Ensure the data directory exists before processing
 if not os.path.exists(DATA_FOLDER):
     os.makedirs(DATA_FOLDER)
 
-def process_pdf(pdf_path):
-    """
-    Processes a single PDF by loading text, splitting it into manageable chunks, 
-    and appending it to a central documents.json file.
-    """
-    
-    # 1. Load the PDF file using LangChain's PyPDFLoader
-    loader = PyPDFLoader(pdf_path)
-    docs = loader.load()
-
-    # 2. Define the text splitting logic. 
+def _make_splitter():
     # chunk_size: Max characters per chunk.
     # chunk_overlap: Overlap between chunks to maintain context across splits.
-    splitter = RecursiveCharacterTextSplitter(
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         separators=["\n\n", "\n", ".", " ", ""]
     )
-    
-    # Apply the split to the loaded document objects
-    split_docs = splitter.split_documents(docs)
 
-    # 3. Format the split chunks into a dictionary format for JSON storage
-    new_entries = [
+def _to_records(split_docs):
+    """Formats split chunks into plain records for the chunk store."""
+    return [
         {
             "page_content": doc.page_content,
             "metadata": {
@@ -46,23 +48,131 @@ def process_pdf(pdf_path):
         for doc in split_docs
     ]
 
-    # 4. Handle Persistent Storage: Load existing JSON data if it exists
-    existing_docs = []
-    if os.path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-            try:
-                existing_docs = json.load(f)
-            except json.JSONDecodeError:
-                # If the file is corrupted or empty, start with an empty list
-                existing_docs = []
-
-    # 5. Append new processed chunks to the existing collection
-    existing_docs.extend(new_entries)
-
-    # 6. Save the updated list back to the JSON file
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        # indent=2 makes the file human-readable
-        json.dump(existing_docs, f, ensure_ascii=False, indent=2)
-
-    # Return the count of new chunks added for UI feedback
-    return len(split_docs)
\ No newline at end of file
+def _process_page_range(pdf_path, start, end):
+    """
+    Worker task: extracts and splits pages [start, end) of a PDF.
+    Each worker opens the file itself, so only page numbers cross the process boundary.
+    """
+    reader = PdfReader(pdf_path)
+    pages = [
+        Document(
+            page_content=reader.pages[i].extract_text(extraction_mode="plain").strip(),
+            metadata={"source": pdf_path, "page": i},
+        )
+        for i in range(start, end)
+    ]
+    return _to_records(_make_splitter().split_documents(pages))
+
+def _page_shards(pdf_path):
+    """Splits a PDF into (path, start, end) page ranges for the worker pool."""
+    total_pages = len(PdfReader(pdf_path).pages)
+    for start in range(0, total_pages, PAGES_PER_SHARD):
+        yield pdf_path, start, min(start + PAGES_PER_SHARD, total_pages)
+
+def _map_shards(executor, shards, max_workers):
+    """
+    Runs shards on the pool and yields (shard, records) in submission order,
+    keeping at most max_workers * MAX_SHARDS_PER_WORKER shards in flight.
+    """
+    shards = iter(shards)
+    in_flight = deque()
+
+    def submit_next():
+        shard = next(shards, None)
+        if shard is not None:
+            in_flight.append((shard, executor.submit(_process_page_range, *shard)))
+
+    for _ in range(max(1, max_workers) * MAX_SHARDS_PER_WORKER):
+        submit_next()
+    # FIFO over futures keeps the output in page order
+    while in_flight:
+        shard, future = in_flight.popleft()
+        records = future.result()
+        submit_next()
+        yield shard, records
+
+def iter_pdf_chunks(pdf_path, executor=None, max_workers=1):
+    """
+    Yields chunk records for a PDF in page order without loading the whole file.
+    Without an executor, pages stream through PyPDFLoader.lazy_load() in this process.
+    With one, page ranges are parsed and split across the process pool.
+    """
+    if executor is None:
+        splitter = _make_splitter()
+        for page in PyPDFLoader(pdf_path).lazy_load():
+            yield from _to_records(splitter.split_documents([page]))
+        return
+
+    for _, records in _map_shards(executor, _page_shards(pdf_path), max_workers):
+        yield from records
+
+def _tag_roles(records, allowed_roles):
+    """Adds the access field to each chunk's metadata; None leaves the chunks public."""
+    if allowed_roles is None:
+        return records
+    roles = normalize_roles(allowed_roles)
+    return ({**r, "metadata": {**r["metadata"], "allowed_roles": roles}} for r in records)
+
+def process_pdf(pdf_path, executor=None, workers=INGEST_WORKERS, allowed_roles=None):
+    """
+    Processes a single PDF by loading text, splitting it into manageable chunks,
+    and appending it to the chunk store (replacing any earlier chunks from a
+    file with the same name). Returns the number of chunks stored.
+    `allowed_roles` (e.g. ["Staff"]) restricts which roles can retrieve the chunks.
+
+    Pages are streamed lazily into a single chunk-store transaction, written in
+    fixed-size batches, so memory stays bounded however large the file is. Passing
+    a process pool `executor` (see ingest_folder) parses page ranges in parallel.
+    The new chunks are read back from the store for embedding
+    (see rag_pipeline.add_source_to_index).
+    """
+    records = _tag_roles(iter_pdf_chunks(pdf_path, executor, workers), allowed_roles)
+
+    # Re-uploading a file replaces its old chunks instead of duplicating them
+    with span("ingest.process_pdf", source=os.path.basename(pdf_path)) as s:
+        n_chunks = chunk_store.append_chunks(records, replace_source=os.path.basename(pdf_path))
+        s.set(chunks=n_chunks)
+    count("ingest.chunks", n_chunks)
+    return n_chunks
+
+def _new_executor(workers):
+    # "spawn" gives workers a clean interpreter instead of a fork of this process's threads
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def ingest_folder(folder=DATA_FOLDER, workers=INGEST_WORKERS, allowed_roles=None):
+    """
+    Ingests every PDF in `folder` in parallel. Page ranges of all files share one
+    process pool, so many small files keep every core busy just like one large file;
+    each file is still written to the chunk store in its own transaction.
+    """
+    pdfs = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(".pdf")
+    )
+    shards = (shard for path in pdfs for shard in _page_shards(path))
+    total = 0
+    with _new_executor(workers) as executor:
+        results = _map_shards(executor, shards, workers)
+        for path, group in groupby(results, key=lambda item: item[0][0]):
+            records = _tag_roles(
+                (record for _, shard_records in group for record in shard_records), allowed_roles
+            )
+            n_chunks = chunk_store.append_chunks(records, replace_source=os.path.basename(path))
+            total += n_chunks
+            count("ingest.chunks", n_chunks)
+            print(f"Indexed {os.path.basename(path)}: {n_chunks} chunks")
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-ingest every PDF in a folder into the chunk store.")
+    parser.add_argument("folder", nargs="?", default=DATA_FOLDER)
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--roles", nargs="+", choices=ROLES, help="roles allowed to retrieve these documents (default: everyone)")
+    parser.add_argument("--no-index", action="store_true", help="skip refreshing the FAISS index afterwards")
+    args = parser.parse_args()
+
+    total = ingest_folder(args.folder, args.workers, args.roles)
+    print(f"Done: {total} chunks")
+    if not args.no_index:
+        import rag_pipeline
+        rag_pipeline.get_vectorstore()
+        print("FAISS index is up to date.")
@@ -0,0 +1,290 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import ingest
+import rag_pipeline
+from telemetry import span
+
+# Configuration: Persistent queue of PDF indexing jobs, worked off by a background thread
+JOBS_DB = "ingest_jobs.db"
+# A running job whose heartbeat is older than this belonged to a crashed process and is retried
+STALE_JOB_SECONDS = 600
+# A running job's heartbeat is refreshed this often, however long a single stage takes
+HEARTBEAT_SECONDS = 30
+IDLE_POLL_SECONDS = 2.0
+# Pages are parsed in a process pool (kept while the queue is busy) so the serving process's GIL stays free
+JOB_PARSE_WORKERS = int(os.getenv("INGEST_JOB_PARSE_WORKERS", str(min(4, ingest.INGEST_WORKERS))))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_init_lock = threading.Lock()
+_initialized_for = None
+_worker = None
+_worker_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _connect():
+    """Opens the job database, creating the schema on first use."""
+    global _initialized_for
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if _initialized_for != JOBS_DB:
+        with _init_lock:
+            if _initialized_for != JOBS_DB:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        batch_id TEXT NOT NULL,
+                        path TEXT NOT NULL,
+                        allowed_roles TEXT,
+                        status TEXT NOT NULL,
+                        stage TEXT,
+                        progress_done INTEGER DEFAULT 0,
+                        progress_total INTEGER DEFAULT 0,
+                        chunks INTEGER,
+                        error TEXT,
+                        timings TEXT,
+                        created_at REAL NOT NULL,
+                        started_at REAL,
+                        heartbeat REAL,
+                        finished_at REAL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id)")
+                _initialized_for = JOBS_DB
+    return conn
+
+
+def _as_dict(row):
+    job = dict(row)
+    job["allowed_roles"] = json.loads(job["allowed_roles"]) if job["allowed_roles"] else None
+    job["timings"] = json.loads(job["timings"]) if job["timings"] else {}
+    job["filename"] = os.path.basename(job["path"])
+    return job
+
+
+# --- Producer side (the Streamlit session) ---
+
+def enqueue_batch(paths, allowed_roles=None):
+    """Queues one job per saved PDF, all under one batch id, and wakes the worker. Returns the batch id."""
+    batch_id = uuid.uuid4().hex[:8]
+    now = time.time()
+    roles = json.dumps(allowed_roles) if allowed_roles is not None else None
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                """
+                INSERT INTO jobs (id, batch_id, path, allowed_roles, status, stage, created_at)
+                VALUES (?, ?, ?, ?, ?, 'waiting', ?)
+                """,
+                # Sub-millisecond offsets keep the upload order within the batch
+                ((uuid.uuid4().hex[:12], batch_id, path, roles, QUEUED, now + i * 1e-6)
+                 for i, path in enumerate(paths)),
+            )
+    finally:
+        conn.close()
+    _wakeup.set()
+    return batch_id
+
+
+def get_batch(batch_id):
+    """The jobs of one upload batch, in upload order."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM jobs WHERE batch_id = ? ORDER BY created_at", (batch_id,)).fetchall()
+    finally:
+        conn.close()
+    return [_as_dict(r) for r in rows]
+
+
+def list_jobs(limit=20):
+    """Most recent jobs first, for the admin sidebar."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [_as_dict(r) for r in rows]
+
+
+def has_pending_jobs():
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT 1 FROM jobs WHERE status IN (?, ?) LIMIT 1", (QUEUED, RUNNING)).fetchone()
+    finally:
+        conn.close()
+    return row is not None
+
+
+# --- Worker side ---
+
+def _update(conn, job_id, **fields):
+    if "timings" in fields:
+        fields["timings"] = json.dumps(fields["timings"])
+    fields["heartbeat"] = time.time()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+@contextmanager
+def _heartbeat(job_id):
+    """
+    Refreshes a running job's heartbeat every HEARTBEAT_SECONDS from a side thread, so a
+    long parse or a first full index build is never mistaken for a crashed worker (and
+    indexed a second time by another process).
+    """
+    stop = threading.Event()
+
+    def beat():
+        conn = _connect()
+        try:
+            while not stop.wait(HEARTBEAT_SECONDS):
+                try:
+                    conn.execute(
+                        "UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING)
+                    )
+                except sqlite3.Error as e:
+                    print(f"Ingest job {job_id} heartbeat failed: {e}")
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=beat, name=f"ingest-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _requeue_stale(conn):
+    """Puts jobs abandoned by a crashed worker back in the queue."""
+    conn.execute(
+        "UPDATE jobs SET status = ?, stage = 'waiting' WHERE status = ? AND heartbeat < ?",
+        (QUEUED, RUNNING, time.time() - STALE_JOB_SECONDS),
+    )
+
+
+def _claim_next(conn):
+    """
+    Atomically moves the oldest queued job to running; safe with several worker processes.
+    Only one job runs at a time across all processes, so there is a single index writer
+    and each job starts from the version the previous one published.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        busy = conn.execute("SELECT 1 FROM jobs WHERE status = ? LIMIT 1", (RUNNING,)).fetchone()
+        row = None if busy else conn.execute(
+            "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+        ).fetchone()
+        job = None
+        if row is not None:
+            job = dict(_as_dict(row), status=RUNNING, started_at=time.time())
+            _update(conn, job["id"], status=RUNNING, stage="starting", started_at=job["started_at"])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return job
+
+
+def _run_job(conn, job, executor):
+    """
+    Indexes one PDF:
+    1. Makes sure the published index is loaded, so the new chunks are added incrementally
+    2. Parses and chunks the PDF into the chunk store
+    3. Embeds the new chunks (read back from the store) into copies of the indexes and swaps them in
+    Queries keep using the previous indexes until step 3 publishes.
+    """
+    timings = {"queued_ms": (job["started_at"] - job["created_at"]) * 1000}
+    try:
+        with _heartbeat(job["id"]), span("ingest.job", source=job["filename"]):
+            _update(conn, job["id"], stage="loading index")
+            rag_pipeline.get_vectorstore()
+
+            with rag_pipeline.index_update():
+                _update(conn, job["id"], stage="parsing")
+                start = time.perf_counter()
+                n_chunks = ingest.process_pdf(
+                    job["path"], executor, JOB_PARSE_WORKERS, allowed_roles=job["allowed_roles"]
+                )
+                timings["parse_ms"] = (time.perf_counter() - start) * 1000
+                _update(conn, job["id"], stage="embedding", chunks=n_chunks,
+                        progress_total=n_chunks, timings=timings)
+
+                start = time.perf_counter()
+                rag_pipeline.add_source_to_index(
+                    os.path.basename(job["path"]),
+                    progress=lambda done, total: _update(
+                        conn, job["id"], progress_done=done, progress_total=total
+                    ),
+                )
+                # No index was loaded yet (first document): build it here, not in a reader's request
+                rag_pipeline.get_vectorstore()
+                timings["index_ms"] = (time.perf_counter() - start) * 1000
+    except Exception as e:
+        print(f"Ingest job {job['id']} ({job['filename']}) failed: {e}")
+        _update(conn, job["id"], status=FAILED, stage="failed", error=str(e),
+                timings=timings, finished_at=time.time())
+        return
+    _update(conn, job["id"], status=DONE, stage="done", progress_done=n_chunks,
+            timings=timings, finished_at=time.time())
+
+
+def _worker_loop():
+    conn = _connect()
+    executor = None
+    while True:
+        try:
+            _requeue_stale(conn)
+            job = _claim_next(conn)
+        except sqlite3.Error as e:
+            print(f"Ingest queue unavailable, retrying: {e}")
+            job = None
+        if job is None:
+            # Queue drained: release the parse pool until the next upload
+            if executor is not None:
+                executor.shutdown()
+                executor = None
+            _wakeup.wait(IDLE_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+        if executor is None and JOB_PARSE_WORKERS > 1:
+            executor = ingest._new_executor(JOB_PARSE_WORKERS)
+        _run_job(conn, job, executor)
+
+
+def start_worker():
+    """
+    Starts this process's background ingest worker (once); further calls are no-ops.
+    Read-only index workers (INDEX_READ_ONLY=on) never write an index, so they don't start one.
+    """
+    global _worker
+    if rag_pipeline.INDEX_READ_ONLY:
+        return None
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_worker_loop, name="ingest-worker", daemon=True)
+            _worker.start()
+    return _worker
+
+
+if __name__ == "__main__":
+    # Dedicated index writer for multi-worker deployments: the Streamlit workers run with
+    # INDEX_READ_ONLY=on and only enqueue uploads; this process indexes and publishes them.
+    if rag_pipeline.INDEX_READ_ONLY:
+        raise SystemExit("The index writer must not run with INDEX_READ_ONLY=on")
+    print("Index writer: loading the published index...")
+    rag_pipeline.get_vectorstore()
+    print(f"Index writer: serving the queue in {JOBS_DB}")
+    _worker_loop()
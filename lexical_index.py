@@ -0,0 +1,284 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from access_control import role_mask
+
+# Configuration: Where the BM25 index is persisted and its scoring parameters
+LEXICAL_DIR = "lexical_index"
+POSTINGS_ARRAYS = ("offsets", "docs", "tfs", "doc_len", "alive")   # one <name>.npy file each
+META_FILE = "meta.json"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Terms found in more than this share of chunks are "common": they are only scored for
+# documents that also contain a rarer query term, which keeps search sub-millisecond
+COMMON_TERM_FRACTION = 0.05
+COMMON_TERM_MIN_DF = 1000
+
+# Deleted chunks are tombstoned; postings are compacted on save once this share is dead
+COMPACT_DEAD_FRACTION = 0.2
+
+# Words plus codes such as "ICU-3", "F/102" or "5.2mg"; codes are also indexed by their parts
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_/.][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[-_/.]")
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        parts = _SPLIT_RE.split(token)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    In-memory inverted BM25 index over the chunk store.
+    Postings are numpy arrays (doc numbers as int32, term frequencies as uint16) and
+    are saved as uncompressed CSR-style .npy files, which load memory-mapped so several
+    worker processes share one copy in the page cache. Documents are identified by the
+    same chunk ids the FAISS docstore uses, so results from both legs can be fused.
+    """
+
+    def __init__(self):
+        self.chunk_ids = []          # doc number -> chunk id
+        self.sources = []            # doc number -> source file (for replace-by-source)
+        self.roles = []              # doc number -> allowed roles (None: everyone)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.postings = {}           # term -> (doc numbers, term frequencies)
+        self.digest = None
+        self._doc_numbers = {}       # chunk id -> doc number
+        self._live_count = 0
+        self._live_len_total = 0
+        self._visible = {}           # role -> alive & readable mask, rebuilt after any change
+
+    def __len__(self):
+        return self._live_count
+
+    def copy(self):
+        """Independent copy for copy-on-write updates; posting arrays are never modified in place, so they are shared."""
+        other = LexicalIndex()
+        other.chunk_ids = list(self.chunk_ids)
+        other.sources = list(self.sources)
+        other.roles = list(self.roles)
+        other.doc_len = self.doc_len
+        other.alive = self.alive.copy()
+        other.postings = dict(self.postings)
+        other.digest = self.digest
+        other._doc_numbers = dict(self._doc_numbers)
+        other._live_count = self._live_count
+        other._live_len_total = self._live_len_total
+        return other
+
+    # --- Updates ---
+
+    def add(self, items):
+        """Indexes (chunk_id, text, metadata) tuples; already-indexed chunk ids are skipped."""
+        new_terms = {}
+        lengths = []
+        start = len(self.chunk_ids)
+        for chunk_id, text, metadata in items:
+            if chunk_id in self._doc_numbers:
+                continue
+            doc = start + len(lengths)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                new_terms.setdefault(term, ([], []))
+                new_terms[term][0].append(doc)
+                new_terms[term][1].append(min(tf, 65535))
+            lengths.append(sum(counts.values()))
+            self.chunk_ids.append(chunk_id)
+            self.sources.append(metadata.get("source"))
+            self.roles.append(metadata.get("allowed_roles"))
+            self._doc_numbers[chunk_id] = doc
+        if not lengths:
+            return 0
+
+        for term, (docs, tfs) in new_terms.items():
+            docs = np.asarray(docs, dtype=np.int32)
+            tfs = np.asarray(tfs, dtype=np.uint16)
+            if term in self.postings:
+                old_docs, old_tfs = self.postings[term]
+                docs = np.concatenate([old_docs, docs])
+                tfs = np.concatenate([old_tfs, tfs])
+            self.postings[term] = (docs, tfs)
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(lengths, dtype=np.int32)])
+        self.alive = np.concatenate([self.alive, np.ones(len(lengths), dtype=bool)])
+        self._live_count += len(lengths)
+        self._live_len_total += int(sum(lengths))
+        self._visible = {}
+        return len(lengths)
+
+    def remove_sources(self, sources):
+        """Tombstones every chunk from the given source files."""
+        removed = 0
+        for doc, source in enumerate(self.sources):
+            if source in sources and self.alive[doc]:
+                self.alive[doc] = False
+                self._live_count -= 1
+                self._live_len_total -= int(self.doc_len[doc])
+                del self._doc_numbers[self.chunk_ids[doc]]
+                removed += 1
+        self._visible = {}
+        return removed
+
+    def compact(self):
+        """Rewrites postings without tombstoned documents."""
+        if self._live_count == len(self.chunk_ids):
+            return
+        keep = np.flatnonzero(self.alive)
+        remap = np.full(len(self.chunk_ids), -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        postings = {}
+        for term, (docs, tfs) in self.postings.items():
+            mask = self.alive[docs]
+            if mask.any():
+                postings[term] = (remap[docs[mask]].astype(np.int32), tfs[mask])
+        self.postings = postings
+        self.chunk_ids = [self.chunk_ids[i] for i in keep]
+        self.sources = [self.sources[i] for i in keep]
+        self.roles = [self.roles[i] for i in keep]
+        self.doc_len = self.doc_len[keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self._doc_numbers = {cid: i for i, cid in enumerate(self.chunk_ids)}
+        self._visible = {}
+
+    def _visible_mask(self, role):
+        """Documents that are both live and readable by `role`; cached per role."""
+        mask = self._visible.get(role)
+        if mask is None:
+            mask = self.alive & role_mask(({"allowed_roles": r} for r in self.roles), role)
+            self._visible[role] = mask
+        return mask
+
+    # --- Search ---
+
+    def _term_scores(self, entry, candidates, n_docs, avgdl):
+        """BM25 contribution of one term to each candidate doc (0 where the term is absent)."""
+        docs, tfs = entry
+        df = len(docs)
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        if candidates is None:
+            tf = np.zeros(len(self.chunk_ids), dtype=np.float32)
+            tf[docs] = tfs
+            lengths = self.doc_len
+        else:
+            # Postings are sorted by doc number, so candidates are found by binary search
+            pos = np.minimum(np.searchsorted(docs, candidates), df - 1)
+            tf = np.where(docs[pos] == candidates, tfs[pos], 0).astype(np.float32)
+            lengths = self.doc_len[candidates]
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avgdl)
+        return idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+    def search(self, query, k=10, role=None):
+        """
+        Returns up to k (chunk_id, bm25 score) pairs, best first. With a `role`, chunks
+        that role may not read are excluded before ranking, so all k results are usable.
+        """
+        if not self._live_count:
+            return []
+        entries = [self.postings[t] for t in set(tokenize(query)) if t in self.postings]
+        if not entries:
+            return []
+        n_docs = self._live_count
+        avgdl = self._live_len_total / n_docs or 1.0
+
+        # Candidates come from the rare terms (codes, drug names); common words only re-rank them.
+        # A query made only of common words falls back to scoring every document.
+        common_df = max(COMMON_TERM_MIN_DF, n_docs * COMMON_TERM_FRACTION)
+        rare = [docs for docs, _ in entries if len(docs) <= common_df]
+        candidates = np.unique(np.concatenate(rare)) if rare else None
+
+        scores = sum(self._term_scores(entry, candidates, n_docs, avgdl) for entry in entries)
+        doc_numbers = np.arange(len(self.chunk_ids)) if candidates is None else candidates
+        scores[~self._visible_mask(role)[doc_numbers]] = 0
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunk_ids[doc_numbers[i]], float(scores[i])) for i in top if scores[i] > 0]
+
+    # --- Persistence ---
+
+    def save(self, digest, index_dir=LEXICAL_DIR):
+        """Writes compacted postings as CSR .npy arrays plus a JSON sidecar; the sidecar is the commit point."""
+        if self._live_count < len(self.chunk_ids) * (1 - COMPACT_DEAD_FRACTION):
+            self.compact()
+        os.makedirs(index_dir, exist_ok=True)
+        terms = sorted(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(self.postings[term][0])
+        docs = np.concatenate([self.postings[t][0] for t in terms]) if terms else np.zeros(0, np.int32)
+        tfs = np.concatenate([self.postings[t][1] for t in terms]) if terms else np.zeros(0, np.uint16)
+
+        arrays = {"offsets": offsets, "docs": docs, "tfs": tfs, "doc_len": self.doc_len, "alive": self.alive}
+        for name in POSTINGS_ARRAYS:
+            tmp = os.path.join(index_dir, f"{name}.tmp.npy")
+            np.save(tmp, arrays[name])
+            os.replace(tmp, os.path.join(index_dir, f"{name}.npy"))
+
+        meta_tmp = os.path.join(index_dir, META_FILE + ".tmp")
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "digest": digest,
+                "terms": terms,
+                "chunk_ids": self.chunk_ids,
+                "sources": self.sources,
+                "roles": self.roles,
+            }, f)
+        os.replace(meta_tmp, os.path.join(index_dir, META_FILE))
+        self.digest = digest
+
+    @classmethod
+    def load(cls, digest, index_dir=LEXICAL_DIR):
+        """
+        Loads the saved index if it was built for `digest` (None: whatever is saved);
+        otherwise returns None. Posting arrays are memory-mapped read-only.
+        """
+        try:
+            with open(os.path.join(index_dir, META_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if digest is not None and meta.get("digest") != digest:
+                return None
+            arrays = {
+                name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+                for name in POSTINGS_ARRAYS
+            }
+        except (OSError, ValueError):
+            return None
+
+        index = cls()
+        offsets, docs, tfs = arrays["offsets"], arrays["docs"], arrays["tfs"]
+        index.postings = {
+            term: (docs[offsets[i]:offsets[i + 1]], tfs[offsets[i]:offsets[i + 1]])
+            for i, term in enumerate(meta["terms"])
+        }
+        index.chunk_ids = meta["chunk_ids"]
+        index.sources = meta["sources"]
+        index.roles = meta.get("roles") or [None] * len(index.chunk_ids)
+        index.doc_len = arrays["doc_len"]
+        index.alive = arrays["alive"].copy()
+        index._doc_numbers = {cid: i for i, cid in enumerate(index.chunk_ids) if index.alive[i]}
+        index._live_count = int(index.alive.sum())
+        index._live_len_total = int(index.doc_len[index.alive].sum())
+        index.digest = meta["digest"]
+        return index
+
+
+def build_from_vectorstore(vectorstore):
+    """Indexes exactly the chunks held by a FAISS store, keyed by the same docstore ids."""
+    index = LexicalIndex()
+    docstore = vectorstore.docstore
+    index.add(
+        (doc_id, doc.page_content, doc.metadata)
+        for doc_id, doc in ((i, docstore.search(i)) for i in vectorstore.index_to_docstore_id.values())
+    )
+    return index
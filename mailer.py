@@ -1,38 +1,340 @@
 import smtplib
 import os
+import sqlite3
+import threading
+import time
 from email.message import EmailMessage
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def send_otp_email(receiver_email, otp_code):
-    """Sends a 6-digit OTP to the specified email address."""
-    sender_email = os.getenv("EMAIL_USER")
-    sender_password = os.getenv("EMAIL_PASS")
+# Configuration: Outgoing mail server. SMTP_SECURITY is "ssl" (port 465), "starttls" (587) or "none" (local test servers)
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "ssl")
+SMTP_TIMEOUT_SECONDS = 30
 
+# Outbox: messages are queued in SQLite and sent by a background worker over one reused connection.
+# A body is only kept until its message is sent, fails for good or expires (expires_at),
+# since reset codes must not outlive their use in plaintext.
+OUTBOX_DB = "mail_outbox.db"
+MAIL_BATCH_SIZE = 20
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_RETRY_BASE_SECONDS = 2.0      # backoff: 2s, 4s, 8s, ... capped below
+MAIL_RETRY_MAX_SECONDS = 300.0
+SMTP_KEEPALIVE_SECONDS = 20        # NOOP before reusing a connection idle longer than this
+SMTP_IDLE_CLOSE_SECONDS = 120      # log out once nothing has been sent for this long
+STALE_SENDING_SECONDS = 300        # "sending" rows older than this were claimed by a crashed worker
+IDLE_POLL_SECONDS = 5.0
+
+QUEUED, SENDING, SENT, FAILED = "queued", "sending", "sent", "failed"
+
+_init_lock = threading.Lock()
+_initialized_for = None
+_worker = None
+_worker_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _connect_db():
+    """Opens the outbox database, creating the schema on first use."""
+    global _initialized_for
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if _initialized_for != OUTBOX_DB:
+        with _init_lock:
+            if _initialized_for != OUTBOX_DB:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        recipient TEXT NOT NULL,
+                        subject TEXT NOT NULL,
+                        body TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at REAL NOT NULL,
+                        last_error TEXT,
+                        created_at REAL NOT NULL,
+                        claimed_at REAL,
+                        sent_at REAL,
+                        expires_at REAL
+                    )
+                """)
+                columns = {row["name"] for row in conn.execute("PRAGMA table_info(outbox)")}
+                if "expires_at" not in columns:
+                    # Outboxes from before bodies were cleared: add the column, clear finished bodies
+                    conn.execute("ALTER TABLE outbox ADD COLUMN expires_at REAL")
+                    conn.execute("UPDATE outbox SET body = '' WHERE status IN (?, ?)", (SENT, FAILED))
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+                _initialized_for = OUTBOX_DB
+    # Bodies can hold reset codes: zero their bytes on disk when they are cleared
+    conn.execute("PRAGMA secure_delete = ON")
+    return conn
+
+
+def _credentials():
+    return os.getenv("EMAIL_USER"), os.getenv("EMAIL_PASS")
+
+
+# --- Producer side ---
+
+def enqueue_email(receiver_email, subject, body, expires_at=None):
+    """
+    Queues a message for the background sender and returns its outbox id. A message
+    still unsent at `expires_at` (epoch seconds) is dropped instead of sent late.
+    """
+    now = time.time()
+    conn = _connect_db()
+    try:
+        cursor = conn.execute(
+            """
+            INSERT INTO outbox (recipient, subject, body, status, next_attempt_at, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (receiver_email, subject, body, QUEUED, now, now, expires_at),
+        )
+        message_id = cursor.lastrowid
+    finally:
+        conn.close()
+    start_mail_worker()
+    _wakeup.set()
+    return message_id
+
+
+def send_otp_email(receiver_email, otp_code, expires_at=None):
+    """
+    Queues a 6-digit OTP email for the specified address; pass the code's expiry as
+    `expires_at`. Returns the outbox id (see delivery_status) right away, or False if
+    mail is not configured.
+    """
+    sender_email, sender_password = _credentials()
     if not sender_email or not sender_password:
         print("Error: Email credentials missing in .env")
         return False
 
-    msg = EmailMessage()
-    msg.set_content(f"""
+    body = f"""
     Your Hospital AI Portal Password Reset Code:
-    
+
     {otp_code}
-    
+
     If you did not request this, please ignore this email.
-    """)
+    """
+    return enqueue_email(receiver_email, '🔐 Your Password Reset Code', body, expires_at=expires_at)
 
-    msg['Subject'] = '🔐 Your Password Reset Code'
-    msg['From'] = sender_email
-    msg['To'] = receiver_email
 
+def delivery_status(message_id):
+    """{"status", "attempts", "last_error"} of a queued message, or None if unknown."""
+    conn = _connect_db()
     try:
-        # Connect to Gmail's SMTP server
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
+        row = conn.execute(
+            "SELECT status, attempts, last_error FROM outbox WHERE id = ?", (message_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row else None
+
+
+# --- Sender side ---
+
+class SmtpConnection:
+    """
+    One authenticated SMTP session reused across messages. It is checked with NOOP
+    after sitting idle, and re-opened (TLS handshake + login) only when that fails.
+    """
+
+    def __init__(self):
+        self.smtp = None
+        self.last_used = 0.0
+        self.opened = 0   # connections opened so far, for benchmarks
+
+    def _open(self):
+        sender_email, sender_password = _credentials()
+        if SMTP_SECURITY == "ssl":
+            smtp = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+        else:
+            smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+            if SMTP_SECURITY == "starttls":
+                smtp.starttls()
+        try:
             smtp.login(sender_email, sender_password)
-            smtp.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"SMTP Error: {e}")
-        return False
\ No newline at end of file
+        except smtplib.SMTPException:
+            smtp.close()
+            raise
+        self.opened += 1
+        return smtp
+
+    def get(self):
+        if self.smtp is not None and time.time() - self.last_used > SMTP_KEEPALIVE_SECONDS:
+            try:
+                if self.smtp.noop()[0] != 250:
+                    self.close()
+            except smtplib.SMTPException:
+                self.close()
+            except OSError:
+                self.close()
+        if self.smtp is None:
+            self.smtp = self._open()
+        self.last_used = time.time()
+        return self.smtp
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+    def close_if_idle(self):
+        if self.smtp is not None and time.time() - self.last_used > SMTP_IDLE_CLOSE_SECONDS:
+            self.close()
+
+
+def _build_message(row):
+    msg = EmailMessage()
+    msg.set_content(row["body"])
+    msg['Subject'] = row["subject"]
+    msg['From'] = _credentials()[0]
+    msg['To'] = row["recipient"]
+    return msg
+
+
+def _claim_batch(conn):
+    """
+    Atomically marks up to MAIL_BATCH_SIZE due messages as sending; safe with several processes.
+    Returns (claimed rows, number of expired messages whose body was cleared).
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Requeue what a crashed sender had claimed
+        conn.execute(
+            "UPDATE outbox SET status = ? WHERE status = ? AND claimed_at < ?",
+            (QUEUED, SENDING, now - STALE_SENDING_SECONDS),
+        )
+        # A code that expired in the queue is useless to its recipient: drop it, and its body
+        expired = conn.execute(
+            "UPDATE outbox SET status = ?, body = '', last_error = ? WHERE status = ? AND expires_at < ?",
+            (FAILED, "expired before it could be sent", QUEUED, now),
+        ).rowcount
+        rows = conn.execute(
+            "SELECT * FROM outbox WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (QUEUED, now, MAIL_BATCH_SIZE),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE outbox SET status = ?, claimed_at = ? WHERE id = ?",
+            ((SENDING, now, r["id"]) for r in rows),
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return rows, expired
+
+
+def _is_permanent(error):
+    """5xx replies (bad address, rejected content, bad credentials) won't succeed on retry."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    code = getattr(error, "smtp_code", None)
+    return code is not None and code >= 500
+
+
+def _record_failure(conn, row, error):
+    attempts = row["attempts"] + 1
+    if _is_permanent(error) or attempts >= MAIL_MAX_ATTEMPTS:
+        conn.execute(
+            "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, body = '' WHERE id = ?",
+            (FAILED, attempts, str(error), row["id"]),
+        )
+        print(f"Mail to {row['recipient']} failed after {attempts} attempt(s): {error}")
+        return
+    delay = min(MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAIL_RETRY_MAX_SECONDS)
+    conn.execute(
+        "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+        (QUEUED, attempts, str(error), time.time() + delay, row["id"]),
+    )
+
+
+def send_batch(conn, connection, rows):
+    """Sends claimed messages over the shared connection, recording each outcome."""
+    for i, row in enumerate(rows):
+        try:
+            connection.get().send_message(_build_message(row))
+        except (smtplib.SMTPException, OSError) as e:
+            # smtplib resets the session after an error reply, so it stays usable;
+            # a dropped connection or a closing server (421) means reconnecting
+            refused = isinstance(e, smtplib.SMTPRecipientsRefused)
+            replied = isinstance(e, smtplib.SMTPResponseException) and e.smtp_code != 421
+            if not (refused or replied):
+                connection.close()
+            _record_failure(conn, row, e)
+            continue
+        except Exception as e:
+            # Anything else (e.g. a message that cannot be built) fails this message only
+            print(f"Mail {row['id']} to {row['recipient']} could not be sent: {e!r}")
+            connection.close()
+            _record_failure(conn, row, e)
+            continue
+        conn.execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = NULL, sent_at = ?, body = '' WHERE id = ?",
+            (SENT, time.time(), row["id"]),
+        )
+
+
+def _fail_unsent(conn, rows, error):
+    """Records `error` on the claimed rows still marked sending, so they are retried (or failed) now."""
+    try:
+        for row in rows:
+            status = conn.execute("SELECT status FROM outbox WHERE id = ?", (row["id"],)).fetchone()
+            if status is not None and status[0] == SENDING:
+                _record_failure(conn, row, error)
+    except sqlite3.Error as e:
+        print(f"Mail outbox unavailable, leaving the batch to the stale-claim requeue: {e}")
+
+
+def _next_due_in(conn):
+    row = conn.execute(
+        "SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?", (QUEUED,)
+    ).fetchone()
+    return max(0.0, row[0] - time.time()) if row[0] is not None else IDLE_POLL_SECONDS
+
+
+def _worker_loop():
+    conn = _connect_db()
+    connection = SmtpConnection()
+    while True:
+        rows = []
+        try:
+            rows, expired = _claim_batch(conn)
+            if rows:
+                send_batch(conn, connection, rows)
+            if rows or expired:
+                # The WAL still holds the pages of the bodies just cleared; fold and empty it
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            if rows:
+                continue
+            wait = min(_next_due_in(conn), IDLE_POLL_SECONDS)
+        except sqlite3.Error as e:
+            print(f"Mail outbox unavailable, retrying: {e}")
+            wait = IDLE_POLL_SECONDS
+        except Exception as e:
+            # The sender must outlive any one batch: nothing restarts it in this process
+            print(f"Mail sender error: {e!r}")
+            connection.close()
+            _fail_unsent(conn, rows, e)
+            wait = IDLE_POLL_SECONDS
+        connection.close_if_idle()
+        _wakeup.wait(wait)
+        _wakeup.clear()
+
+
+def start_mail_worker():
+    """Starts this process's background sender (once); further calls are no-ops."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_worker_loop, name="mail-outbox", daemon=True)
+            _worker.start()
+    return _worker
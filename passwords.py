@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+# Configuration: bcrypt work factor and the process pool that runs it
+# - BCRYPT_ROUNDS: cost for new hashes; existing hashes are upgraded (or downgraded) on the next login
+# - BCRYPT_WORKERS: hashing processes (0 hashes inline on the calling thread)
+# - BCRYPT_MAX_PENDING: hashes allowed in flight; further logins wait for a slot instead of piling up
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", str(max(1, BCRYPT_WORKERS) * 4)))
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(BCRYPT_MAX_PENDING)
+
+
+# --- Run in the worker processes (module-level so they can be pickled) ---
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+# --- Called from the app ---
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None and BCRYPT_WORKERS > 0:
+            # "spawn": workers must not inherit the server's threads and open SQLite handles
+            _pool = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _run(fn, *args):
+    """Runs a bcrypt call in the pool, keeping its CPU time off the Streamlit script threads."""
+    with _slots:
+        pool = _get_pool()
+        if pool is None:
+            return fn(*args)
+        return pool.submit(fn, *args).result()
+
+
+def hash_password(password, rounds=None):
+    """Returns a bcrypt hash (as str) of `password` at the configured cost."""
+    return _run(_hash, password, rounds or BCRYPT_ROUNDS)
+
+
+def check_password(password, hashed):
+    """True if `password` matches the stored bcrypt hash."""
+    return _run(_check, password, hashed)
+
+
+def hash_rounds(hashed):
+    """The cost factor encoded in a bcrypt hash ("$2b$12$..." -> 12), or None if unparseable."""
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed):
+    """True if the hash was made with a different cost than the current policy."""
+    return hash_rounds(hashed) != BCRYPT_ROUNDS
@@ -0,0 +1,141 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import queue
+import threading
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+# Configuration: The chat model and how many pooled HTTP connections it may keep open
+CHAT_MODEL = "gpt-4o-mini"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+_service = None
+_service_lock = threading.Lock()
+_DONE = object()
+
+
+class QueryService:
+    """
+    Process-wide home of the query path, shared by every Streamlit session:
+    1. One long-lived ChatOpenAI with pooled sync/async HTTP clients, so connections
+       (and their TLS handshakes) are reused across turns and users
+    2. A background event loop that runs the ainvoke/astream pipeline; sync callers
+       submit coroutines to it and wait for the result
+    3. Single-flight: identical in-flight questions share one LLM call
+    """
+
+    def __init__(self, max_connections=LLM_MAX_CONNECTIONS):
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.llm = ChatOpenAI(
+            temperature=0,
+            model=CHAT_MODEL,
+            http_client=httpx.Client(limits=limits, timeout=LLM_TIMEOUT_SECONDS),
+            http_async_client=httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT_SECONDS),
+        )
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="query-service", daemon=True).start()
+        self._in_flight = {}   # key -> asyncio.Future; only touched on the service loop
+        self._counters = {"leaders": 0, "coalesced": 0}
+
+    # --- Bridging sync callers onto the service loop ---
+
+    def _submit(self, coro):
+        """
+        Schedules a coroutine on the service loop inside a copy of the caller's context,
+        so context variables (e.g. the current telemetry span) carry over.
+        """
+        context = contextvars.copy_context()
+        done = concurrent.futures.Future()
+
+        def relay(task):
+            if task.cancelled():
+                done.cancel()
+            elif task.exception() is not None:
+                done.set_exception(task.exception())
+            else:
+                done.set_result(task.result())
+
+        def start():
+            context.run(self._loop.create_task, coro).add_done_callback(relay)
+
+        self._loop.call_soon_threadsafe(start)
+        return done
+
+    def run(self, coro):
+        """Runs a coroutine on the service loop and blocks the calling thread until it finishes."""
+        return self._submit(coro).result()
+
+    def iterate(self, agen):
+        """Drives an async generator on the service loop and yields its items to a sync caller."""
+        items = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put((item, None))
+            except BaseException as e:
+                items.put((_DONE, e))
+                return
+            items.put((_DONE, None))
+
+        self._submit(pump())
+        while True:
+            item, error = items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+
+    # --- Single-flight (call these from coroutines running on the service loop) ---
+
+    def join(self, key):
+        """Returns (future, is_leader). The leader must later call finish() or fail()."""
+        future = self._in_flight.get(key)
+        if future is not None:
+            self._counters["coalesced"] += 1
+            return future, False
+        future = self._loop.create_future()
+        # Nobody may be waiting; mark a failure as seen so asyncio doesn't warn about it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        self._counters["leaders"] += 1
+        return future, True
+
+    def finish(self, key, result):
+        future = self._in_flight.pop(key)
+        future.set_result(result)
+
+    def fail(self, key, error):
+        future = self._in_flight.pop(key)
+        future.set_exception(error)
+
+    async def single_flight(self, key, make_coro):
+        """Awaits make_coro() once per key at a time; concurrent callers with the same key share its result."""
+        future, leader = self.join(key)
+        if not leader:
+            return await asyncio.shield(future)
+        try:
+            result = await make_coro()
+        except BaseException as e:
+            self.fail(key, e)
+            raise
+        self.finish(key, result)
+        return result
+
+    def stats(self):
+        """How many questions reached the LLM vs. were served by an identical in-flight call."""
+        return dict(self._counters, in_flight=len(self._in_flight))
+
+
+def get_query_service():
+    """Returns the process-wide QueryService, creating it on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = QueryService()
+        return _service
@@ -1,82 +1,567 @@
-import json
+import asyncio
 import os
+import threading
+import time
+from contextlib import contextmanager
 from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_openai import OpenAIEmbeddings
 from langchain_classic.chains import RetrievalQA
 from dotenv import load_dotenv
+import chunk_store
+import index_store
+import lexical_index
+from embedding_cache import CachedEmbeddings
+from embedding_pipeline import embed_query, embed_texts
+from answer_cache import AnswerCache, normalize_query
+from conversation import condense_query, start_summary_refresh
+from hybrid_retriever import HYBRID_FETCH_K, HybridRetriever
+from reranker import RERANK_FETCH_K, rerank
+from context_packer import pack_context
+from query_service import get_query_service
+from telemetry import count, span, traced
+from token_utils import count_tokens
 
 # Load environment variables (API Keys) from .env file
 load_dotenv()
 
-# The source file generated by ingest.py
-DOC_FILE = "documents.json"
+# How many chunks are embedded (concurrently, see embedding_pipeline) and added to the index per step during a full build
+BUILD_BATCH_SIZE = 2000
+
+# "openai" in production; "fake" gives deterministic local vectors for offline runs
+EMBEDDINGS_PROVIDER = os.getenv("EMBEDDINGS_PROVIDER", "openai")
+FAKE_EMBEDDING_SIZE = 256
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+# Multi-worker deployments: with INDEX_READ_ONLY=on this process never builds or writes an
+# index. It serves the version the single writer (see ingest_jobs) last published, and
+# checks the CURRENT pointer for a newer one at most every INDEX_POLL_SECONDS.
+INDEX_READ_ONLY = os.getenv("INDEX_READ_ONLY", "off") == "on"
+INDEX_POLL_SECONDS = float(os.getenv("INDEX_POLL_SECONDS", "2"))
+
+# Process-wide vector store cache, shared by every Streamlit session in this server
+_vectorstore_lock = threading.Lock()
+_vectorstore_cache = {
+    "corpus_version": None, "digest": None, "vectorstore": None, "lexical": None,
+    "published": None, "checked_at": 0.0,
+}
+# One incremental index writer at a time; readers never wait on it, only on the final swap
+_update_lock = threading.Lock()
+_updates_in_progress = 0
+
+NO_DOCUMENTS_MESSAGE = "No documents found. Admin needs to upload files first."
+
+# Process-wide answer cache for repeated questions, partitioned by role
+_answer_cache = AnswerCache()
+
+def get_embeddings():
+    """Returns the process-wide embeddings object, wrapped in the persistent embedding cache."""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            if EMBEDDINGS_PROVIDER == "fake":
+                base = DeterministicFakeEmbedding(size=FAKE_EMBEDDING_SIZE)
+            else:
+                # Retries (and their rate limiting) are embedding_pipeline's job, not the client's
+                base = OpenAIEmbeddings(max_retries=0)
+            _embeddings = CachedEmbeddings(base)
+        return _embeddings
 
 def load_documents():
     """
-    Reads the processed JSON file and converts data back into 
+    Lazily streams the processed chunks from the chunk store as
     LangChain Document objects for the vector store.
     """
-    if not os.path.exists(DOC_FILE):
-        return []
-    
-    with open(DOC_FILE, "r", encoding="utf-8") as f:
-        raw_docs = json.load(f)
-    
     # Reconstruct Document objects with content and their original metadata (source, page)
-    return [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in raw_docs]
+    for d in chunk_store.iter_chunks():
+        yield Document(page_content=d["page_content"], metadata=d["metadata"])
+
+def _build_vectorstore(embeddings):
+    """Embeds the whole corpus batch by batch, so only one batch of text is held at a time."""
+    vectorstore = None
+    seen = set()
+    batch = []
+
+    def flush():
+        nonlocal vectorstore
+        texts = [d.page_content for d in batch]
+        with span("index.embed", chunks=len(texts)):
+            vectors = embed_texts(embeddings, texts)
+        pairs = zip(texts, vectors)
+        metadatas = [d.metadata for d in batch]
+        ids = [index_store.chunk_id(d) for d in batch]
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(pairs, embeddings, metadatas=metadatas, ids=ids)
+        else:
+            vectorstore.add_embeddings(pairs, metadatas=metadatas, ids=ids)
+        batch.clear()
+
+    for doc in load_documents():
+        # Identical chunks are only indexed once (their ids would collide anyway)
+        cid = index_store.chunk_id(doc)
+        if cid in seen:
+            continue
+        seen.add(cid)
+        batch.append(doc)
+        if len(batch) >= BUILD_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+    # Past the size threshold, swap the flat build index for the configured ANN backend
+    index_store.ensure_backend(vectorstore)
+    return vectorstore
+
+def _load_published(embeddings, manifest=None, name=None):
+    """
+    Opens a published index version (default: the current one) with the FAISS vectors
+    and BM25 postings memory-mapped. With a `manifest`, only a version built for the
+    same chunks is accepted.
+    Returns (vectorstore, lexical, version name, saved manifest); Nones if unavailable.
+    """
+    name = name or index_store.current_version()
+    if name is None:
+        return None, None, None, None
+    path = index_store.version_dir(name)
+    saved = index_store.read_manifest(path)
+    if saved is None or (manifest is not None and saved.get("digest") != manifest["digest"]):
+        return None, None, None, None
+    with span("index.load"):
+        vectorstore = index_store.load_index(embeddings, saved, path)
+    if vectorstore is None:
+        return None, None, None, None
+    with span("lexical.load"):
+        lexical = lexical_index.LexicalIndex.load(saved["digest"], os.path.join(path, index_store.LEXICAL_SUBDIR))
+    return vectorstore, lexical, name, saved
+
+def _publish(vectorstore, lexical, manifest, version):
+    """Publishes a new index version recording the corpus version it covers; returns its name."""
+    if lexical is None:
+        with span("lexical.build"):
+            lexical = lexical_index.build_from_vectorstore(vectorstore)
+    manifest = dict(manifest, corpus_version=version)
+    name = index_store.publish_index(vectorstore, manifest, lexical)
+    # The published docstore holds exactly these chunks: read them from there, so the
+    # next update only records its own changes on top of it (index_store.DeltaDocstore)
+    vectorstore.docstore = index_store.MappedDocstore(
+        os.path.join(index_store.version_dir(name), index_store.DOCSTORE_FILE)
+    )
+    return name, lexical
+
+@contextmanager
+def index_update():
+    """
+    Brackets a chunk-store write and the index update that follows it. Meanwhile
+    readers keep using the published indexes instead of rebuilding them from a
+    chunk store that is ahead of the index.
+    """
+    global _updates_in_progress
+    with _vectorstore_lock:
+        _updates_in_progress += 1
+    try:
+        yield
+    finally:
+        with _vectorstore_lock:
+            _updates_in_progress -= 1
+
+def _follow_published():
+    """
+    Read-only workers: serves the published indexes and swaps in a newer version once
+    the writer publishes one. Files are memory-mapped, so N workers share one copy.
+    """
+    with _vectorstore_lock:
+        now = time.monotonic()
+        if now - _vectorstore_cache["checked_at"] < INDEX_POLL_SECONDS:
+            return _vectorstore_cache["vectorstore"], _vectorstore_cache["lexical"]
+        _vectorstore_cache["checked_at"] = now
+        name = index_store.current_version()
+        if name is None or name == _vectorstore_cache["published"]:
+            return _vectorstore_cache["vectorstore"], _vectorstore_cache["lexical"]
+
+        vectorstore, lexical, _, saved = _load_published(get_embeddings(), name=name)
+        if vectorstore is None or lexical is None:
+            # Pruned or half-visible on this filesystem: keep serving, retry next poll
+            print(f"Index version {name} could not be loaded; still serving {_vectorstore_cache['published']}")
+            return _vectorstore_cache["vectorstore"], _vectorstore_cache["lexical"]
+        count("index.reloads")
+        _vectorstore_cache.update(
+            corpus_version=saved.get("corpus_version"), digest=saved["digest"],
+            vectorstore=vectorstore, lexical=lexical, published=name,
+        )
+        return vectorstore, lexical
+
+def _get_indexes():
+    """
+    Returns the shared (FAISS store, BM25 index) pair for the current corpus:
+    1. Reuses the in-process indexes while the chunk store's version is unchanged
+       (or while an index_update() is about to publish newer ones)
+    2. Otherwise memory-maps the published index version if its manifest still matches
+    3. Only re-embeds the corpus when the manifest has changed, then publishes a new version
+    The lexical index is published in the same version directory, so both always cover the same chunks.
+    Read-only workers skip all of this and follow the published version (_follow_published).
+    """
+    if INDEX_READ_ONLY:
+        return _follow_published()
+
+    version = chunk_store.corpus_version()
+    with _vectorstore_lock:
+        current = _vectorstore_cache["vectorstore"]
+        if _vectorstore_cache["corpus_version"] == version or (_updates_in_progress and current is not None):
+            return current, _vectorstore_cache["lexical"]
+
+        chunk_ids = set(chunk_store.iter_chunk_ids())
+        if not chunk_ids:
+            _vectorstore_cache.update(corpus_version=version, digest=None, vectorstore=None, lexical=None)
+            return None, None
+
+        embeddings = get_embeddings()
+        manifest = index_store.build_manifest(list(chunk_ids), embeddings.model)
+
+        vectorstore, lexical = current, _vectorstore_cache["lexical"]
+        name = _vectorstore_cache["published"]
+        if vectorstore is None or _vectorstore_cache["digest"] != manifest["digest"]:
+            vectorstore, lexical, name, _ = _load_published(embeddings, manifest)
+            if vectorstore is None:
+                # Pre-versioning layout: index files directly in INDEX_DIR
+                with span("index.load"):
+                    vectorstore = index_store.load_index(embeddings, manifest, index_store.INDEX_DIR)
+                if vectorstore is None:
+                    with span("index.build", chunks=len(chunk_ids)):
+                        vectorstore = _build_vectorstore(embeddings)
+                name = None
+            if index_store.ensure_backend(vectorstore):
+                # FAISS_INDEX_BACKEND changed (or the threshold was crossed): re-index, don't re-embed
+                name = None
+            if name is None or lexical is None:
+                name, lexical = _publish(vectorstore, lexical, manifest, version)
+
+        _vectorstore_cache.update(
+            corpus_version=version, digest=manifest["digest"], vectorstore=vectorstore, lexical=lexical,
+            published=name,
+        )
+        return vectorstore, lexical
+
+def get_vectorstore():
+    """Returns the shared FAISS store for the current corpus (see _get_indexes)."""
+    return _get_indexes()[0]
+
+def add_chunks_to_index(records, progress=None):
+    """
+    Incrementally indexes freshly ingested chunk records (see _add_to_index).
+    Holds all of `records` at once; add_source_to_index streams a stored file instead.
+    """
+    records = list(records)
+    sources = {r["metadata"].get("source") for r in records}
+    return _add_to_index(sources, [records] if records else [], len(records), progress)
+
+def add_source_to_index(source, progress=None):
+    """
+    Incrementally indexes a file ingest.process_pdf has just stored (see _add_to_index),
+    reading its chunks back from the chunk store BUILD_BATCH_SIZE at a time, so no
+    more than one batch of texts is held besides the index itself.
+    """
+    return _add_to_index(
+        {source}, chunk_store.iter_source_chunks(source, BUILD_BATCH_SIZE),
+        chunk_store.count_source_chunks(source), progress,
+    )
+
+def _add_to_index(sources, batches, total, progress=None):
+    """
+    Incremental index update for the chunks of `sources`, given as `batches` of records:
+    1. Drops vectors and BM25 postings from any source being re-uploaded
+    2. Embeds only the new chunks, batch by batch, and appends them to copies of the live indexes
+    3. Persists the result and swaps it in for every session
+    Steps 1-2 work on private copies, so queries keep being answered from the
+    published indexes until the swap. Published versions are immutable, so step 3
+    still writes a whole new version; the docstore part of it is the published file
+    plus this upload's rows (see index_store.DeltaDocstore). Falls back to a lazy
+    full build if no store is loaded yet. `progress(done, total)` reports embedded
+    chunks out of `total`.
+    """
+    version = chunk_store.corpus_version()
+
+    with _update_lock, index_update():
+        with _vectorstore_lock:
+            current, current_lexical = _vectorstore_cache["vectorstore"], _vectorstore_cache["lexical"]
+            if current is None:
+                # Nothing loaded yet: get_vectorstore() will load or build from the chunk store
+                _vectorstore_cache.update(corpus_version=None, digest=None)
+                return 0
+
+        vectorstore = index_store.copy_vectorstore(current)
+        lexical = (current_lexical or lexical_index.build_from_vectorstore(current)).copy()
+
+        # 1. Replace, don't duplicate, the vectors of a re-uploaded file
+        stale_ids = index_store.ids_for_sources(vectorstore, sources)
+        if stale_ids:
+            index_store.delete_ids(vectorstore, stale_ids)
+        lexical.remove_sources(sources)
+
+        # 2. Embed only what is new (a chunk repeated within the upload once)
+        added = set()
+        done = 0
+        for records in batches:
+            new_docs = {}
+            for r in records:
+                doc = Document(page_content=r["page_content"], metadata=r["metadata"])
+                cid = index_store.chunk_id(doc)
+                if cid not in added:
+                    added.add(cid)
+                    new_docs[cid] = doc
+            if new_docs:
+                texts = [d.page_content for d in new_docs.values()]
+                batch_progress = None
+                if progress:
+                    batch_progress = lambda embedded, _, offset=done: progress(offset + embedded, total)
+                with span("index.embed", chunks=len(texts)):
+                    vectors = embed_texts(vectorstore.embedding_function, texts, progress=batch_progress)
+                vectorstore.add_embeddings(
+                    zip(texts, vectors),
+                    metadatas=[d.metadata for d in new_docs.values()],
+                    ids=list(new_docs),
+                )
+                lexical.add((cid, d.page_content, d.metadata) for cid, d in new_docs.items())
+            done += len(records)
+            if progress:
+                progress(done, total)
+        index_store.ensure_backend(vectorstore)
 
+        # 3. Publish a new version (other workers pick it up) and swap it in here
+        manifest = index_store.build_manifest(
+            list(vectorstore.index_to_docstore_id.values()),
+            vectorstore.embedding_function.model,
+        )
+        name, lexical = _publish(vectorstore, lexical, manifest, version)
+        with _vectorstore_lock:
+            _vectorstore_cache.update(
+                corpus_version=version, digest=manifest["digest"], vectorstore=vectorstore, lexical=lexical,
+                published=name,
+            )
+        return len(added)
+
+def index_corpus_version():
+    """
+    Corpus version that answers are cached under. Read-only workers use the version
+    their loaded index was built from, which may trail the chunk store while the writer works.
+    """
+    if INDEX_READ_ONLY:
+        return _vectorstore_cache["corpus_version"]
+    return chunk_store.corpus_version()
+
+@traced("rag.build_qa_chain")
 def build_qa_chain():
     """
     Initializes the RAG (Retrieval-Augmented Generation) pipeline:
-    1. Loads documents
-    2. Creates vector embeddings
-    3. Sets up the FAISS vector store
-    4. Configures the LLM and Retrieval chain
+    1. Fetches the shared, persisted FAISS vector store and BM25 index
+    2. Configures the LLM and a hybrid (vector + keyword) Retrieval chain
     """
-    documents = load_documents()
-    if not documents:
+    vectorstore, lexical = _get_indexes()
+    if vectorstore is None:
         return None
     
-    # Initialize OpenAI embeddings model
-    embeddings = OpenAIEmbeddings()
-    
-    # Create a searchable vector database in memory using FAISS
-    vectorstore = FAISS.from_documents(documents, embeddings)
-    
-    # Initialize the LLM (GPT-4o-mini) with 0 temperature for factual consistency
-    llm = ChatOpenAI(temperature=0, model="gpt-4o-mini")
+    # The process-wide LLM (GPT-4o-mini, temperature 0 for factual consistency) keeps
+    # its pooled HTTP connections alive across turns, so it is shared, not re-created
+    llm = get_query_service().llm
     
     # Create the RetrievalQA chain
-    # k=3 retrieves the 3 most relevant document chunks for context
+    # The retriever over-fetches RERANK_FETCH_K candidates, fused from the FAISS and
+    # BM25 lists; _retrieve() reranks them and packs the best into the role's token budget
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
-        retriever=vectorstore.as_retriever(search_kwargs={"k": 3}),
+        retriever=HybridRetriever(
+            vectorstore=vectorstore,
+            lexical=lexical,
+            k=RERANK_FETCH_K,
+            fetch_k=max(HYBRID_FETCH_K, RERANK_FETCH_K),
+        ),
         return_source_documents=True
     )
     return qa_chain
 
 
 
-def role_based_query(qa_chain, query, role="Patient"):
+def _role_prompt(query, role):
+    """Augments the user query with identity-based rules."""
+    return f"""You are a hospital assistant. User role: {role}
+    Rules:
+    - If Patient: do NOT reveal private medical records of others. Only provide general guidance or specific personal info if available.
+    - If Staff/Admin: provide detailed professional access to records and policies.
+    - Always cite sources if available.
+    
+    Question: {query}"""
+
+def _cached_answer(query, role, version):
+    """Looks the question up in the answer cache; returns (cached result or None, query vector)."""
+    # Exact match first (no embedding needed), then a close paraphrase.
+    # Keys include the corpus version, so new uploads invalidate the cache.
+    with span("rag.cache_lookup") as s:
+        cached = _answer_cache.get_exact(role, query, version)
+        if cached is not None:
+            s.set(hit="exact")
+            count("answer_cache.hits")
+            return cached, None
+        # The question as retrieval will embed it: on a miss, _retrieve() reuses this vector
+        query_vector = embed_query(get_embeddings(), query)
+        cached = _answer_cache.get_similar(role, query, query_vector, version)
+        s.set(hit="similar" if cached is not None else "miss")
+        count("answer_cache.hits" if cached is not None else "answer_cache.misses")
+        return cached, query_vector
+
+def _retrieve(qa_chain, query, role, timings, query_vector=None):
+    """
+    Retrieval pipeline in front of the LLM, recording per-stage timings:
+    1. Over-fetch candidates this role may read (hybrid vector + BM25)
+    2. Rerank them (falls back to retrieval order past the latency budget)
+    3. Merge overlapping neighbours, drop duplicates and fill the role's context token
+       budget from the reranked pool in rank order
+    Retrieval uses the question alone: the role rules would skew both similarity and keyword scores.
+    `query_vector` is the question's embedding if the answer-cache lookup already computed it.
+    """
+    with span("rag.retrieve", role=role) as s:
+        candidates = qa_chain.retriever.for_role(role, query_vector).invoke(query)
+        s.set(candidates=len(candidates))
+    timings["retrieve_ms"] = s.ms
+    timings["candidates"] = len(candidates)
+    with span("rag.rerank") as s:
+        docs = rerank(query, candidates, timings=timings)
+        s.set(fallback=timings["rerank_fallback"])
+    with span("rag.pack") as s:
+        docs = pack_context(docs, role, timings=timings)
+        s.set(context_tokens=timings["context_tokens"], saved=timings["context_tokens_saved"])
+    count("tokens.context", timings["context_tokens"])
+    count("tokens.context_saved", timings["context_tokens_saved"])
+    return docs
+
+def _chain_llm(qa_chain):
+    """The chat model inside a RetrievalQA "stuff" chain."""
+    return qa_chain.combine_documents_chain.llm_chain.llm
+
+async def _prepare(qa_chain, query, role, session_id):
+    """Condenses the question and checks the answer cache; returns (query, version, cached, query_vector)."""
+    # Condensing and cache lookups touch SQLite and the embeddings client: keep them off the event loop
+    with span("rag.condense") as s:
+        asked = query
+        query = await asyncio.to_thread(condense_query, _chain_llm(qa_chain), session_id, query)
+        s.set(rewritten=query != asked)
+    version = await asyncio.to_thread(index_corpus_version)
+    cached, query_vector = await asyncio.to_thread(_cached_answer, query, role, version)
+    return query, version, cached, query_vector
+
+async def arole_based_query(qa_chain, query, role="Patient", session_id=None):
     """
     Wraps the user query with role-based instructions before sending to the LLM.
-    This acts as a security layer to control data visibility.
+    Retrieval itself is filtered by each chunk's allowed roles, so the prompt rules
+    are a second line of defence rather than the only one.
+    With a `session_id`, follow-up questions are first rewritten into standalone
+    queries using the conversation so far. Identical questions asked concurrently
+    (same role, corpus and wording) share a single LLM call.
     """
     if qa_chain is None:
         return {
-            "result": "No documents found. Admin needs to upload files first.", 
+            "result": NO_DOCUMENTS_MESSAGE,
             "source_documents": []
         }
-    
-    # Augment the prompt with identity-based rules
-    prompt = f"""You are a hospital assistant. User role: {role}
-    Rules:
-    - If Patient: do NOT reveal private medical records of others. Only provide general guidance or specific personal info if available.
-    - If Staff/Admin: provide detailed professional access to records and policies.
-    - Always cite sources if available.
-    
-    Question: {query}"""
-    
-    # Execute the chain and return the answer + source metadata
-    return qa_chain.invoke(prompt)
\ No newline at end of file
+
+    with span("rag.query", role=role, streaming=False):
+        return await _answer(qa_chain, query, role, session_id)
+
+async def _answer(qa_chain, query, role, session_id):
+    query, version, cached, query_vector = await _prepare(qa_chain, query, role, session_id)
+    if cached is not None:
+        return cached
+
+    async def answer():
+        # Retrieve and rerank, then answer with the role-augmented prompt
+        timings = {}
+        prompt = _role_prompt(query, role)
+        docs = await asyncio.to_thread(_retrieve, qa_chain, query, role, timings, query_vector)
+        with span("rag.generate") as s:
+            answer = await qa_chain.combine_documents_chain.ainvoke({"input_documents": docs, "question": prompt})
+        timings["generate_ms"] = s.ms
+        count("tokens.completion", count_tokens(answer["output_text"]))
+        result = {"query": prompt, "result": answer["output_text"], "source_documents": docs, "timings": timings}
+        _answer_cache.put(role, query, version, result, query_vector)
+        return result
+
+    key = (role, normalize_query(query), version)
+    return await get_query_service().single_flight(key, answer)
+
+def role_based_query(qa_chain, query, role="Patient", session_id=None):
+    """Blocking wrapper around arole_based_query, for callers without an event loop."""
+    return get_query_service().run(arole_based_query(qa_chain, query, role, session_id))
+
+async def astream_role_based_query(qa_chain, query, role="Patient", session_id=None):
+    """
+    Streaming variant of arole_based_query. Yields the answer as text tokens while the
+    LLM generates it, then one final dict with "result" and "source_documents".
+    If the same question is already being answered, waits for that answer instead.
+    """
+    if qa_chain is None:
+        yield NO_DOCUMENTS_MESSAGE
+        yield {"result": NO_DOCUMENTS_MESSAGE, "source_documents": []}
+        return
+
+    query, version, cached, query_vector = await _prepare(qa_chain, query, role, session_id)
+    if cached is not None:
+        yield cached["result"]
+        yield cached
+        return
+
+    service = get_query_service()
+    key = (role, normalize_query(query), version)
+    future, leader = service.join(key)
+    if not leader:
+        result = await asyncio.shield(future)
+        yield result["result"]
+        yield result
+        return
+
+    try:
+        # 1. Retrieve and rerank exactly as arole_based_query does
+        timings = {}
+        prompt = _role_prompt(query, role)
+        docs = await asyncio.to_thread(_retrieve, qa_chain, query, role, timings, query_vector)
+
+        # 2. Build the same "stuff" prompt, but stream the LLM instead of waiting for it
+        combine = qa_chain.combine_documents_chain
+        inputs = combine._get_inputs(docs, question=prompt)
+        llm_prompt = combine.llm_chain.prompt.format_prompt(**inputs)
+        parts = []
+        with span("rag.generate", streaming=True) as s:
+            async for chunk in combine.llm_chain.llm.astream(llm_prompt):
+                if chunk.content:
+                    if not parts:
+                        timings["first_token_ms"] = (time.perf_counter() - s.start) * 1000
+                    parts.append(chunk.content)
+                    yield chunk.content
+            s.set(first_token_ms=timings.get("first_token_ms"))
+
+        timings["generate_ms"] = s.ms
+        result = {"query": prompt, "result": "".join(parts), "source_documents": docs, "timings": timings}
+        count("tokens.completion", count_tokens(result["result"]))
+        _answer_cache.put(role, query, version, result, query_vector)
+    except BaseException as e:
+        service.fail(key, e)
+        raise
+    service.finish(key, result)
+    yield result
+
+def stream_role_based_query(qa_chain, query, role="Patient", session_id=None):
+    """Sync generator over astream_role_based_query, for st.write_stream."""
+    return get_query_service().iterate(astream_role_based_query(qa_chain, query, role, session_id))
+
+def refresh_conversation_summary(qa_chain, session_id):
+    """
+    Folds turns that left the verbatim window into the session's rolling summary, in the
+    background. Call it once the answer has been delivered and saved, so the extra LLM
+    call never delays a reply.
+    """
+    if qa_chain is None or session_id is None:
+        return None
+    return start_summary_refresh(_chain_llm(qa_chain), session_id)
+
+def answer_cache_stats():
+    """Hit/miss counters of the answer cache, for the admin sidebar."""
+    return _answer_cache.stats()
\ No newline at end of file
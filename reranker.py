@@ -0,0 +1,129 @@
+import math
+import os
+import time
+
+from hybrid_retriever import reciprocal_rank_fusion
+from lexical_index import tokenize
+from token_utils import count_tokens, truncate_tokens
+
+# Configuration: Over-fetch, rerank, then keep the best chunks that fit a token budget
+# - RERANKER: "lexical" (default, no extra dependencies) or "cross-encoder"
+#   (needs the optional sentence-transformers package; RERANK_MODEL picks the model)
+# - RERANK_BUDGET_MS: hard per-query limit; past it the retrieval order is kept
+# - RERANK_WEIGHT: the scorer's order is fused with the retrieval order (RRF), counting
+#   this much against the retrieval order's 1; 0 keeps the retrieval order. At 0.25 the
+#   lexical scorer never lowered recall@3 below the fused order in
+#   benchmarks/bench_hybrid_recall.py (replacing the order outright cost up to 4 points)
+RERANKER = os.getenv("RERANKER", "lexical")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "30"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "200"))
+RERANK_WEIGHT = float(os.getenv("RERANK_WEIGHT", "0.25"))
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+
+
+class LexicalOverlapScorer:
+    """
+    Cheap default scorer: how much of the question a chunk covers. Longer (more specific)
+    query terms weigh more, and query bigrams found verbatim in the chunk add a bonus,
+    so "discharge form F-102" prefers the chunk that actually says "form F-102".
+    """
+
+    def score(self, query, texts):
+        terms = tokenize(query)
+        weights = {t: math.log(2 + len(t)) for t in terms}
+        bigrams = set(zip(terms, terms[1:]))
+        total = sum(weights.values()) or 1.0
+        scores = []
+        for text in texts:
+            tokens = tokenize(text)
+            present = set(tokens)
+            coverage = sum(w for t, w in weights.items() if t in present) / total
+            phrase = len(bigrams & set(zip(tokens, tokens[1:]))) / len(bigrams) if bigrams else 0.0
+            scores.append(coverage + 0.5 * phrase)
+        return scores
+
+
+class CrossEncoderScorer:
+    """Scores (question, chunk) pairs with a local CPU cross-encoder."""
+
+    def __init__(self, model_name=RERANK_MODEL):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query, texts):
+        return [float(s) for s in self.model.predict([(query, t) for t in texts])]
+
+
+_scorer = None
+
+
+def get_scorer():
+    """Process-wide scorer; falls back to lexical overlap if the cross-encoder can't be loaded."""
+    global _scorer
+    if _scorer is None:
+        if RERANKER == "cross-encoder":
+            try:
+                _scorer = CrossEncoderScorer()
+            except Exception as e:
+                print(f"Cross-encoder unavailable, using lexical reranking: {e}")
+        if _scorer is None:
+            _scorer = LexicalOverlapScorer()
+    return _scorer
+
+
+def rerank(query, docs, scorer=None, top_k=None, budget_ms=RERANK_BUDGET_MS,
+           batch_size=RERANK_BATCH_SIZE, weight=RERANK_WEIGHT, timings=None):
+    """
+    Scores retrieved docs with `scorer` in batches, fuses that order with the retrieval
+    order (reciprocal rank fusion, the scorer counting `weight`) and returns them best
+    first, all of them or the best `top_k`. The scorer refines the fused ranking rather
+    than replacing it.
+    If scoring runs past `budget_ms`, the remaining batches are skipped and the
+    original retrieval order is returned instead, so a slow model never stalls a query.
+    """
+    scorer = scorer or get_scorer()
+    start = time.perf_counter()
+    deadline = start + budget_ms / 1000
+    scores = []
+    fallback = False
+    ranked = list(docs)
+    if weight > 0:
+        for i in range(0, len(docs), batch_size):
+            if time.perf_counter() > deadline:
+                fallback = True
+                break
+            scores.extend(scorer.score(query, [d.page_content for d in docs[i:i + batch_size]]))
+        if not fallback:
+            # Stable sort: ties keep their retrieval order
+            by_score = sorted(range(len(docs)), key=lambda i: -scores[i])
+            order = reciprocal_rank_fusion([range(len(docs)), by_score], weights=[1.0, weight])
+            ranked = [docs[i] for i in order]
+    if timings is not None:
+        timings["rerank_ms"] = (time.perf_counter() - start) * 1000
+        timings["rerank_fallback"] = fallback
+    return ranked[:top_k]
+
+
+def trim_to_budget(docs, max_tokens=CONTEXT_MAX_TOKENS, timings=None):
+    """
+    Keeps docs in rank order while they fit in `max_tokens` of prompt context.
+    The best chunk is always kept (truncated if it alone is over budget).
+    """
+    start = time.perf_counter()
+    kept, used = [], 0
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if used + tokens > max_tokens:
+            if not kept:
+                doc = doc.model_copy(update={"page_content": truncate_tokens(doc.page_content, max_tokens)})
+                kept.append(doc)
+                used = max_tokens
+            break
+        kept.append(doc)
+        used += tokens
+    if timings is not None:
+        timings["trim_ms"] = (time.perf_counter() - start) * 1000
+        timings["context_tokens"] = used
+    return kept
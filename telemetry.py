@@ -0,0 +1,199 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configuration: Latency spans and counters for the hot path
+# - TELEMETRY=off turns recording into a no-op (spans still time themselves for callers)
+# - TELEMETRY_JSONL appends one JSON line per finished span to that file
+# - TELEMETRY_PROMETHEUS_PORT serves the Prometheus text format on http://<addr>:<port>/metrics
+# - TELEMETRY_PROMETHEUS_ADDR is that address: loopback by default, since /metrics has no auth
+#   and reveals usage; set 0.0.0.0 only when the port is firewalled to the scraper
+TELEMETRY_ENABLED = os.getenv("TELEMETRY", "on").lower() not in ("off", "0", "false")
+TELEMETRY_JSONL = os.getenv("TELEMETRY_JSONL", "")
+TELEMETRY_PROMETHEUS_PORT = int(os.getenv("TELEMETRY_PROMETHEUS_PORT", "0"))
+TELEMETRY_PROMETHEUS_ADDR = os.getenv("TELEMETRY_PROMETHEUS_ADDR", "127.0.0.1")
+
+# Percentiles are computed over the most recent samples of each span
+SAMPLES_PER_SPAN = 2048
+PERCENTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_samples = {}    # span name -> deque of durations (ms)
+_counts = {}     # span name -> total spans recorded
+_counters = {}   # counter name -> running total
+_jsonl = None
+_prometheus_server = None
+
+_current = contextvars.ContextVar("telemetry_span", default=None)
+
+
+class Span:
+    """
+    One timed stage. `ms` is available after the block exits. Nested spans share
+    the trace id of the outermost one, so a JSONL trace can be reassembled per request.
+    """
+
+    __slots__ = ("name", "attrs", "trace_id", "span_id", "parent_id", "start", "ms", "_token")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.ms = 0.0
+
+    def __enter__(self):
+        if TELEMETRY_ENABLED:
+            parent = _current.get()
+            self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+            self.parent_id = parent.span_id if parent else None
+            self.span_id = uuid.uuid4().hex[:8]
+            self._token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def set(self, **attrs):
+        """Attaches attributes (token counts, hit/miss, sizes) to the span."""
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.ms = (time.perf_counter() - self.start) * 1000
+        if TELEMETRY_ENABLED:
+            _current.reset(self._token)
+            if exc_type is not None:
+                self.attrs["error"] = exc_type.__name__
+            _record(self)
+        return False
+
+
+def span(name, **attrs):
+    """Context manager timing a stage: `with span("rag.generate") as s: ...`."""
+    return Span(name, attrs)
+
+
+def traced(name):
+    """Decorator form of span() for plain functions."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TELEMETRY_ENABLED:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1):
+    """Adds to a running counter (tokens, cache hits, chunks ingested)."""
+    if TELEMETRY_ENABLED:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def _record(s):
+    with _lock:
+        _samples.setdefault(s.name, deque(maxlen=SAMPLES_PER_SPAN)).append(s.ms)
+        _counts[s.name] = _counts.get(s.name, 0) + 1
+        if TELEMETRY_JSONL:
+            _write_jsonl(s)
+
+
+def _write_jsonl(s):
+    """Appends one span event. Caller holds the lock."""
+    global _jsonl
+    if _jsonl is None:
+        _jsonl = open(TELEMETRY_JSONL, "a", encoding="utf-8", buffering=1)
+    _jsonl.write(json.dumps({
+        "ts": time.time(),
+        "trace": s.trace_id,
+        "span": s.span_id,
+        "parent": s.parent_id,
+        "name": s.name,
+        "ms": round(s.ms, 3),
+        **s.attrs,
+    }, default=str) + "\n")
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summary():
+    """Per-span {count, mean, p50, p95, p99} in ms over recent samples, plus counters."""
+    with _lock:
+        samples = {name: sorted(values) for name, values in _samples.items()}
+        counts = dict(_counts)
+        counters = dict(_counters)
+    spans = {}
+    for name, ordered in sorted(samples.items()):
+        spans[name] = {
+            "count": counts[name],
+            "mean": sum(ordered) / len(ordered),
+            **{f"p{int(q * 100)}": _percentile(ordered, q) for q in PERCENTILES},
+        }
+    return {"spans": spans, "counters": counters}
+
+
+def reset():
+    """Drops every sample and counter (e.g. after a deploy or for a clean benchmark)."""
+    with _lock:
+        _samples.clear()
+        _counts.clear()
+        _counters.clear()
+
+
+def _metric_name(name):
+    return "hka_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text():
+    """Current metrics in the Prometheus text exposition format."""
+    data = summary()
+    lines = []
+    for name, s in data["spans"].items():
+        metric = _metric_name(name) + "_ms"
+        lines.append(f"# TYPE {metric} summary")
+        for q in PERCENTILES:
+            lines.append(f'{metric}{{quantile="{q}"}} {s[f"p{int(q * 100)}"]:.3f}')
+        lines.append(f"{metric}_count {s['count']}")
+    for name, value in sorted(data["counters"].items()):
+        metric = _metric_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def start_prometheus_server(port=TELEMETRY_PROMETHEUS_PORT, addr=TELEMETRY_PROMETHEUS_ADDR):
+    """Serves /metrics from a daemon thread, once per process. Returns the server (or None if disabled)."""
+    global _prometheus_server
+    if not port or not TELEMETRY_ENABLED:
+        return None
+    with _lock:
+        if _prometheus_server is None:  # False after a failed bind: don't retry on every rerun
+            class Handler(BaseHTTPRequestHandler):
+                def log_message(self, *args):
+                    pass
+
+                def do_GET(self):
+                    found = self.path.startswith("/metrics")
+                    body = prometheus_text().encode("utf-8") if found else b"not found\n"
+                    self.send_response(200 if found else 404)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            try:
+                _prometheus_server = ThreadingHTTPServer((addr, port), Handler)
+            except OSError as e:
+                print(f"Metrics endpoint not started on {addr}:{port}: {e}")
+                _prometheus_server = False
+                return None
+            _prometheus_server.daemon_threads = True
+            threading.Thread(target=_prometheus_server.serve_forever, daemon=True).start()
+    return _prometheus_server or None
@@ -0,0 +1,35 @@
+import numpy as np
+
+from answer_cache import AnswerCache
+
+
+def near(vector, cosine):
+    """A unit vector at the given cosine similarity to `vector` (a unit basis vector)."""
+    other = np.zeros_like(vector)
+    other[1] = 1.0
+    return cosine * vector + np.sqrt(1 - cosine ** 2) * other
+
+
+BASE = np.eye(8, dtype=np.float32)[0]
+
+
+def test_rewording_hits_the_semantic_tier():
+    cache = AnswerCache()
+    cache.put("Patient", "What are the visiting hours?", "v1", "answer", BASE)
+    assert cache.get_similar("Patient", "When can I visit?", near(BASE, 0.99), "v1") == "answer"
+
+
+def test_near_miss_paraphrase_does_not_hit():
+    cache = AnswerCache()
+    cache.put("Staff", "What is the maximum daily dose of ibuprofen?", "v1", "ibuprofen", BASE)
+    # Close enough for the old 0.95 threshold, but a different drug
+    assert cache.get_similar("Staff", "What is the maximum daily dose of naproxen?", near(BASE, 0.96), "v1") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_different_numbers_never_share_an_answer():
+    cache = AnswerCache()
+    cache.put("Staff", "Can a patient take 200 mg ibuprofen every 4 hours?", "v1", "200", BASE)
+    assert cache.get_similar("Staff", "Can a patient take 400 mg ibuprofen every 4 hours?", near(BASE, 0.999), "v1") is None
+    assert cache.get_similar("Staff", "Is 200 mg ibuprofen every 4 hours OK for a patient?", near(BASE, 0.99), "v1") == "200"
+    assert cache.get_similar("Staff", "Where is form F-102?", BASE, "v1") is None
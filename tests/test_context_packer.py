@@ -0,0 +1,47 @@
+from langchain_core.documents import Document
+
+from context_packer import pack_context
+from token_utils import count_tokens
+
+WORDS = "admission discharge pharmacy ward theatre radiology outpatient consent".split()
+
+
+def chunk(i, page=None):
+    text = " ".join(f"{WORDS[(i + j) % len(WORDS)]}{i}" for j in range(60))
+    return Document(page_content=text, metadata={"source": "policy.pdf", "page": page if page is not None else i})
+
+
+def test_budget_decides_how_many_passages_go_in():
+    pool = [chunk(i) for i in range(30)]
+    size = count_tokens(pool[0].page_content)
+    for passages in (1, 4, 9):
+        timings = {}
+        packed = pack_context(pool, max_tokens=passages * size + size // 2, timings=timings)
+        assert [d.page_content for d in packed] == [d.page_content for d in pool[:passages]]
+        assert timings["context_tokens"] <= passages * size + size // 2
+        assert timings["context_chunks"] == passages
+
+
+def test_role_budget_applies(monkeypatch):
+    import context_packer
+
+    pool = [chunk(i) for i in range(30)]
+    size = count_tokens(pool[0].page_content)
+    monkeypatch.setitem(context_packer.ROLE_CONTEXT_MAX_TOKENS, "Patient", 2 * size)
+    monkeypatch.setitem(context_packer.ROLE_CONTEXT_MAX_TOKENS, "Staff", 6 * size)
+    assert len(pack_context(pool, "Patient")) == 2
+    assert len(pack_context(pool, "Staff")) == 6
+
+
+def test_overlapping_neighbours_free_budget_for_more_passages():
+    first = chunk(0)
+    # The next chunk of the same page repeats the last 200 characters of the first
+    tail = first.page_content[-200:]
+    second = Document(page_content=tail + " " + chunk(1).page_content, metadata=first.metadata)
+    pool = [first, second] + [chunk(i) for i in range(2, 30)]
+    timings = {}
+    packed = pack_context(pool, max_tokens=4 * count_tokens(first.page_content), timings=timings)
+    assert packed[0].page_content.startswith(first.page_content)
+    assert packed[0].page_content.endswith(chunk(1).page_content)
+    assert timings["chunks_merged"] == 1
+    assert timings["context_tokens_saved"] > 0
@@ -0,0 +1,91 @@
+import pytest
+
+import conversation
+import database
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class RecordingLLM:
+    """Stands in for the chat model: records prompts and answers with a fixed reply."""
+
+    def __init__(self, reply="What is the paracetamol dose for children?"):
+        self.reply = reply
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return FakeMessage(self.reply)
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "users.db"))
+    database.init_db()
+    yield "s1"
+    database.close_connections()
+
+
+def add_turns(session_id, turns):
+    for i in range(turns):
+        database.save_message(session_id, "a@example.com", "user", f"question {i} about paracetamol")
+        database.save_message(session_id, "a@example.com", "assistant", f"answer {i}")
+
+
+@pytest.mark.parametrize("question", [
+    "What is the paracetamol dose for children?",
+    "Which forms do I need before a CT scan?",
+    "How do I request annual leave as a nurse?",
+])
+def test_standalone_questions_skip_the_llm(session, question):
+    add_turns(session, 2)
+    llm = RecordingLLM()
+    assert conversation.condense_query(llm, session, question) == question
+    assert llm.prompts == []
+
+
+@pytest.mark.parametrize("question", [
+    "Is it safe for them?",
+    "and for children?",
+    "What about Ward 3?",
+    "dosage?",
+])
+def test_follow_ups_are_condensed(session, question):
+    add_turns(session, 1)
+    llm = RecordingLLM()
+    assert conversation.condense_query(llm, session, question) == llm.reply
+    assert len(llm.prompts) == 1
+    assert question in llm.prompts[0]
+
+
+def test_condensing_never_summarizes(session):
+    add_turns(session, conversation.HISTORY_TURNS + conversation.SUMMARY_BATCH_TURNS + 2)
+    llm = RecordingLLM()
+    conversation.condense_query(llm, session, "and for children?")
+    assert len(llm.prompts) == 1
+    assert "Follow-up question" in llm.prompts[0]
+    assert database.get_session_summary(session) == ("", 0)
+
+
+def test_refresh_folds_older_turns_into_the_summary(session):
+    add_turns(session, conversation.HISTORY_TURNS + conversation.SUMMARY_BATCH_TURNS)
+    llm = RecordingLLM(reply="Asked about paracetamol.")
+    conversation.start_summary_refresh(llm, session).join()
+    summary, through_id = database.get_session_summary(session)
+    assert summary == "Asked about paracetamol."
+    history = database.get_chat_history(session)
+    assert through_id == history[-2 * conversation.HISTORY_TURNS - 1]["id"]
+
+    # Nothing new has slid out of the window: no second call
+    conversation.refresh_summary(llm, session)
+    assert len(llm.prompts) == 1
+
+
+def test_refresh_waits_for_a_full_batch(session):
+    add_turns(session, conversation.HISTORY_TURNS + conversation.SUMMARY_BATCH_TURNS - 1)
+    llm = RecordingLLM()
+    conversation.refresh_summary(llm, session)
+    assert llm.prompts == []
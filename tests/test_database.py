@@ -0,0 +1,117 @@
+import sqlite3
+import threading
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "users.db"))
+    database.init_db()
+    yield database
+    database.close_connections()
+
+
+def test_init_db_applies_every_migration(db):
+    with db.connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    assert version == len(db.MIGRATIONS)
+
+
+def test_init_db_on_current_schema_skips_the_write_lock(db):
+    # Another connection holds the write lock (e.g. a chat write in another session)
+    writer = sqlite3.connect(db.DB_NAME, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        db.init_db()  # would wait out the busy timeout and fail if it took the lock
+        with db.connection() as conn:
+            assert not conn.in_transaction
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+
+
+def test_init_db_migrates_an_outdated_file(db):
+    with db.connection() as conn:
+        conn.execute("PRAGMA user_version = 3")
+        conn.execute("DROP TABLE rate_buckets")
+    db.init_db()
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'rate_buckets'").fetchone()
+
+
+@pytest.fixture
+def opened(db, monkeypatch):
+    """Records every connection the pool opens."""
+    connections = []
+    open_connection = db._open_connection
+
+    def counting_open():
+        connections.append(open_connection())
+        return connections[-1]
+
+    monkeypatch.setattr(db, "_open_connection", counting_open)
+    return connections
+
+
+def run_in_threads(fn, count, concurrent=1):
+    for first in range(0, count, concurrent):
+        threads = [threading.Thread(target=fn, args=(n,)) for n in range(first, min(first + concurrent, count))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+
+def test_connections_are_reused_across_threads(db, opened):
+    # Streamlit runs every rerun on a new thread
+    def rerun(n):
+        db.get_chat_history("s1", limit=31)
+        db.save_message("s1", "a@example.com", "user", f"message {n}")
+
+    run_in_threads(rerun, 50)
+    assert len(opened) == 0  # served by the connection init_db left in the pool
+    assert len(db.get_chat_history("s1")) == 50
+
+
+def test_pool_keeps_at_most_pool_size_idle_connections(db, opened):
+    barrier = threading.Barrier(db.POOL_SIZE + 4)
+
+    def hold(n):
+        with db.connection():
+            barrier.wait()
+
+    run_in_threads(hold, db.POOL_SIZE + 4, concurrent=db.POOL_SIZE + 4)
+    assert db._pool.qsize() == db.POOL_SIZE
+    assert len(opened) == db.POOL_SIZE + 3  # one of the holders reused init_db's connection
+
+
+def test_nested_use_shares_one_transaction(db):
+    with db.transaction() as outer:
+        outer.execute("INSERT INTO users (email, password, role) VALUES ('x@example.com', '', 'Patient')")
+        db.save_message("s1", "x@example.com", "user", "hi")
+        with db.connection() as conn:
+            assert conn.in_transaction
+            assert conn.execute("SELECT COUNT(*) FROM chat_history").fetchone()[0] == 1
+    with db.connection() as conn:
+        assert not conn.in_transaction
+
+
+def test_a_failed_transaction_returns_a_clean_connection(db):
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction() as c:
+            c.execute("INSERT INTO users (email, password, role) VALUES ('y@example.com', '', 'Staff')")
+            c.execute("INSERT INTO users (email, password, role) VALUES ('y@example.com', '', 'Staff')")
+    assert not db.user_exists("y@example.com")
+    with db.connection() as conn:
+        assert not conn.in_transaction
+
+
+def test_changing_the_database_file_drops_pooled_connections(db, tmp_path, monkeypatch):
+    db.save_message("s1", "a@example.com", "user", "hi")
+    monkeypatch.setattr(db, "DB_NAME", str(tmp_path / "other.db"))
+    db.init_db()
+    assert db.get_chat_history("s1") == []
@@ -0,0 +1,141 @@
+import hashlib
+import sqlite3
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+import embedding_cache
+from embedding_cache import CachedEmbeddings
+
+DIM = 4
+VECTOR_BYTES = DIM * 4  # float32
+
+
+class CountingEmbeddings(Embeddings):
+    """Deterministic local embedder that records every text it is asked to embed."""
+
+    def __init__(self, model="fake-model"):
+        self.model = model
+        self.calls = []
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255 for b in digest[:DIM]]
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return self._vector(text)
+
+    @property
+    def embedded(self):
+        return [t for call in self.calls for t in call]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "embedding_cache.db")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Strictly increasing time, so LRU order never depends on timer resolution."""
+    ticks = iter(range(1, 1_000_000))
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: float(next(ticks)))
+
+
+def test_hits_and_misses_are_counted(db_path):
+    base = CountingEmbeddings()
+    cache = CachedEmbeddings(base, db_path=db_path)
+
+    first = cache.embed_documents(["visiting hours", "parking"])
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    second = cache.embed_documents(["parking", "visiting hours"])
+    assert second == first[::-1]
+    assert cache.embed_query("parking") == first[1]
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert base.embedded == ["visiting hours", "parking"]
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 2 * VECTOR_BYTES
+    assert stats["hit_rate"] == pytest.approx(3 / 5)
+
+
+def test_key_is_model_and_sha256_of_text(db_path):
+    cache = CachedEmbeddings(CountingEmbeddings("model-a"), db_path=db_path)
+    cache.embed_documents(["discharge policy"])
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT model, text_hash FROM embeddings").fetchall()
+    conn.close()
+    assert rows == [("model-a", hashlib.sha256("discharge policy".encode("utf-8")).hexdigest())]
+
+    # Same text, another model: a different key, so it is embedded again
+    other = CountingEmbeddings("model-b")
+    CachedEmbeddings(other, db_path=db_path).embed_documents(["discharge policy"])
+    assert other.embedded == ["discharge policy"]
+
+
+def test_cache_persists_across_instances(db_path):
+    first = CachedEmbeddings(CountingEmbeddings(), db_path=db_path)
+    vector = first.embed_query("pharmacy hours")
+
+    base = CountingEmbeddings()
+    second = CachedEmbeddings(base, db_path=db_path)
+    assert second.embed_query("pharmacy hours") == vector
+    assert base.embedded == []
+    assert (second.hits, second.misses) == (1, 0)
+
+
+def test_repeated_text_in_one_batch_is_embedded_once(db_path):
+    base = CountingEmbeddings()
+    cache = CachedEmbeddings(base, db_path=db_path)
+
+    vectors = cache.embed_documents(["fire exit", "ward b", "fire exit", "fire exit"])
+    assert base.embedded == ["fire exit", "ward b"]
+    assert vectors[0] == vectors[2] == vectors[3]
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert cache.stats()["entries"] == 2
+
+
+def test_miss_returns_what_a_later_hit_returns(db_path):
+    cache = CachedEmbeddings(CountingEmbeddings(), db_path=db_path)
+    missed = cache.embed_query("icu visiting rules")
+    assert cache.embed_query("icu visiting rules") == missed
+
+
+def test_least_recently_used_vectors_are_evicted_over_max_bytes(db_path, clock):
+    base = CountingEmbeddings()
+    cache = CachedEmbeddings(base, db_path=db_path, max_bytes=4 * VECTOR_BYTES)
+    for text in ["a", "b", "c", "d"]:
+        cache.embed_query(text)
+    assert cache.stats()["entries"] == 4
+
+    # "a" is used again, so "b" and "c" are now the least recently used
+    cache.embed_query("a")
+    cache.embed_query("e")
+
+    stats = cache.stats()
+    assert stats["bytes"] <= cache.max_bytes * embedding_cache.EVICT_TO_FRACTION
+    assert stats["entries"] == 3
+
+    base.calls.clear()
+    cache.embed_documents(["a", "d", "e"])
+    assert base.embedded == []
+    cache.embed_documents(["b"])
+    assert base.embedded == ["b"]
+
+
+def test_byte_budget_is_restored_after_reopening(db_path):
+    cache = CachedEmbeddings(CountingEmbeddings(), db_path=db_path)
+    cache.embed_documents(["one", "two", "three"])
+
+    reopened = CachedEmbeddings(CountingEmbeddings(), db_path=db_path, max_bytes=2 * VECTOR_BYTES)
+    assert reopened.stats()["bytes"] == 3 * VECTOR_BYTES
+    reopened.embed_query("four")
+    assert reopened.stats()["bytes"] <= 2 * VECTOR_BYTES * embedding_cache.EVICT_TO_FRACTION
@@ -0,0 +1,69 @@
+import httpx
+import openai
+import pytest
+
+import embedding_pipeline
+from embedding_pipeline import embed_query, embed_texts
+
+
+def api_error(status):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    response = httpx.Response(status, request=request, headers={"retry-after": "0.001"})
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+class FlakyEmbeddings:
+    """Fails with the given errors first, then embeds every text as [len(text)]."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def embed_documents(self, texts):
+        self._call()
+        return [[float(len(t))] for t in texts]
+
+    def embed_query(self, text):
+        self._call()
+        return [float(len(text))]
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+def test_every_batch_retry_passes_the_rate_limiter():
+    embeddings = FlakyEmbeddings([api_error(429), api_error(503)])
+    limiter = CountingLimiter()
+    stats = {}
+    vectors = embed_texts(embeddings, ["a", "bb"], batch_size=2, max_workers=1,
+                          rate_limiter=limiter, stats=stats)
+    assert vectors == [[1.0], [2.0]]
+    assert embeddings.calls == 3
+    assert limiter.acquired == 3
+    assert stats["retries"] == 2
+
+
+def test_client_errors_are_not_retried():
+    embeddings = FlakyEmbeddings([api_error(400)])
+    with pytest.raises(openai.APIStatusError):
+        embed_texts(embeddings, ["a"], max_workers=1, rate_limiter=CountingLimiter())
+    assert embeddings.calls == 1
+
+
+def test_query_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(embedding_pipeline, "BACKOFF_BASE_SECONDS", 0)
+    embeddings = FlakyEmbeddings([api_error(500)] * 5)
+    with pytest.raises(openai.APIStatusError):
+        embed_query(embeddings, "q", max_retries=2)
+    assert embeddings.calls == 3
+    assert embed_query(FlakyEmbeddings([api_error(502)]), "abc") == [3.0]
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+import chunk_store
+import ingest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from pdf_fixtures import write_text_pdf  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_store, "CHUNK_DB", str(tmp_path / "chunks.db"))
+    return tmp_path
+
+
+def records(n, source="a.pdf"):
+    return ({"page_content": f"chunk {i}", "metadata": {"source": source, "page": i}} for i in range(n))
+
+
+def test_append_writes_a_stream_in_batches(store, monkeypatch):
+    monkeypatch.setattr(chunk_store, "INSERT_BATCH_SIZE", 3)
+    assert chunk_store.append_chunks(records(10)) == 10
+    assert [r["page_content"] for r in chunk_store.get_source_chunks("a.pdf")] == [f"chunk {i}" for i in range(10)]
+
+
+def test_source_chunks_stream_in_batches(store):
+    chunk_store.append_chunks(records(7))
+    chunk_store.append_chunks(records(2, source="b.pdf"))
+    batches = list(chunk_store.iter_source_chunks("a.pdf", batch_size=3))
+    assert [len(b) for b in batches] == [3, 3, 1]
+    assert chunk_store.count_source_chunks("a.pdf") == 7
+
+
+def test_process_pdf_returns_the_chunk_count(store):
+    path = str(store / "policy.pdf")
+    write_text_pdf(path, 4, seed=1)
+    n_chunks = ingest.process_pdf(path, allowed_roles=["Staff"])
+    assert isinstance(n_chunks, int) and n_chunks > 0
+    stored = chunk_store.get_source_chunks("policy.pdf")
+    assert len(stored) == n_chunks
+    assert all(r["metadata"]["allowed_roles"] == ["Admin", "Staff"] for r in stored)
+
+    # Re-uploading replaces the file's chunks
+    assert ingest.process_pdf(path) == n_chunks
+    assert chunk_store.count_source_chunks("policy.pdf") == n_chunks
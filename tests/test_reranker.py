@@ -0,0 +1,57 @@
+from langchain_core.documents import Document
+
+from reranker import rerank
+
+
+class FixedScorer:
+    """Scores each chunk by a number looked up from its text."""
+
+    def __init__(self, scores):
+        self.scores = scores
+
+    def score(self, query, texts):
+        return [self.scores[t] for t in texts]
+
+
+def docs(n):
+    return [Document(page_content=f"chunk {i}") for i in range(n)]
+
+
+def contents(ranked):
+    return [d.page_content for d in ranked]
+
+
+def test_scorer_order_is_fused_with_the_retrieval_order():
+    candidates = docs(30)
+    # The scorer prefers the exact reverse of the retrieval order
+    scorer = FixedScorer({d.page_content: i for i, d in enumerate(candidates)})
+    top = contents(rerank("q", candidates, scorer, top_k=3, budget_ms=1e9))
+    # The retrieval order still dominates: the scorer's favourite does not jump to the top
+    assert top[0] == "chunk 0"
+    assert "chunk 29" not in top
+
+
+def test_scorer_reorders_close_candidates():
+    candidates = docs(30)
+    scorer = FixedScorer({d.page_content: 1.0 if d.page_content == "chunk 5" else 0.0 for d in candidates})
+    top = contents(rerank("q", candidates, scorer, top_k=6, budget_ms=1e9, weight=0.25))
+    assert top == ["chunk 0", "chunk 1", "chunk 2", "chunk 3", "chunk 5", "chunk 4"]
+
+
+def test_zero_weight_keeps_the_retrieval_order_without_scoring():
+    class Unused:
+        def score(self, query, texts):
+            raise AssertionError("scorer called")
+
+    timings = {}
+    ranked = rerank("q", docs(5), Unused(), top_k=3, weight=0, timings=timings)
+    assert contents(ranked) == ["chunk 0", "chunk 1", "chunk 2"]
+    assert timings["rerank_fallback"] is False
+
+
+def test_over_budget_falls_back_to_the_retrieval_order():
+    timings = {}
+    scorer = FixedScorer({f"chunk {i}": i for i in range(5)})
+    ranked = rerank("q", docs(5), scorer, top_k=5, budget_ms=-1, timings=timings)
+    assert contents(ranked) == [f"chunk {i}" for i in range(5)]
+    assert timings["rerank_fallback"] is True
@@ -0,0 +1,41 @@
+import tiktoken
+
+# Tokenizer of the chat model (gpt-4o-mini)
+TOKEN_MODEL = "gpt-4o-mini"
+
+# Rough characters-per-token ratio, used if the tokenizer data can't be loaded (e.g. offline)
+FALLBACK_CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """Loads the tokenizer once per process; returns None if it is unavailable."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            _encoding = tiktoken.encoding_for_model(TOKEN_MODEL)
+        except Exception as e:
+            print(f"Tokenizer unavailable, estimating token counts: {e}")
+            _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text):
+    """Number of tokens `text` costs in a prompt."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + FALLBACK_CHARS_PER_TOKEN - 1) // FALLBACK_CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens):
+    """Cuts `text` down to at most `max_tokens` tokens."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * FALLBACK_CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])